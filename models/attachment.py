@@ -0,0 +1,50 @@
+import json
+
+# 附件消息的内容格式：前缀 + JSON 描述，和文本消息一样写入聊天记录
+ATTACHMENT_PREFIX = "ATT1:"
+
+
+class Attachment:
+    def __init__(self, sha256, name, size, width=0, height=0):
+        """
+        一个附件（文件或图片）的描述，文件本身按 sha256 存放在 panel.attachments.AttachmentStore 中
+        :param sha256: 文件内容的 SHA-256（十六进制）
+        :param name: 原文件名
+        :param size: 文件大小，字节
+        :param width: 图片宽度，非图片为 0
+        :param height: 图片高度，非图片为 0
+        """
+        self.sha256 = sha256
+        self.name = name
+        self.size = size
+        self.width = width
+        self.height = height
+
+    @property
+    def is_image(self):
+        return self.width > 0 and self.height > 0
+
+    def to_content(self):
+        """编码为消息内容"""
+        return ATTACHMENT_PREFIX + json.dumps({
+            "sha256": self.sha256,
+            "name": self.name,
+            "size": self.size,
+            "width": self.width,
+            "height": self.height,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_content(cls, content):
+        """从消息内容解析附件，普通文本消息返回 None"""
+        if not isinstance(content, str) or not content.startswith(ATTACHMENT_PREFIX):
+            return None
+        try:
+            fields = json.loads(content[len(ATTACHMENT_PREFIX):])
+            return cls(str(fields["sha256"]), str(fields["name"]), int(fields["size"]),
+                       int(fields.get("width", 0)), int(fields.get("height", 0)))
+        except (ValueError, TypeError, KeyError):
+            return None
+
+    def display_text(self):
+        return f"[{'图片' if self.is_image else '文件'}] {self.name}"
@@ -0,0 +1,19 @@
+from models.attachment import Attachment
+
+
+class ChatMessage:
+    def __init__(self, sender, content, is_me, time, message_id=None):
+        """
+        一条聊天记录
+        :param sender: 发送者用户名
+        :param content: 消息文本；附件消息为 Attachment.to_content() 的结果
+        :param is_me: 是否是自己发送的消息
+        :param time: datetime，发送/接收时间
+        :param message_id: 本地记录 ID，用于分页加载和去重
+        """
+        self.sender = sender
+        self.content = content
+        self.is_me = is_me
+        self.time = time
+        self.message_id = message_id
+        self.attachment = Attachment.from_content(content)
@@ -0,0 +1,217 @@
+import errno
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import tempfile
+
+from PIL import Image, UnidentifiedImageError
+
+from models.attachment import Attachment
+from settings import AttachmentDir, MaxAttachmentSize
+
+
+def _preallocate(fd, size):
+    """预先分配文件空间（避免边写边扩展文件），不支持时只设置文件大小"""
+    if hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError:
+            pass
+    os.ftruncate(fd, size)
+
+
+class AttachmentWriter:
+    """
+    把接收中的附件写入预先分配好大小、内存映射的临时文件，同时计算 SHA-256
+    网络数据可以直接 recv_into 到 view() 返回的缓冲区，不经过中间的 bytes；
+    commit() 校验摘要后移入附件存储；内容已存在时只校验不写盘
+    """
+    SCRATCH_SIZE = 1024 * 1024
+
+    def __init__(self, store, sha256, size):
+        """
+        :param size: 对方声明的附件大小，超过 MaxAttachmentSize 或磁盘剩余空间时抛出异常，不分配文件
+        """
+        if not 0 <= size <= MaxAttachmentSize:
+            raise ValueError(f"附件大小 {size} 字节超出上限 {MaxAttachmentSize} 字节")
+        self._store = store
+        self._expected = sha256
+        self._size = size
+        self._received = 0
+        self._hash = hashlib.sha256()
+        self._map = None
+        self._scratch = None
+        if store.has(sha256):
+            self._file = None  # 同样的内容已存过，不再写盘
+            self._temp_path = None
+        else:
+            if shutil.disk_usage(store.temp_dir).free < size:
+                raise OSError(errno.ENOSPC, f"磁盘空间不足，无法接收 {size} 字节的附件")
+            fd, self._temp_path = tempfile.mkstemp(dir=store.temp_dir)
+            self._file = os.fdopen(fd, "r+b")
+            try:
+                _preallocate(fd, size)
+                if size:
+                    self._map = mmap.mmap(fd, size)
+            except BaseException:
+                self.abort()
+                raise
+
+    def view(self, n):
+        """
+        接下来 n 字节的可写缓冲区：映射到输出文件的对应位置，内容已存在时是一块临时缓冲区
+        填满后调用 advance(n)；用完须 release()（或用 with），否则无法关闭映射
+        """
+        if self._received + n > self._size:
+            raise ValueError(f"附件超出声明的大小 {self._size} 字节")
+        if self._map is not None:
+            return memoryview(self._map)[self._received:self._received + n]
+        if self._scratch is None or len(self._scratch) < n:
+            self._scratch = bytearray(max(n, self.SCRATCH_SIZE))
+        return memoryview(self._scratch)[:n]
+
+    def advance(self, n):
+        """view(n) 已经填满，计入摘要"""
+        with self.view(n) as data:
+            self._hash.update(data)
+        self._received += n
+
+    def write(self, data):
+        with self.view(len(data)) as buf:
+            buf[:] = data
+        self.advance(len(data))
+
+    def commit(self):
+        """接收完毕，返回附件在存储中的路径"""
+        digest = self._hash.hexdigest()
+        if self._received != self._size or digest != self._expected:
+            self.abort()
+            raise ValueError("附件内容与摘要不符")
+        if self._file is not None:
+            self._close()
+            self._store._move_in(self._temp_path, digest)
+        return self._store.path_of(digest)
+
+    def abort(self):
+        if self._file is not None:
+            self._close()
+            try:
+                os.remove(self._temp_path)
+            except OSError:
+                pass
+
+    def _close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self._file = None
+
+
+class AttachmentStore:
+    """
+    内容寻址的附件存储
+    文件按 SHA-256 存放在 objects/<前两位>/<摘要>，同样的内容只存一份；
+    缩略图按 (摘要, 尺寸) 生成后缓存在 thumbs/ 中
+    """
+    CHUNK_SIZE = 1024 * 1024
+    _DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+    def __init__(self, root=AttachmentDir):
+        self.root = root
+        self.temp_dir = os.path.join(root, "tmp")
+        self.thumbs_dir = os.path.join(root, "thumbs")
+        for directory in (self.temp_dir, self.thumbs_dir, os.path.join(root, "objects")):
+            os.makedirs(directory, exist_ok=True)
+
+    def path_of(self, sha256):
+        # 摘要来自对端，必须校验格式，防止拼出存储目录之外的路径
+        if not self._DIGEST.match(sha256):
+            raise ValueError(f"无效的附件摘要: {sha256!r}")
+        return os.path.join(self.root, "objects", sha256[:2], sha256)
+
+    def has(self, sha256):
+        return os.path.exists(self.path_of(sha256))
+
+    def import_file(self, path):
+        """
+        把本地文件存入附件存储（边复制边计算摘要，只读一遍文件）
+        :return: Attachment，图片会带上宽高
+        """
+        size = os.path.getsize(path)
+        if size > MaxAttachmentSize:
+            raise ValueError(f"文件大小 {size} 字节超出附件上限 {MaxAttachmentSize} 字节")
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(dir=self.temp_dir)
+        try:
+            with open(path, "rb") as src, os.fdopen(fd, "wb") as dst:
+                while chunk := src.read(self.CHUNK_SIZE):
+                    digest.update(chunk)
+                    dst.write(chunk)
+            sha256 = digest.hexdigest()
+            self._move_in(temp_path, sha256)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        width, height = self._image_size(self.path_of(sha256))
+        return Attachment(sha256, os.path.basename(path), os.path.getsize(self.path_of(sha256)), width, height)
+
+    def named_path(self, attachment):
+        """
+        带原文件名的路径（硬链接到存储中的文件，不占额外空间），用于交给系统程序打开
+        """
+        directory = os.path.join(self.root, "named", attachment.sha256[:16])
+        path = os.path.join(directory, os.path.basename(attachment.name) or attachment.sha256)
+        if not os.path.exists(path):
+            os.makedirs(directory, exist_ok=True)
+            try:
+                os.link(self.path_of(attachment.sha256), path)
+            except OSError:
+                shutil.copyfile(self.path_of(attachment.sha256), path)
+        return path
+
+    def writer(self, attachment):
+        """接收附件用的写入器"""
+        self.path_of(attachment.sha256)
+        return AttachmentWriter(self, attachment.sha256, attachment.size)
+
+    def _move_in(self, temp_path, sha256):
+        target = self.path_of(sha256)
+        if os.path.exists(target):
+            os.remove(temp_path)  # 去重：同样的内容已存过
+            return
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(temp_path, target)
+
+    @staticmethod
+    def _image_size(path):
+        """图片的宽高（只读文件头），不是图片时返回 (0, 0)"""
+        try:
+            with Image.open(path) as image:
+                return image.size
+        except (UnidentifiedImageError, OSError):
+            return 0, 0
+
+    def thumbnail(self, sha256, max_size):
+        """
+        生成（或取出已缓存的）缩略图，最长边不超过 max_size，不放大
+        耗时较长，应在后台线程中调用
+        :return: 缩略图 PNG 路径
+        """
+        path = os.path.join(self.thumbs_dir, f"{sha256}_{max_size}.png")
+        if os.path.exists(path):
+            return path
+        with Image.open(self.path_of(sha256)) as image:
+            image.draft("RGB", (max_size, max_size))  # JPEG 直接按缩小的尺寸解码
+            image.thumbnail((max_size, max_size))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            fd, temp_path = tempfile.mkstemp(dir=self.temp_dir, suffix=".png")
+            with os.fdopen(fd, "wb") as f:
+                image.save(f, "PNG")
+        os.replace(temp_path, path)
+        return path
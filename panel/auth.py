@@ -1,17 +1,21 @@
 from settings import BaseUrl
 from panel.encrypt import *
 from panel.storage import SecureStorage
-import requests
+from panel.credentials import Credentials
+from panel import session
 
 Url = f"{BaseUrl}/api/auth"
+# 注册/登录不携带共享会话中可能残留的旧 token
+_ANONYMOUS = {"Authorization": None}
 
 def register(username, password,email):
     cryptoManager = CryptoManager()
     public_key, private_key = cryptoManager.get_my_keys()
     
     url = f"{Url}/register/"
-    response = requests.post(
+    response = session.post(
         url,
+        headers=_ANONYMOUS,
         json={
             "username": username,
             "password": sha256(password),
@@ -24,17 +28,18 @@ def register(username, password,email):
     
     storage = SecureStorage()
     storage.save_my_user_id(user_id)
+    Credentials().set_user_id(user_id)
     return data
 
 def login(type,username, password):
     url = f"{Url}/login/"
     if type == "username":
-        response = requests.post(url, json={
+        response = session.post(url, headers=_ANONYMOUS, json={
             "username": username,
             "password": sha256(password)
         })
     elif type == "email":
-        response = requests.post(url, json={
+        response = session.post(url, headers=_ANONYMOUS, json={
             "email": username,
             "password": sha256(password)
         })
@@ -44,19 +49,20 @@ def login(type,username, password):
     token = response.json().get("token")
     if token:
         storage = SecureStorage()
-        user_id = storage.get_my_user_id()
+        user_id = Credentials().get_user_id()
         storage.save_token(user_id, token)
+        Credentials().set(user_id, token)
+        session.set_auth_token(token)
     
     return response.json()
 
 def logout():
     url = f"{Url}/logout/"
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
-    response = requests.post(
-        url,
-        headers=headers,
-    )    
+    if not session.has_auth_token():
+        session.set_auth_token(Credentials().get_token())
+    response = session.post(url)
+    Credentials().clear()
+    session.set_auth_token(None)
     print(response.json())
     return response.json()
 
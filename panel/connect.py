@@ -1,79 +1,153 @@
-from settings import BaseUrl
-import requests
+from settings import BaseUrl, RequestTimeout, NotificationPollTimeout, NotificationMaxBackoff, OfflinePageSize
+from datetime import datetime
+from panel import session
 from panel.encrypt import *
 from panel.storage import SecureStorage
+from panel.credentials import Credentials
+from panel.presence import PresenceCache
+import threading
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
 
 Url = f"{BaseUrl}/api/contact"
-def getlist():
-    url = f"{Url}/getlist/"
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
-    response = requests.get(url, headers=headers)
-    data = response.json()
-    print(data)
 
-    if response.status_code == 200:
+def _ensure_auth():
+    """首次调用时把内存凭据中的 token 安装到共享会话的 Authorization 头"""
+    if not session.has_auth_token():
+        session.set_auth_token(Credentials().get_token())
+
+class _FriendSyncState:
+    """好友列表增量同步的本地状态（按当前用户隔离）"""
+    def __init__(self, user_id=None):
+        self.user_id = user_id
+        self.etag = None
+        self.version = None
+        self.friends = {}       # userid -> 好友字典，保持服务器返回顺序
+        self.public_keys = None # userid -> 已保存的公钥，首次同步时一次性从数据库读出
+
+_friend_sync = _FriendSyncState()
+_friend_sync_lock = threading.Lock()
+
+def sync_friends():
+    """
+    增量同步好友列表
+    请求携带上次的 ETag(If-None-Match) 和版本号(since)：
+      - 304：没有变化
+      - 200 且 incremental 为真：只包含变化的好友和 removed 中被删除的好友 ID
+      - 200 其他情况：完整列表，本地比对得出变化
+    只有公钥变化的好友才会调用 save_key
+    返回 {"message", "friends": 完整列表, "changed": 变化的好友, "removed": 删除的好友 ID}
+    """
+    global _friend_sync
+    with _friend_sync_lock:
+        user_id = Credentials().get_user_id()
+        if _friend_sync.user_id != user_id:
+            _friend_sync = _FriendSyncState(user_id)
+        state = _friend_sync
+
+        headers = {}
+        params = {}
+        if state.etag:
+            headers["If-None-Match"] = state.etag
+        if state.version is not None:
+            params["since"] = state.version
+
+        _ensure_auth()
+        response = session.get(f"{Url}/getlist/", headers=headers, params=params)
+        if response.status_code == 304:
+            PresenceCache().update_from_friends(state.friends.values())
+            return {"message": "好友列表无变化", "friends": list(state.friends.values()), "changed": [], "removed": []}
+
+        data = response.json()
+        if response.status_code != 200:
+            return {"error": "获取好友列表失败", "message": data.get("message", "")}
+
         friends = data.get("friends", [])
+        if data.get("incremental"):
+            changed = [friend for friend in friends if state.friends.get(friend.get("userid")) != friend]
+            removed = [friend_id for friend_id in data.get("removed", []) if friend_id in state.friends]
+        else:
+            new_ids = {friend.get("userid") for friend in friends}
+            changed = [friend for friend in friends if state.friends.get(friend.get("userid")) != friend]
+            removed = [friend_id for friend_id in state.friends if friend_id not in new_ids]
+
         try:
-            for friend in friends:                       # 这些字段都是字典。                                      
-                user_id = friend.get("userid")
-                nickname = friend.get("nickname")
-                username = friend.get("username")
+            storage = SecureStorage()
+            if state.public_keys is None:
+                state.public_keys = storage.get_public_keys()
+            for friend in changed:
+                friend_id = friend.get("userid")
                 user_pk = friend.get("userpk")
-                user_status = friend.get("user_status")
-                user_ipaddr = friend.get("user_ipaddr")
-                user_port = friend.get("user_port")
-
-                storage = SecureStorage()
-                storage.save_key(user_id, user_pk)
-
-                
+                if state.public_keys.get(friend_id) != user_pk:
+                    storage.save_key(friend_id, user_pk)
+                    state.public_keys[friend_id] = user_pk
         except Exception as e:
             return {"error": "获取好友列表失败", "message": str(e)}
-        
-        # 这里是返回值
-        
-        return {"message": "获取好友列表成功", "friends": friends} # friends 是一个 列表，单元是字典，包括以上的字段
-    else:
-        return {"error": "获取好友列表失败", "message": data.get("message", "")}
+
+        if data.get("incremental"):
+            for friend in changed:
+                state.friends[friend.get("userid")] = friend
+            for friend_id in removed:
+                state.friends.pop(friend_id, None)
+        else:
+            state.friends = {friend.get("userid"): friend for friend in friends}
+        state.etag = response.headers.get("ETag")
+        state.version = data.get("version")
+        PresenceCache().update_from_friends(state.friends.values())
+        print(f"[Sync] Friends: {len(changed)} changed, {len(removed)} removed")
+
+        return {
+            "message": "获取好友列表成功",
+            "friends": list(state.friends.values()),
+            "changed": changed,
+            "removed": removed
+        }
+
+def get_cached_friend(user_id):
+    """返回最近一次同步得到的好友字典，未同步过则为 None（不发请求）"""
+    return _friend_sync.friends.get(user_id)
+
+def getlist():
+    """
+    获取完整好友列表（基于 sync_friends 增量同步）
+    friends 是一个列表，单元是字典，包括 userid, nickname, username, userpk,
+    user_status, user_ipaddr, user_port 字段
+    """
+    result = sync_friends()
+    if "error" in result:
+        return result
+    return {"message": "获取好友列表成功", "friends": result["friends"]}
 
 def addfriend(type,str):
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
+    _ensure_auth()
     if type == "username":
-        response = requests.post(f"{Url}/addfriend/", headers=headers, json={"username": str})
+        response = session.post(f"{Url}/addfriend/", json={"username": str})
     elif type == "email":
-        response = requests.post(f"{Url}/addfriend/", headers=headers, json={"email": str})
+        response = session.post(f"{Url}/addfriend/", json={"email": str})
     else:
         return {"error": "参数错误", "message": "type必须是'username'或'email'"}
     return response.json()
 
 def deletefriend(type,str):
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
+    _ensure_auth()
     if type == "username":
-        response = requests.post(f"{Url}/deletefriend/", headers=headers, json={"username": str})
+        response = session.post(f"{Url}/deletefriend/", json={"username": str})
     elif type == "email":
-        response = requests.post(f"{Url}/deletefriend/", headers=headers, json={"email": str})
+        response = session.post(f"{Url}/deletefriend/", json={"email": str})
     else:
         return {"error": "参数错误", "message": "type必须是'username'或'email'"}
     return response.json()
 
 def updateinfo(nickname):
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
-    response = requests.post(f"{Url}/updateinfo/", headers=headers, json={"nickname": nickname})
+    _ensure_auth()
+    response = session.post(f"{Url}/updateinfo/", json={"nickname": nickname})
     return response.json()
 
 def create_friend_request(username):
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
-    response = requests.post(
+    _ensure_auth()
+    response = session.post(
         f"{Url}/createfriendrequest/",
-        headers=headers,
         json={"username": username}
     )
     data = response.json()
@@ -84,11 +158,9 @@ def create_friend_request(username):
         return {"error": "创建好友申请失败", "message": data}
 
 def deal_friend_request(username, action):
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
-    response = requests.post(
+    _ensure_auth()
+    response = session.post(
         f"{Url}/dealfriendrequest/",
-        headers=headers,
         json={
             "username": username,
             "action": action
@@ -103,8 +175,8 @@ def deal_friend_request(username, action):
         
 
 def show_friend_request_list():
-    headers = {"Authorization": f"Token {SecureStorage().get_token(SecureStorage().get_my_user_id())}"}
-    response = requests.get(f"{Url}/showfriendrequestlist/", headers=headers)
+    _ensure_auth()
+    response = session.get(f"{Url}/showfriendrequestlist/")
     data = response.json()
     print(data)
     
@@ -115,8 +187,8 @@ def show_friend_request_list():
 
 
 def show_self_friend_request_list():
-    headers = {"Authorization": f"Token {SecureStorage().get_token(SecureStorage().get_my_user_id())}"}
-    response = requests.get(f"{Url}/showselfrequestlist/", headers=headers)
+    _ensure_auth()
+    response = session.get(f"{Url}/showselfrequestlist/")
     data = response.json()
     
     if response.status_code == 200:
@@ -127,11 +199,10 @@ def show_self_friend_request_list():
 
 def get_user_profile():
     """获取当前用户个人资料"""
-    token = SecureStorage().get_token(SecureStorage().get_my_user_id())
-    headers = {"Authorization": f"Token {token}"}
+    _ensure_auth()
     
     profile_url = f"{Url}/profile/"  # <-- 请根据后端实际接口调整
-    response = requests.get(profile_url, headers=headers)
+    response = session.get(profile_url)
     data = response.json()
 
     if response.status_code == 200:
@@ -146,10 +217,11 @@ def get_user_profile():
             "message": data.get("message", "")
         }
     
-# 获取离线消息不用前端调用，在storage.read_message_with_offline()中调用
+# 获取离线消息不用前端调用，由 sync_offline_inbox() 拉取（storage.read_message_with_offline() 中调用）
+# 旧接口：一次返回全部离线消息，delete_offline_message() 删除全部，只在服务器没有分页接口时使用
 def get_offline_message():
-    headers = {"Authorization": f"Token {SecureStorage().get_token(SecureStorage().get_my_user_id())}"}
-    response = requests.post(f"{Url}/getofflinemessage/", headers=headers)
+    _ensure_auth()
+    response = session.post(f"{Url}/getofflinemessage/")
     data = response.json()
     if response.status_code == 200:
         return data
@@ -157,10 +229,9 @@ def get_offline_message():
         return {"error": "获取离线消息失败", "message": data}
     
 def send_offline_message(recievername, content):
-    headers = {"Authorization": f"Token {SecureStorage().get_token(SecureStorage().get_my_user_id())}"}
-    response = requests.post(
+    _ensure_auth()
+    response = session.post(
         f"{Url}/sendofflinemessage/",
-        headers=headers,
         json={
             "receivername": recievername,
             "content": content
@@ -173,12 +244,258 @@ def send_offline_message(recievername, content):
     else:
         return {"error": "发送离线消息失败", "message": data}
     
+def send_offline_messages(messages):
+    """
+    一次请求批量上传离线消息，可以发给不同的好友
+    :param messages: [{"receivername": ..., "content": ...}, ...]，content 应已用 encrypt_for_friend 加密
+    服务器不支持批量接口（404）时退回逐条按顺序发送，遇到失败即停止，
+    返回的错误中 sent 为已成功发送的前几条消息数，调用方只需重发其余的消息
+    """
+    _ensure_auth()
+    response = session.post(f"{Url}/sendofflinemessages/", json={"messages": messages})
+    if response.status_code == 404:
+        for sent, message in enumerate(messages):
+            try:
+                result = send_offline_message(message["receivername"], message["content"])
+            except Exception as e:
+                result = {"error": "发送离线消息失败", "message": str(e)}
+            if "error" in result:
+                return dict(result, sent=sent)
+        return {"message": "发送成功", "count": len(messages)}
+
+    data = response.json()
+    if response.status_code == 201:
+        return data
+    else:
+        return {"error": "发送离线消息失败", "message": data}
+
 def delete_offline_message():
-    headers = {"Authorization": f"Token {SecureStorage().get_token(SecureStorage().get_my_user_id())}"}
-    response = requests.post(f"{Url}/deleteofflinemessage/", headers=headers)
+    _ensure_auth()
+    response = session.post(f"{Url}/deleteofflinemessage/")
     data = response.json()
     
     if response.status_code == 200:
         return data
     else:
         return {"error": "删除离线消息失败", "message": data}
+
+def fetch_offline_messages(after=None, limit=OfflinePageSize):
+    """
+    分页获取离线消息
+    返回 {"messages": [{"id", "senderid", "sendername", "content", "time"}, ...], "next": 下一页游标或 None}；
+    服务器没有分页接口（404）时返回 None
+    """
+    _ensure_auth()
+    body = {"limit": limit}
+    if after is not None:
+        body["after"] = after
+    response = session.post(f"{Url}/offlinemessages/", json=body)
+    if response.status_code == 404:
+        return None
+    data = response.json()
+
+    if response.status_code == 200:
+        return data
+    else:
+        return {"error": "获取离线消息失败", "message": data}
+
+def ack_offline_messages(message_ids):
+    """确认已保存的离线消息，服务器只删除这些 ID（与 fetch_offline_messages 配套的接口）"""
+    _ensure_auth()
+    response = session.post(f"{Url}/ackofflinemessages/", json={"ids": list(message_ids)})
+    data = response.json()
+
+    if response.status_code == 200:
+        return data
+    else:
+        return {"error": "删除离线消息失败", "message": data}
+
+def _parse_message_time(value):
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except (TypeError, ValueError):
+        return None
+
+def _accept_offline_messages(messages, crypto_manager, name_to_id):
+    """
+    解密一批离线消息，返回 (recv_messages 的行, 对应的消息)
+    没有 ID、找不到发送者或无法解密的消息跳过，不能确认
+    """
+    rows = []
+    accepted = []
+    for message in messages:
+        message_id = message.get("id")
+        if message_id is None:
+            print(f"[Offline] Message from {message.get('sendername')} has no id, skipped")
+            continue
+        sender_id = message.get("senderid") or name_to_id.get(message.get("sendername"))
+        if not sender_id:
+            print(f"[Offline] Unknown sender {message.get('sendername')} of message {message_id}, deferred")
+            continue
+        try:
+            message["content"] = crypto_manager.decrypt_from_friend(message.get("content", ""))
+        except Exception as e:
+            print(f"[Offline] Failed to decrypt message {message_id}, left on server: {e}")
+            continue
+        rows.append((str(message_id), sender_id, message["content"], _parse_message_time(message.get("time"))))
+        accepted.append(message)
+    return rows, accepted
+
+_offline_inbox_lock = threading.Lock()
+
+def sync_offline_inbox(limit=OfflinePageSize):
+    """
+    把服务器上的离线消息逐页合并进本地记录
+    每页先在一个事务中按消息 ID 幂等写入 recv_messages，提交后再确认这一页的 ID；
+    中途失败时未确认的消息留在服务器，下次重新拉取也不会重复保存
+    无法解密或找不到发送者（好友列表还没同步到）的消息不保存也不确认，留在服务器上等下次同步；
+    这里不主动同步好友列表，以免吞掉界面增量刷新要用的变化
+    服务器没有分页接口时退回旧接口：一次取回全部，只有全部保存成功时才删除
+    返回本次新保存的消息列表
+    """
+    with _offline_inbox_lock:
+        storage = SecureStorage()
+        crypto_manager = CryptoManager()
+        name_to_id = {friend.get("username"): friend_id for friend_id, friend in _friend_sync.friends.items()}
+        saved = []
+        after = None
+        while True:
+            page = fetch_offline_messages(after=after, limit=limit)
+            if page is None:
+                saved = _sync_legacy_offline_inbox(storage, crypto_manager, name_to_id)
+                break
+            if "error" in page:
+                raise ConnectionError(page["message"])
+            messages = page.get("messages", [])
+            if not messages:
+                break
+
+            rows, accepted = _accept_offline_messages(messages, crypto_manager, name_to_id)
+            if accepted:
+                inserted = set(storage.save_recv_messages(rows))
+                saved.extend(message for message in accepted if str(message["id"]) in inserted)
+
+                result = ack_offline_messages([message["id"] for message in accepted])
+                if "error" in result:
+                    raise ConnectionError(result["message"])
+
+            after = page.get("next")
+            if after is None:
+                break
+
+        if saved:
+            print(f"[Offline] Merged {len(saved)} offline messages")
+        return saved
+
+def _sync_legacy_offline_inbox(storage, crypto_manager, name_to_id):
+    """旧接口只能删除全部离线消息：有任何一条没有保存时都不删除，等下次同步"""
+    data = get_offline_message()
+    if isinstance(data, dict) and "error" in data:
+        raise ConnectionError(data["message"])
+    messages = data.get("messages", []) if isinstance(data, dict) else data
+    if not messages:
+        return []
+
+    rows, accepted = _accept_offline_messages(messages, crypto_manager, name_to_id)
+    inserted = set(storage.save_recv_messages(rows)) if rows else set()
+    if len(accepted) == len(messages):
+        result = delete_offline_message()
+        if "error" in result:
+            raise ConnectionError(result["message"])
+    else:
+        print(f"[Offline] {len(messages) - len(accepted)} offline messages not saved, keeping the server inbox")
+    return [message for message in accepted if str(message["id"]) in inserted]
+
+class NotificationChannel:
+    """
+    长轮询通知通道
+    后台线程持续请求 notifications 接口，服务器在有新事件或超时后返回；
+    事件批量回调订阅者 callback(events: list[dict])，每个事件形如
+    {"id": ..., "type": EVENT_*, "data": {...}}
+    """
+    EVENT_PRESENCE = "presence"                # data: {"userid", "user_status"}
+    EVENT_FRIEND_REQUEST = "friend_request"    # data: {"username"}
+    EVENT_OFFLINE_MESSAGE = "offline_message"  # data: {"sendername", ...}
+
+    def __init__(self, poll_timeout=NotificationPollTimeout):
+        self._poll_timeout = poll_timeout
+        self._cursor = None
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._connected = threading.Event()
+        self._thread = None
+
+    def subscribe(self, callback):
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止通道（正在挂起的请求返回后线程退出）"""
+        self._stop_event.set()
+        self._connected.clear()
+
+    def is_connected(self):
+        """最近一次轮询是否成功"""
+        return self._connected.is_set()
+
+    def poll_once(self):
+        """执行一次长轮询，返回事件列表"""
+        _ensure_auth()
+        params = {"timeout": self._poll_timeout}
+        if self._cursor is not None:
+            params["cursor"] = self._cursor
+        response = session.get(
+            f"{Url}/notifications/",
+            params=params,
+            timeout=(RequestTimeout[0], self._poll_timeout + RequestTimeout[1])
+        )
+        if response.status_code != 200:
+            raise ConnectionError(f"通知通道请求失败: {response.status_code}")
+        data = response.json()
+        self._cursor = data.get("cursor", self._cursor)
+        return data.get("events", [])
+
+    def _run(self):
+        backoff = 1
+        while not self._stop_event.is_set():
+            try:
+                events = self.poll_once()
+            except Exception as e:
+                self._connected.clear()
+                print(f"[Notify] Poll failed: {e}, retry in {backoff}s")
+                self._stop_event.wait(backoff)
+                backoff = min(backoff * 2, NotificationMaxBackoff)
+                continue
+
+            backoff = 1
+            self._connected.set()
+            if events and not self._stop_event.is_set():
+                self._dispatch(events)
+
+    def _dispatch(self, events):
+        for event in events:
+            if event.get("type") == self.EVENT_PRESENCE:
+                data = event.get("data", {})
+                PresenceCache().set_online(data.get("userid"), data.get("user_status") == "online")
+
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                print(f"[Notify] Subscriber error: {e}")
@@ -0,0 +1,59 @@
+import threading
+
+from panel.Singleton import Singleton
+from panel.storage import SecureStorage
+
+
+class Credentials(Singleton):
+    """
+    内存中的登录凭据（用户 ID + token）
+    login()/register() 写入，logout() 清空；首次读取时才回落到本地数据库加载一次，
+    之后构造请求不再产生任何磁盘 I/O
+    """
+
+    def __init__(self):
+        if self.initialized:
+            return
+        self.initialized = True
+        self._lock = threading.Lock()
+        self._user_id = None
+        self._token = None
+        self._loaded = False
+
+    def _load(self):
+        if self._loaded:
+            return
+        storage = SecureStorage()
+        if self._user_id is None:
+            self._user_id = storage.get_my_user_id()
+        if self._token is None and self._user_id is not None:
+            self._token = storage.get_token(self._user_id)
+        self._loaded = True
+
+    def get_user_id(self):
+        with self._lock:
+            self._load()
+            return self._user_id
+
+    def get_token(self):
+        with self._lock:
+            self._load()
+            return self._token
+
+    def set_user_id(self, user_id):
+        with self._lock:
+            self._user_id = user_id
+            self._token = None
+            self._loaded = True
+
+    def set(self, user_id, token):
+        with self._lock:
+            self._user_id = user_id
+            self._token = token
+            self._loaded = True
+
+    def clear(self):
+        """登出后清空，且不再从数据库回落加载"""
+        with self._lock:
+            self._token = None
+            self._loaded = True
@@ -6,6 +6,10 @@ from Crypto.Util.Padding import pad, unpad
 from panel.Singleton import Singleton
 
 
+# 端到端加密离线消息的格式前缀
+E2E_PREFIX = "E2E1:"
+
+
 def b64encode(data: bytes) -> str:
     return base64.b64encode(data).decode('ascii')
 
@@ -105,6 +109,40 @@ class CryptoManager(Singleton):
             "message_type": "str"
         }
 
+    def aes_encrypt_bytes(self, data: bytes, key_b64: str) -> bytes:
+        """AES CBC 加密字节串，返回 iv + 密文（文件分块传输使用，不做 base64）"""
+        key = b64decode(key_b64)
+        _check_aes_key_len(key)
+
+        iv = os.urandom(16)
+        cipher = AES.new(key, AES.MODE_CBC, iv)
+        return iv + cipher.encrypt(pad(data, AES.block_size))
+
+    def aes_decrypt_bytes(self, data: bytes, key_b64: str) -> bytes:
+        """解密 aes_encrypt_bytes 的结果"""
+        key = b64decode(key_b64)
+        _check_aes_key_len(key)
+
+        cipher = AES.new(key, AES.MODE_CBC, data[:16])
+        return unpad(cipher.decrypt(data[16:]), AES.block_size)
+
+    def encrypt_for_friend(self, content: str, friend_public_key_b64: str) -> str:
+        """
+        混合加密经服务器中转的离线消息：随机 AES 密钥用好友公钥 RSA 加密，内容用 AES 加密
+        返回 "E2E1:<RSA加密的AES密钥>:<AES密文>"，两段均为 base64
+        """
+        res = self.encrypt_session_key_for_friend(friend_public_key_b64)
+        encrypted = self.aes_encrypt_auto(content, res["session_key"])
+        return f"{E2E_PREFIX}{res['encrypted_key']}:{encrypted['encrypted_message']}"
+
+    def decrypt_from_friend(self, envelope: str) -> str:
+        """解密 encrypt_for_friend 生成的离线消息，非加密格式的内容原样返回"""
+        if not envelope.startswith(E2E_PREFIX):
+            return envelope
+        encrypted_key, encrypted_message = envelope[len(E2E_PREFIX):].split(":", 1)
+        session_key = self.decrypt_session_key(encrypted_key)
+        return self.aes_decrypt_auto(encrypted_message, session_key, "str")
+
     def aes_decrypt_auto(self, encrypted_message_b64: str, key_b64: str, message_type: str):
         """
         解密 AES CBC 加密消息，返回字符串（通常是明文）
@@ -162,6 +200,13 @@ def test_p2p_communication():
 
     print("✅ P2P通信测试通过！")
 
+    # Bob 给 Alice 发送端到端加密的离线消息
+    envelope = bob.encrypt_for_friend(plaintext, alice_pub)
+    print("[Bob] 离线消息密文:", envelope[:60] + "...")
+    assert plaintext not in envelope
+    assert alice.decrypt_from_friend(envelope) == plaintext
+    print("✅ 离线消息端到端加密测试通过！")
+
 
 if __name__ == "__main__":
     test_p2p_communication()
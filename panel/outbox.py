@@ -0,0 +1,215 @@
+import threading
+import time
+from collections import OrderedDict
+
+from panel.storage import SecureStorage
+from panel.presence import PresenceCache
+from panel.p2p import P2PEvent
+from panel.encrypt import CryptoManager
+from panel import connect
+from settings import OutboxPollInterval, OutboxAckTimeout, OutboxRetryBase, OutboxRetryMax, OutboxBatchSize
+
+
+class OutboxWorker:
+    """
+    发件箱投递线程（store-and-forward）
+    每条消息先写入 SecureStorage 的 outbox 表，再由本线程按顺序投递：
+      - 好友在线：通过 P2P 会话发出（不等待回执，连续发送），收到回执后标记送达；
+        回执超时则重新投递
+      - 好友离线或 P2P 失败：用好友公钥端到端加密后批量上传离线消息，服务器接收即视为送达
+      - 都失败：指数退避后重试，进程重启后从数据库继续
+    状态变化回调订阅者 callback(outbox_id, state)
+    """
+    EARLY_ACK_LIMIT = 1000  # 最多暂存的未匹配回执数
+
+    def __init__(self, p2p_api=None):
+        self._storage = SecureStorage()
+        self._crypto_manager = CryptoManager()
+        self._p2p_api = p2p_api
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+        # 先于发件箱记录 wire_id 到达的回执 -> 到达时间；重复的回执、重启前发出的消息的回执永远匹配不上，
+        # 超过 OutboxAckTimeout 后在 deliver_due 中丢弃
+        self._early_acks = OrderedDict()
+        if self._p2p_api:
+            self._p2p_api.subscribe(self._on_p2p_events)
+
+    def subscribe(self, callback):
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def enqueue(self, user_id, username, message):
+        """持久化一条待发送消息并唤醒投递线程，返回发件箱 ID"""
+        outbox_id = self._storage.enqueue_outbox(user_id, username, message)
+        self._wake_event.set()
+        return outbox_id
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self._p2p_api:
+            self._p2p_api.unsubscribe(self._on_p2p_events)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wake_event.clear()
+            try:
+                self.deliver_due()
+            except Exception as e:
+                print(f"[Outbox] Delivery error: {e}")
+            self._wake_event.wait(OutboxPollInterval)
+
+    def deliver_due(self):
+        """
+        投递所有到期的消息
+        同一好友的消息保持入队顺序：某条消息投递失败或仍在退避中时，
+        本轮跳过该好友后面的消息（等待回执的消息不阻塞后续发送）；
+        不能走 P2P 的消息（不论发给谁）加密后合并为批量请求上传
+        """
+        now = time.time()
+        self._expire_early_acks(now)
+        blocked = set()
+        offline_users = set()
+        batch = []
+        for entry in self._storage.get_undelivered_outbox():
+            if self._stop_event.is_set():
+                return
+            outbox_id, user_id, username, message, state, attempts, next_attempt = entry
+            if user_id in blocked:
+                continue
+            if next_attempt > now:
+                if state == SecureStorage.OUTBOX_PENDING:
+                    blocked.add(user_id)
+                continue
+            # 已经通过 P2P 发出但回执超时的消息，说明对方可能已掉线，改走离线消息；
+            # 同一好友已有消息走离线消息时，后面的消息也走离线消息
+            if user_id not in offline_users and state != SecureStorage.OUTBOX_SENT \
+                    and self._send_p2p(user_id, outbox_id, message):
+                continue
+            offline_users.add(user_id)
+            batch.append(entry)
+
+        for start in range(0, len(batch), OutboxBatchSize):
+            if not self._upload_offline(batch[start:start + OutboxBatchSize]):
+                # 剩余消息留待下一轮，届时会被退避中的消息阻塞，保证顺序
+                break
+
+    def _upload_offline(self, entries):
+        """把一批消息用各自好友的公钥加密后一次上传，返回是否全部成功（部分成功时只重试其余的消息）"""
+        public_keys = {}
+        messages = []
+        uploading = []
+        for entry in entries:
+            outbox_id, user_id, username, message = entry[:4]
+            if user_id not in public_keys:
+                public_keys[user_id] = self._storage.get_public_key(user_id)
+            if not public_keys[user_id]:
+                print(f"[Outbox] No public key for user {user_id}")
+                self._retry_later(entry)
+                continue
+            messages.append({
+                "receivername": username,
+                "content": self._crypto_manager.encrypt_for_friend(message, public_keys[user_id])
+            })
+            uploading.append(entry)
+
+        if not uploading:
+            return True
+
+        try:
+            result = connect.send_offline_messages(messages)
+        except Exception as e:
+            result = {"error": "发送离线消息失败", "message": str(e)}
+
+        # 逐条发送的退路中途失败时，前 sent 条已经被服务器接收，不能再重发
+        sent = result.get("sent", 0) if "error" in result else len(uploading)
+        for entry in uploading[:sent]:
+            self._set_state(entry[0], SecureStorage.OUTBOX_DELIVERED)
+        if "error" in result:
+            for entry in uploading[sent:]:
+                self._retry_later(entry)
+            return False
+        return True
+
+    def _retry_later(self, entry):
+        outbox_id, attempts = entry[0], entry[5]
+        delay = min(OutboxRetryBase * 2 ** attempts, OutboxRetryMax)
+        print(f"[Outbox] Delivery of {outbox_id} failed, retry in {delay}s")
+        self._storage.update_outbox(outbox_id, SecureStorage.OUTBOX_PENDING,
+                                    next_attempt=time.time() + delay, attempts=attempts + 1)
+
+    def _send_p2p(self, user_id, outbox_id, message):
+        """尝试通过 P2P 发出，成功则等待回执"""
+        if not self._p2p_api or not PresenceCache().is_online(user_id):
+            return False
+
+        if not self._p2p_api.has_session(user_id):
+            # 在后台发起连接，本轮改走离线消息；不在投递线程中等待连接超时，
+            # 一个连不上的好友不会拖住发给其他好友的消息
+            friend = connect.get_cached_friend(user_id) or {}
+            if friend.get("user_ipaddr") and friend.get("user_port"):
+                self._p2p_api.init_session_async(user_id, friend["user_ipaddr"], int(friend["user_port"]))
+            return False
+
+        wire_id = self._p2p_api.send_queued_message(user_id, message)
+        if not wire_id:
+            return False
+        self._storage.update_outbox(outbox_id, SecureStorage.OUTBOX_SENT,
+                                    next_attempt=time.time() + OutboxAckTimeout, wire_id=wire_id)
+        with self._lock:
+            acked = self._early_acks.pop(wire_id, None) is not None
+        if acked:
+            self._set_state(outbox_id, SecureStorage.OUTBOX_DELIVERED)
+        else:
+            self._notify(outbox_id, SecureStorage.OUTBOX_SENT)
+        return True
+
+    def _on_p2p_events(self, events):
+        """P2P 回执：标记送达；会话建立：立即重试积压的消息"""
+        for event in events:
+            if event.event_type == P2PEvent.EVENT_ACK:
+                outbox_id = self._storage.mark_outbox_delivered_by_wire_id(event.data["message_id"])
+                if outbox_id is not None:
+                    self._notify(outbox_id, SecureStorage.OUTBOX_DELIVERED)
+                else:
+                    with self._lock:
+                        self._early_acks[event.data["message_id"]] = time.time()
+                        self._early_acks.move_to_end(event.data["message_id"])
+                        if len(self._early_acks) > self.EARLY_ACK_LIMIT:
+                            self._early_acks.popitem(last=False)
+            elif event.event_type == P2PEvent.EVENT_PRESENCE and event.data["online"]:
+                self._wake_event.set()
+
+    def _expire_early_acks(self, now):
+        with self._lock:
+            while self._early_acks and next(iter(self._early_acks.values())) < now - OutboxAckTimeout:
+                self._early_acks.popitem(last=False)
+
+    def _set_state(self, outbox_id, state):
+        self._storage.update_outbox(outbox_id, state)
+        self._notify(outbox_id, state)
+
+    def _notify(self, outbox_id, state):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            try:
+                callback(outbox_id, state)
+            except Exception as e:
+                print(f"[Outbox] Subscriber error: {e}")
@@ -1,13 +1,31 @@
 from panel.storage import *
 from panel.encrypt import *
 from panel.Singleton import Singleton
+from panel.credentials import Credentials
+from panel.presence import PresenceCache
+from panel.attachments import AttachmentStore
+from models.attachment import Attachment
+from panel.stego import read_strips, StripEmbedder, PngStreamWriter, StegoStreamReceiver
+from panel.send_scheduler import SendScheduler, StreamWindow
+from settings import StegoStripRows, StegoReceiveDir, FileTransferEncrypt, SendRateLimit, PeerSendRateLimit, StreamWindowSize, MaxAttachmentSize
+import os
+import itertools
+import queue
+import mmap
+import sys
 import threading
 import struct
 import socket
 from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime
+import hashlib
 import time
 
 class P2PEndpoint(Singleton):    
+    FILE_CHUNK_SIZE = 256 * 1024  # 发送文件时每帧的字节数
+    ZERO_COPY = True  # 明文附件用 sendfile 发送、recv_into 映射文件接收；False 时走普通读写（对比测试用）
+
     def __init__(self, host, port):
         self._storage = SecureStorage()
         self._crypto_manager = CryptoManager()
@@ -15,10 +33,20 @@ class P2PEndpoint(Singleton):
         self._host = host
         self._port = port
         self._max_connections = 10
-        self.active_connections = {}
-        self.passive_connections = {}
+        self.connections = {}      # user_id -> 与该好友唯一的连接，聊天、传输和控制消息按流复用
+        self._initiators = {}      # 连接 -> 发起连接一方的 user_id
         self.session_keys = {}
         self.handle_threads_is_running = {}
+        self.stego_transfers = {}  # (user_id, 流 ID) -> 正在接收的隐写图片
+        self.file_transfers = {}   # (user_id, 流 ID) -> (Attachment, AttachmentWriter)
+        self.send_windows = {}     # (连接, 流 ID) -> 发送中的批量流的 StreamWindow
+        self._recv_unacked = {}    # (连接, 流 ID) -> 已处理但尚未归还窗口的字节数
+        self._writers = {}         # 连接 -> P2PConnectionWriter，读取线程要回复的帧由它写出
+        self._connecting = set()   # 正在后台发起连接的 user_id
+        self._connecting_lock = threading.Lock()
+        self._stream_ids = itertools.count(P2PMessage.STREAM_FIRST_TRANSFER)
+        self._scheduler = SendScheduler(SendRateLimit, PeerSendRateLimit)
+        self.events = P2PEventDispatcher()
         
     def start_server(self):
         """启动服务器监听线程"""
@@ -31,44 +59,81 @@ class P2PEndpoint(Singleton):
         print(f"[Server] Listening on {self._host}:{self._port}")
 
     def establish_connection(self, user_id, host, port):
-        """发起主动连接并进行密钥交换"""
-        with self._thread_handler.get_connections_lock("active_connections"):
-            if user_id in self.active_connections:
-                print(f"[Connect] Already connected to user {user_id}")
-                return
+        """发起连接并进行密钥交换；与该好友已有连接（包括对方发起的）时直接复用"""
+        if self._conn_of_user(user_id) is not None:
+            print(f"[Connect] Already connected to user {user_id}")
+            return
 
-            try:
-                client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                with self._thread_handler.get_conn_lock(client):
-                    client.connect((host, port))
-                    print(f"[Connect] Connected to {host}:{port}")
-            except Exception as e:
-                print(f"[ERROR] Failed to connect to {host}:{port} - {e}")
+        try:
+            client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            client.connect((host, port))
+            print(f"[Connect] Connected to {host}:{port}")
+        except Exception as e:
+            print(f"[ERROR] Failed to connect to {host}:{port} - {e}")
+            return
+
+        try:
+            print(f"[Connect] Initiating key exchange with user {user_id}")
+            payload, session_key = self._init_key_exchange(user_id)
+            msg = P2PMessage(P2PMessage.MSG_TYPE_KEY_EXCHANGE, self.get_my_user_id(), payload)
+            self._send_bytes(client, msg.to_bytes())
+            future = self._thread_handler.executor.submit(self._recv_key_exchange_ack, client, session_key)
+            if not future.result():
+                print(f"[Connect] Key exchange with user {user_id} failed")
+                client.close()
+            elif not self._register_connection(user_id, client, self.get_my_user_id(), session_key):
+                print(f"[Connect] User {user_id} already connected to us, dropping duplicate connection")
+                client.close()
+            else:
+                print(f"[Connect] Key exchange with user {user_id} completed")
+                self.handle_threads_is_running[client] = True
+                self._thread_handler.executor.submit(self._handle_connection, client, user_id)
+                print(f"[Connect] _handle_connection is running: {self.handle_threads_is_running[client]},target:{host}:{port}")
+        except Exception as e:
+            print(f"[ERROR] Failed during key exchange with user {user_id} - {e}")
+            client.close()
+
+    def establish_connection_async(self, user_id, host, port):
+        """
+        在单独的线程中发起连接，不阻塞调用方；同一好友同时只发起一次
+        连接建立后照常发布 EVENT_PRESENCE
+        """
+        with self._connecting_lock:
+            if user_id in self._connecting or self._conn_of_user(user_id) is not None:
                 return
+            self._connecting.add(user_id)
 
+        def connect():
             try:
-                print(f"[Connect] Initiating key exchange with user {user_id}")
-                payload = self._init_key_exchange(user_id)
-                msg = P2PMessage(P2PMessage.MSG_TYPE_KEY_EXCHANGE, self.get_my_user_id(), payload)
-                with self._thread_handler.get_conn_lock(client):
-                    client.sendall(msg.to_bytes())
-                self.active_connections[user_id] = client
-                future = self._thread_handler.executor.submit(self._recv_key_exchange_ack, client)
-                result = future.result()
-                if result:
-                    print(f"[Connect] Key exchange with user {user_id} completed")
-                    self.handle_threads_is_running[client] = True
-                    self._thread_handler.executor.submit(self._handle_connection, client)      
-                    print(f"[Connect] _handle_connection is running: {self.handle_threads_is_running[client]},target:{host}:{port}")
-                else:
-                    print(f"[Connect] Key exchange with user {user_id} failed")
-                    self.close_active_connection(user_id)
-            except Exception as e:
-                print(f"[ERROR] Failed during key exchange with user {user_id} - {e}")
-                client.close()
-                if user_id in self.active_connections:
-                    del self.active_connections[user_id]
-    
+                self.establish_connection(user_id, host, port)
+            finally:
+                with self._connecting_lock:
+                    self._connecting.discard(user_id)
+
+        threading.Thread(target=connect, daemon=True).start()
+
+    def _register_connection(self, user_id, conn, initiator, session_key):
+        """
+        登记与好友的连接，每个好友只保留一条
+        双方同时发起连接时，两端都保留 user_id 较小的一方发起的那条，另一条关闭；
+        其他情况下新连接替换旧连接（例如对方重启后重新连接）
+        :param initiator: 发起这条连接的一方的 user_id
+        :return: 是否登记成功，False 时调用方应关闭 conn
+        """
+        preferred = min(self.get_my_user_id(), user_id)
+        with self._thread_handler.get_connections_lock("connections"):
+            old = self.connections.get(user_id)
+            if old is not None and old is not conn and initiator != preferred and self._initiators.get(old) == preferred:
+                return False
+            self.connections[user_id] = conn
+            self._initiators[conn] = initiator
+            self.save_session_key(user_id, session_key)
+        if old is not None and old is not conn:
+            print(f"[Connect] Replacing previous connection with user {user_id}")
+            self._close_socket(old)
+        self._publish_presence(user_id, True)
+        return True
+
     def _accept_connections(self):
         print("[Server] Accepting connections...")
         while self.is_running():
@@ -85,25 +150,68 @@ class P2PEndpoint(Singleton):
                 break
         print("[Server] Stopped accepting connections")
 
-    def _handle_connection(self, conn):
-        """处理客户端连接"""
-        user_id = None
+    def _handle_connection(self, conn, user_id=None):
+        """
+        读取一条连接上的所有消息，按消息类型和流分发
+        :param user_id: 主动发起的连接已知对方 ID；对方发起的连接在密钥交换时得知
+        """
         try:
             while self.is_running() and self.handle_threads_is_running[conn]:
                 try:
                     with self._thread_handler.get_conn_lock(conn):
                         conn.settimeout(1.0)
-                        data = P2PMessage.from_socket(conn)
+                        header = P2PMessage.recv_header(conn)
+                        if header is None:
+                            break
+                        if header[0] == P2PMessage.MSG_TYPE_FILE_RAW:
+                            self._recv_file_raw(conn, *header[1:])
+                            self._stream_consumed(conn, header[2], header[3] - P2PMessage.FRAME_SIZE)
+                            continue
+                        data = P2PMessage.recv_payload(conn, *header)
                     if data is None:
                         break
                     user_id = data.my_user_id
                     if data.msg_type == P2PMessage.MSG_TYPE_KEY_EXCHANGE:
                         print(f"[Server] Handling key exchange from {user_id}")
-                        self._handle_key_exchange(user_id, data.payload)
-                        self.passive_connections[user_id] = conn
+                        session_key = self._handle_key_exchange(user_id, data.payload)
+                        if not self._register_connection(user_id, conn, user_id, session_key):
+                            print(f"[Server] Already connected to user {user_id}, dropping duplicate connection")
+                            break
                         self._send_key_exchange_ack(user_id)
                     elif data.msg_type == P2PMessage.MSG_TYPE_TEXT:
-                        self._recv_message(data, conn)
+                        result = self._recv_message(data, conn)
+                        if result:
+                            message_id = data.digest()
+                            self.events.publish(P2PEvent(P2PEvent.EVENT_MESSAGE, user_id, {
+                                "message_id": message_id,
+                                "content": result[1]
+                            }))
+                            self._send_text_ack(conn, message_id)
+                    elif data.msg_type == P2PMessage.MSG_TYPE_LSB:
+                        result = self._recv_stego(data)
+                        self._stream_frame_done(conn, data)
+                        if result:
+                            self.events.publish(P2PEvent(P2PEvent.EVENT_MESSAGE, user_id, {
+                                "message_id": data.digest(),
+                                "content": result[1],
+                                "image_path": result[2]
+                            }))
+                    elif data.msg_type == P2PMessage.MSG_TYPE_FILE:
+                        result = self._recv_file(data)
+                        self._stream_frame_done(conn, data)
+                        if result:
+                            self.events.publish(P2PEvent(P2PEvent.EVENT_MESSAGE, user_id, {
+                                "message_id": data.digest(),
+                                "content": result[1]
+                            }))
+                    elif data.msg_type == P2PMessage.MSG_TYPE_TEXT_ACK:
+                        self.events.publish(P2PEvent(P2PEvent.EVENT_ACK, user_id, {
+                            "message_id": data.payload.decode()
+                        }))
+                    elif data.msg_type == P2PMessage.MSG_TYPE_WINDOW_UPDATE:
+                        window = self.send_windows.get((conn, data.stream_id))
+                        if window is not None:
+                            window.release(struct.unpack(P2PMessage.WINDOW_FORMAT, data.payload)[0])
                     elif data.msg_type == P2PMessage.MSG_TYPE_KEY_EXCHANGE_ACK:
                         print(f"[Server] Received ACK from {user_id}")
                 except socket.timeout:
@@ -115,30 +223,30 @@ class P2PEndpoint(Singleton):
             print(f"[Server] Connection failed: {str(e)}")
         finally:
             if user_id:
-                self.close_passive_connection(user_id)
+                self._drop_connection(user_id, conn)
+            else:
+                self._close_socket(conn)
 
     def _handle_key_exchange(self, user_id, encrypted_session_key_bytes):
         """处理接收到的密钥交换请求"""
         print(f"[Server] Starting decryption of session key for user {user_id}")
         session_key = self._crypto_manager.decrypt_session_key(encrypted_session_key_bytes,message_type="bytes")
         print(f"[Server] Decrypted session key, user_id: {user_id}, lenth: {len(session_key)}")
-        self.save_session_key(user_id, session_key)
         print(f"[Server] Key exchange completed with user {user_id}")
+        return session_key
 
     def _init_key_exchange(self, user_id):
-        """生成新的对称密钥并加密发给好友"""
+        """
+        生成新的对称密钥并用好友公钥加密
+        密钥在连接登记成功后才保存，同时发起的另一条连接被丢弃时不会覆盖正在使用的密钥
+        :return: (发给好友的加密密钥, 会话密钥)
+        """
         public_key = self._storage.get_public_key(user_id)
         if not public_key:
-            print(f"[WARNING] Public key for user {user_id} not found")
-            return None
+            raise ValueError(f"Public key for user {user_id} not found")
 
         res = self._crypto_manager.encrypt_session_key_for_friend(public_key)
-        encrypted_key = res["encrypted_key"]
-        session_key = res["session_key"]
-        print(f"[Server] Cached session key for user {user_id}")
-        self.save_session_key(user_id, session_key)
-        
-        return b64decode(encrypted_key)
+        return b64decode(res["encrypted_key"]), res["session_key"]
 
     @staticmethod
     def _send_handler(func):
@@ -154,7 +262,7 @@ class P2PEndpoint(Singleton):
                 if data:
                     self._storage.save_sent_data(user_id, data)
                   
-                func(self, *args)
+                return func(self, *args)
             except Exception as e:
                 print(f"[Send] Error: {e}")
             finally:
@@ -163,24 +271,222 @@ class P2PEndpoint(Singleton):
     
     @_send_handler
     def send_message(self, user_id:int, content: str):
-        """发送加密文本消息"""
+        """发送加密文本消息并记入已发送消息，返回消息 ID（对方回执中携带同一 ID）"""
+        return self.send_text(user_id, content)
+
+    def send_text(self, user_id:int, content: str):
+        """发送加密文本消息但不写入本地记录（发件箱投递使用），返回消息 ID"""
         session_key = self.get_session_key(user_id)
         if session_key:
             res = self._crypto_manager.aes_encrypt_auto(content, session_key)
             encrypted_message = res["encrypted_message"]
             payload = encrypted_message.encode()
-            msg = P2PMessage(P2PMessage.MSG_TYPE_TEXT, self.get_my_user_id(), payload)
+            msg = P2PMessage(P2PMessage.MSG_TYPE_TEXT, self.get_my_user_id(), payload, P2PMessage.STREAM_CHAT)
             conn = self._conn_of_user(user_id)
             if conn:
-                conn.sendall(msg.to_bytes())
+                self._send_bytes(conn, msg.to_bytes(), SendScheduler.PRIORITY_TEXT)
                 print(f"[Send] Sent message to user {user_id}")
+                return msg.digest()
         else:
             print(f"[Send] No session key for user {user_id}")
+        return None
+
+    @_send_handler
+    def send_file(self, user_id:int, content: str, file_path: str, encrypt: bool = None):
+        """
+        在新的传输流上发送附件（MSG_TYPE_FILE），返回流 ID
+        :param content: Attachment.to_content()，作为首帧发给对方并写入本地记录
+        :param file_path: 文件路径（通常是附件存储中的路径）
+        :param encrypt: 是否每块用会话密钥加密，None 时按 settings.FileTransferEncrypt；
+                        不加密时内容以 MSG_TYPE_FILE_RAW 帧明文零拷贝发送，只适合局域网或本身已加密的内容
+        """
+        if encrypt is None:
+            encrypt = FileTransferEncrypt
+        session_key = self.get_session_key(user_id)
+        conn = self._conn_of_user(user_id)
+        if not session_key or not conn:
+            print(f"[Send] No session with user {user_id}")
+            return None
+
+        stream_id = self._open_stream(conn)
+        try:
+            self._send_stream_frame(conn, P2PMessage.MSG_TYPE_FILE, P2PMessage.FRAME_START, stream_id, content.encode())
+            try:
+                with open(file_path, "rb") as f:
+                    if encrypt:
+                        while chunk := f.read(self._frame_limit()):
+                            encrypted = self._crypto_manager.aes_encrypt_bytes(chunk, session_key)
+                            self._send_stream_frame(conn, P2PMessage.MSG_TYPE_FILE, P2PMessage.FRAME_DATA, stream_id, encrypted)
+                    else:
+                        self._send_raw_file(conn, stream_id, f)
+            except OSError:
+                self._send_stream_frame(conn, P2PMessage.MSG_TYPE_FILE, P2PMessage.FRAME_ABORT, stream_id)
+                raise
+            self._send_stream_frame(conn, P2PMessage.MSG_TYPE_FILE, P2PMessage.FRAME_END, stream_id)
+        finally:
+            self._close_stream(conn, stream_id)
+        print(f"[Send] Sent file {file_path} to user {user_id}")
+        return stream_id
+
+    @_send_handler
+    def send_stego_image(self, user_id: int, content: str, image_path: str):
+        """
+        把文本加密后藏入图片发送（MSG_TYPE_LSB），返回流 ID
+        载体图片按行分块，边嵌入边编码为 PNG 边发送，不在内存中保留完整的编码结果
+        """
+        session_key = self.get_session_key(user_id)
+        conn = self._conn_of_user(user_id)
+        if not session_key or not conn:
+            print(f"[Send] No session with user {user_id}")
+            return None
+
+        payload = self._crypto_manager.aes_encrypt_auto(content, session_key)["encrypted_message"].encode()
+        shape, strips = read_strips(image_path, StegoStripRows)
+        embedder = StripEmbedder(shape, payload)
+        writer = PngStreamWriter(shape)
+
+        def chunks():
+            yield writer.header()
+            for strip in strips:
+                yield writer.write(embedder.embed(strip))
+            yield writer.finish()
+
+        return self._send_stego_stream(conn, user_id, image_path, chunks())
 
     @_send_handler
-    def send_file(self, user_id:int, file_path: str):
-        """发送文件"""
-        pass
+    def send_stego_file(self, user_id: int, content: str, png_path: str):
+        """
+        发送已经藏好内容的 PNG（stego.encode_file 的输出，内容须已用会话密钥加密），返回流 ID
+        :param content: 藏入的明文，只用于写入本地记录
+        """
+        conn = self._conn_of_user(user_id)
+        if not self.get_session_key(user_id) or not conn:
+            print(f"[Send] No session with user {user_id}")
+            return None
+
+        def chunks():
+            with open(png_path, "rb") as f:
+                while chunk := f.read(self.FILE_CHUNK_SIZE):
+                    yield chunk
+
+        return self._send_stego_stream(conn, user_id, png_path, chunks())
+
+    def _send_stego_stream(self, conn: socket.socket, user_id: int, image_path: str, chunks):
+        """在新的传输流上把 PNG 字节流拆成 MSG_TYPE_LSB 帧发送，出错时通知对方放弃"""
+        stream_id = self._open_stream(conn)
+        name = os.path.splitext(os.path.basename(image_path))[0] + ".png"
+        try:
+            self._send_stream_frame(conn, P2PMessage.MSG_TYPE_LSB, P2PMessage.FRAME_START, stream_id, name.encode())
+            try:
+                for chunk in chunks:
+                    # 宽图片的一个分块可能比流的发送窗口还大，拆成不超过半个窗口的帧
+                    with memoryview(chunk) as view:
+                        for offset in range(0, len(view), self._frame_limit()):
+                            self._send_stream_frame(conn, P2PMessage.MSG_TYPE_LSB, P2PMessage.FRAME_DATA, stream_id,
+                                                    bytes(view[offset:offset + self._frame_limit()]))
+            except (ValueError, OSError):
+                self._send_stream_frame(conn, P2PMessage.MSG_TYPE_LSB, P2PMessage.FRAME_ABORT, stream_id)
+                raise
+            self._send_stream_frame(conn, P2PMessage.MSG_TYPE_LSB, P2PMessage.FRAME_END, stream_id)
+        finally:
+            self._close_stream(conn, stream_id)
+        print(f"[Send] Sent stego image {name} to user {user_id}")
+        return stream_id
+
+    def _send_raw_file(self, conn: socket.socket, stream_id: int, f):
+        """
+        把文件内容切成 MSG_TYPE_FILE_RAW 帧明文发送
+        帧头单独写出，内容由 socket.sendfile 交给内核直接从页缓存发送；
+        没有 os.sendfile 的平台改为发送内存映射的切片，同样不复制到用户态缓冲区
+        """
+        size = os.fstat(f.fileno()).st_size
+        mapped = None
+        if self.ZERO_COPY and not hasattr(os, "sendfile") and size:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset in range(0, size, self._frame_limit()):
+                count = min(self._frame_limit(), size - offset)
+                header = P2PMessage.pack_header(P2PMessage.MSG_TYPE_FILE_RAW, self.get_my_user_id(), stream_id, P2PMessage.FRAME_SIZE + count)
+                header += struct.pack(P2PMessage.FRAME_FORMAT, P2PMessage.FRAME_DATA)
+                self.send_windows[(conn, stream_id)].acquire(count)
+                # 帧头和内容分两次写出，作为一帧交给调度器，中间不会插入其他线程的帧
+                self._scheduler.send(conn, len(header) + count, SendScheduler.PRIORITY_BULK,
+                                     partial(self._write_raw_chunk, conn, header, f, mapped, offset, count))
+        finally:
+            if mapped is not None:
+                mapped.close()
+
+    def _write_raw_chunk(self, conn: socket.socket, header: bytes, f, mapped, offset: int, count: int):
+        conn.sendall(header)
+        if mapped is not None:
+            with memoryview(mapped)[offset:offset + count] as view:
+                conn.sendall(view)
+        elif self.ZERO_COPY:
+            if conn.sendfile(f, offset, count) != count:
+                raise ConnectionError("文件在发送过程中被截断，连接上的帧已不完整")
+        else:
+            f.seek(offset)
+            conn.sendall(f.read(count))
+
+    def _send_stream_frame(self, conn: socket.socket, msg_type: int, kind: int, stream_id: int, body: bytes = b""):
+        payload = struct.pack(P2PMessage.FRAME_FORMAT, kind) + body
+        # 数据块占用流的发送窗口，按批量优先级限速发送；开始/结束帧很小，按控制帧发送（同一传输的帧由同一线程依次发出，顺序不变）
+        if kind == P2PMessage.FRAME_DATA:
+            self.send_windows[(conn, stream_id)].acquire(len(body))
+            priority = SendScheduler.PRIORITY_BULK
+        else:
+            priority = SendScheduler.PRIORITY_CONTROL
+        self._send_bytes(conn, P2PMessage(msg_type, self.get_my_user_id(), payload, stream_id).to_bytes(), priority)
+
+    def _frame_limit(self):
+        """传输流上一个数据帧的最大字节数，不超过半个发送窗口，窗口归还一半时就能发出下一帧"""
+        return min(self.FILE_CHUNK_SIZE, StreamWindowSize // 2)
+
+    def _open_stream(self, conn: socket.socket):
+        """分配一个传输流，返回流 ID"""
+        stream_id = next(self._stream_ids)
+        self.send_windows[(conn, stream_id)] = StreamWindow(StreamWindowSize)
+        return stream_id
+
+    def _close_stream(self, conn: socket.socket, stream_id: int):
+        window = self.send_windows.pop((conn, stream_id), None)
+        if window is not None:
+            window.close()
+
+    def _stream_frame_done(self, conn: socket.socket, data):
+        """接收方处理完传输流上的一帧：数据帧计入窗口归还，结束帧清理流的状态"""
+        kind, = struct.unpack_from(P2PMessage.FRAME_FORMAT, data.payload)
+        if kind == P2PMessage.FRAME_DATA:
+            self._stream_consumed(conn, data.stream_id, len(data.payload) - P2PMessage.FRAME_SIZE)
+        elif kind in (P2PMessage.FRAME_END, P2PMessage.FRAME_ABORT):
+            self._recv_unacked.pop((conn, data.stream_id), None)
+
+    def _stream_consumed(self, conn: socket.socket, stream_id: int, size: int):
+        """累计处理完的字节数，满半个窗口时归还给发送方"""
+        key = (conn, stream_id)
+        unacked = self._recv_unacked.get(key, 0) + size
+        if unacked >= StreamWindowSize // 2:
+            msg = P2PMessage(P2PMessage.MSG_TYPE_WINDOW_UPDATE, self.get_my_user_id(),
+                             struct.pack(P2PMessage.WINDOW_FORMAT, unacked), stream_id)
+            self._reply(conn, msg.to_bytes())
+            unacked = 0
+        self._recv_unacked[key] = unacked
+
+    def _reply(self, conn: socket.socket, data: bytes):
+        """
+        读取线程要回复的控制帧（回执、窗口归还）交给该连接的发送线程写出
+        读取线程从不阻塞在写入上：双方都在发送大文件时，两端的读取线程都要继续读，否则会互相等待
+        """
+        if not self.handle_threads_is_running.get(conn):
+            return
+        writer = self._writers.get(conn)
+        if writer is None:
+            writer = self._writers[conn] = P2PConnectionWriter(self, conn)
+        writer.put(data)
+
+    def _send_bytes(self, conn: socket.socket, data: bytes, priority: int = SendScheduler.PRIORITY_CONTROL):
+        """经发送调度器写出完整的一帧：多个线程同时向同一连接发送时不会交错，文本和控制帧优先于批量数据"""
+        self._scheduler.send(conn, len(data), priority, partial(conn.sendall, data))
 
     @_send_handler
     def _send_key_exchange_ack(self, user_id: int):
@@ -198,16 +504,21 @@ class P2PEndpoint(Singleton):
 
         conn = self._conn_of_user(user_id)
         if conn:
-            conn.sendall(msg.to_bytes())
+            self._send_bytes(conn, msg.to_bytes())
             print(f"[Send] Sent key exchange ACK to user {user_id}")
         print(f"[ERROR] No connection found for user {user_id}")
 
+    def _send_text_ack(self, conn: socket.socket, message_id: str):
+        """发送文本消息送达回执，载荷为消息 ID（由连接的发送线程写出）"""
+        msg = P2PMessage(P2PMessage.MSG_TYPE_TEXT_ACK, self.get_my_user_id(), message_id.encode(), P2PMessage.STREAM_CHAT)
+        self._reply(conn, msg.to_bytes())
+
+    def _publish_presence(self, user_id, online: bool):
+        PresenceCache().mark_session(user_id, online)
+        self.events.publish(P2PEvent(P2PEvent.EVENT_PRESENCE, user_id, {"online": online}))
+
     def _conn_of_user(self, user_id):
-        if user_id in self.active_connections:
-            return self.active_connections[user_id]
-        if user_id in self.passive_connections:
-            return self.passive_connections[user_id]
-        return None
+        return self.connections.get(user_id)
     
     @staticmethod
     def _recv_handler(func):
@@ -246,13 +557,133 @@ class P2PEndpoint(Singleton):
         return user_id, msg
 
     @_recv_handler
-    def _recv_file(self, data, conn: socket.socket) -> tuple[int, str]:
-        """接收文件"""
-        pass
+    def _recv_file(self, data) -> tuple[int, str]:
+        """
+        接收附件的一帧：解密后写入附件存储，边收边计算 SHA-256
+        最后一帧到达时校验摘要，返回 (user_id, 附件消息内容)；传输未结束时返回 None
+        """
+        user_id = data.my_user_id
+        kind, = struct.unpack_from(P2PMessage.FRAME_FORMAT, data.payload)
+        stream_id = data.stream_id
+        body = data.payload[P2PMessage.FRAME_SIZE:]
+        key = (user_id, stream_id)
+
+        if kind == P2PMessage.FRAME_START:
+            attachment = Attachment.from_content(body.decode(errors="replace"))
+            if attachment is None:
+                raise ValueError(f"Invalid attachment header from user {user_id}")
+            self.file_transfers[key] = (attachment, AttachmentStore().writer(attachment))
+            return None
+
+        if key not in self.file_transfers:
+            print(f"[Recv] Unknown file transfer {stream_id} from user {user_id}")
+            return None
+        attachment, writer = self.file_transfers[key]
+        try:
+            if kind == P2PMessage.FRAME_DATA:
+                session_key = self.get_session_key(user_id)
+                if not session_key:
+                    raise ValueError(f"No session key for user {user_id}")
+                writer.write(self._crypto_manager.aes_decrypt_bytes(body, session_key))
+                return None
+            del self.file_transfers[key]
+            if kind == P2PMessage.FRAME_ABORT:
+                writer.abort()
+                print(f"[Recv] File transfer {stream_id} aborted by user {user_id}")
+                return None
+            writer.commit()
+            print(f"[Recv] File {attachment.name} from user {user_id}")
+            return user_id, attachment.to_content()
+        except Exception:
+            self.file_transfers.pop(key, None)
+            writer.abort()
+            raise
     
+    def _recv_file_raw(self, conn: socket.socket, user_id: int, stream_id: int, length: int):
+        """
+        接收一块明文附件内容（MSG_TYPE_FILE_RAW）：直接 recv_into 到附件的内存映射输出文件
+        传输无效时仍读完这一帧，保持连接上的帧边界
+        """
+        frame = P2PMessage._recv_exact(conn, P2PMessage.FRAME_SIZE)
+        if frame is None:
+            raise ConnectionError("Connection closed")
+        count = length - P2PMessage.FRAME_SIZE
+        key = (user_id, stream_id)
+        if key not in self.file_transfers:
+            print(f"[Recv] Unknown file transfer {stream_id} from user {user_id}")
+            P2PMessage.skip(conn, count)
+            return
+        writer = self.file_transfers[key][1]
+        try:
+            if self.ZERO_COPY:
+                with writer.view(count) as buf:
+                    P2PMessage.recv_into(conn, buf)
+                writer.advance(count)
+            else:
+                body = P2PMessage._recv_exact(conn, count)
+                if body is None:
+                    raise ConnectionError("Connection closed")
+                writer.write(body)
+        except ValueError as e:
+            print(f"[Recv] File transfer {stream_id} from user {user_id} dropped: {e}")
+            del self.file_transfers[key]
+            writer.abort()
+            P2PMessage.skip(conn, count)
+
     @_recv_handler
-    def _recv_key_exchange_ack(self, conn: socket.socket, limit=5) -> bool:
-        """接收密钥交换确认"""
+    def _recv_stego(self, data) -> tuple[int, str, str]:
+        """
+        接收隐写图片的一帧：图片边接收边写入文件，同时逐块提取载荷
+        最后一帧到达时解密出文本，返回 (user_id, 文本, 图片路径)；传输未结束时返回 None
+        """
+        user_id = data.my_user_id
+        kind, = struct.unpack_from(P2PMessage.FRAME_FORMAT, data.payload)
+        stream_id = data.stream_id
+        body = data.payload[P2PMessage.FRAME_SIZE:]
+        key = (user_id, stream_id)
+
+        if kind == P2PMessage.FRAME_START:
+            name = os.path.splitext(os.path.basename(body.decode(errors="replace")))[0] or "image"
+            os.makedirs(StegoReceiveDir, exist_ok=True)
+            path = os.path.join(StegoReceiveDir, f"{user_id}_{os.urandom(4).hex()}_{name}.png")
+            self.stego_transfers[key] = StegoStreamReceiver(path, StegoStripRows, MaxAttachmentSize)
+            return None
+
+        receiver = self.stego_transfers.get(key)
+        if receiver is None:
+            print(f"[Recv] Unknown stego transfer {stream_id} from user {user_id}")
+            return None
+        try:
+            if kind == P2PMessage.FRAME_DATA:
+                receiver.feed(body)
+                return None
+            del self.stego_transfers[key]
+            if kind == P2PMessage.FRAME_ABORT:
+                receiver.abort()
+                print(f"[Recv] Stego transfer {stream_id} aborted by user {user_id}")
+                return None
+            session_key = self.get_session_key(user_id)
+            if not session_key:
+                raise ValueError(f"No session key for user {user_id}")
+            payload = receiver.finish()
+            content = self._crypto_manager.aes_decrypt_auto(payload.decode("ascii"), session_key, "str")
+            print(f"[Recv] Stego image from user {user_id}: {receiver.path}")
+            return user_id, content, receiver.path
+        except Exception:
+            self.stego_transfers.pop(key, None)
+            receiver.abort()
+            raise
+
+    def _abort_transfers(self, user_id):
+        """连接断开时丢弃该用户未完成的隐写图片和附件"""
+        for key in [key for key in self.stego_transfers if key[0] == user_id]:
+            self.stego_transfers.pop(key).abort()
+        for key in [key for key in self.file_transfers if key[0] == user_id]:
+            self.file_transfers.pop(key)[1].abort()
+
+    @_recv_handler
+    def _recv_key_exchange_ack(self, conn: socket.socket, session_key: str, limit=5) -> bool:
+        """接收密钥交换确认，用这条连接上刚发出的会话密钥解密"""
         conn_lock = self._thread_handler.get_conn_lock(conn)
         if not conn_lock.acquire(timeout=limit):
             print("[Sever] Failed to acquire connection lock")
@@ -261,11 +692,6 @@ class P2PEndpoint(Singleton):
         try:
             def _check_key_exchange_ack(data: P2PMessage) -> bool:
                 user_id = data.my_user_id
-                session_key = self.get_session_key(user_id)
-                if not session_key:
-                    print(f"[ERROR] No session key available for user {user_id}")
-                    return False
-                
                 encrypted_payload_b64 = data.payload.decode()
                 msg = self._crypto_manager.aes_decrypt_auto(encrypted_payload_b64, session_key, "str")
                 expected = "Your user id is " + str(self.get_my_user_id())
@@ -294,7 +720,7 @@ class P2PEndpoint(Singleton):
     def get_my_user_id(self):
         """获取本地用户 ID"""
         if not hasattr(self, "my_user_id") or self.my_user_id is None:
-            self.my_user_id = self._storage.get_my_user_id()
+            self.my_user_id = Credentials().get_user_id()
         return self.my_user_id
 
     def close_server_and_connections(self):
@@ -302,37 +728,51 @@ class P2PEndpoint(Singleton):
         self._thread_handler.stop_event.set()
         self.server.close()
 
-        for user_id in list(self.passive_connections.keys()):
-            self.close_passive_connection(user_id)
-        
-        for user_id in list(self.active_connections.keys()):
-            self.close_active_connection(user_id)
+        for user_id in list(self.connections.keys()):
+            self.close_connection(user_id)
             
+        self.events.close()
         self._thread_handler.executor.shutdown(wait=True)
         print("[Close] Server and all connections closed.")
 
-    def close_passive_connection(self, user_id):
+    def close_connection(self, user_id):
         """关闭与特定用户的连接"""
-        if user_id in self.passive_connections:
-            with self._thread_handler.get_connections_lock("passive_connections"):
-                with self._thread_handler.get_conn_lock(self.passive_connections[user_id]):
-                    conn = self.passive_connections.pop(user_id)
-                    self.handle_threads_is_running[conn] = False
-                    print(f"[Server] _handle_connection {user_id} is running: {self.handle_threads_is_running[conn]}")
-                    conn.close()
-                    self._storage.remove_session_key(user_id)
-                    print(f"[Close] Closed passive connection with user {user_id}")
-             
-    def close_active_connection(self, user_id):
-        if user_id in self.active_connections:
-            with self._thread_handler.get_connections_lock("active_connections"):
-                with self._thread_handler.get_conn_lock(self.active_connections[user_id]):
-                    conn = self.active_connections.pop(user_id)
-                    self.handle_threads_is_running[conn] = False
-                    print(f"[Server] _handle_connection {user_id} is running: {self.handle_threads_is_running[conn]}")
-                    conn.close()
-                    self._storage.remove_session_key(user_id)
-                    print(f"[Close] Closed active connection with user {user_id}")
+        conn = self._conn_of_user(user_id)
+        if conn is not None:
+            self._drop_connection(user_id, conn)
+
+    def _drop_connection(self, user_id, conn):
+        """关闭连接；conn 是该用户当前的连接时一并清理会话密钥、未完成的传输和在线状态"""
+        with self._thread_handler.get_connections_lock("connections"):
+            current = self.connections.get(user_id) is conn
+            if current:
+                del self.connections[user_id]
+                self.remove_session_key(user_id)
+        self._close_socket(conn)
+        if current:
+            print(f"[Close] Closed connection with user {user_id}")
+            self._abort_transfers(user_id)
+            self._publish_presence(user_id, False)
+
+    def _close_socket(self, conn):
+        """停止连接的读取线程，唤醒等待窗口的发送方，关闭 socket"""
+        self.handle_threads_is_running[conn] = False
+        self._initiators.pop(conn, None)
+        writer = self._writers.pop(conn, None)
+        if writer is not None:
+            writer.close()
+        self._scheduler.forget(conn)
+        for key in [key for key in list(self.send_windows) if key[0] is conn]:
+            window = self.send_windows.pop(key, None)
+            if window is not None:
+                window.close()
+        for key in [key for key in list(self._recv_unacked) if key[0] is conn]:
+            self._recv_unacked.pop(key, None)
+        try:
+            conn.shutdown(socket.SHUT_RDWR)  # 让阻塞在 recv 中的读取线程立即返回
+        except OSError:
+            pass
+        conn.close()
 
     def get_session_key(self, user_id):
         if user_id in self.session_keys:
@@ -353,34 +793,93 @@ class P2PEndpoint(Singleton):
         return self._thread_handler
         
 class P2PMessage:
-    HEADER_FORMAT = '!BII'
+    HEADER_FORMAT = '!BIII'  # 消息类型, 发送方 user_id, 流 ID, 载荷长度
     HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
 
+    # 每个好友只有一条连接，不同用途的消息按流区分
+    STREAM_CONTROL = 0         # 密钥交换及其确认
+    STREAM_CHAT = 1            # 文本消息及回执
+    STREAM_FIRST_TRANSFER = 2  # 此后的流 ID 由发送方分配给每次附件、隐写图片传输，受流量控制
+
     MSG_TYPE_TEXT = 1
     MSG_TYPE_KEY_EXCHANGE = 2
     MSG_TYPE_KEY_EXCHANGE_ACK = 3
     MSG_TYPE_FILE = 4
     MSG_TYPE_LSB = 5
+    MSG_TYPE_TEXT_ACK = 6
+    MSG_TYPE_FILE_RAW = 7  # 不加密传输的附件内容：FRAME_DATA 帧头 + 明文，接收端直接读入输出文件
+    MSG_TYPE_WINDOW_UPDATE = 8  # 接收方归还流的发送窗口，流 ID 为对方发出的传输流
+
+    WINDOW_FORMAT = '!I'  # MSG_TYPE_WINDOW_UPDATE 的载荷：归还的字节数
+
+    # MSG_TYPE_LSB / MSG_TYPE_FILE 的载荷：帧类型 + 内容，一个文件拆成同一个流上的多帧发送
+    FRAME_FORMAT = '!B'
+    FRAME_SIZE = struct.calcsize(FRAME_FORMAT)
+    FRAME_START = 0   # 隐写图片：文件名；附件：Attachment.to_content()
+    FRAME_DATA = 1    # 隐写图片：一段 PNG 字节流；附件：一块用会话密钥加密的文件内容
+    FRAME_END = 2
+    FRAME_ABORT = 3   # 发送端出错，放弃本次传输
     
-    def __init__(self, msg_type: int, my_user_id: int, payload: bytes):
+    def __init__(self, msg_type: int, my_user_id: int, payload: bytes, stream_id: int = STREAM_CONTROL):
         self.msg_type = msg_type
         self.my_user_id = my_user_id
         self.payload = payload
+        self.stream_id = stream_id
+
+    def digest(self) -> str:
+        """消息 ID：密文载荷的 SHA-256 摘要（随机 IV 保证唯一）"""
+        return hashlib.sha256(self.payload).hexdigest()[:32]
 
     def to_bytes(self) -> bytes:
-        header = struct.pack(self.HEADER_FORMAT, self.msg_type, self.my_user_id, len(self.payload))
-        return header + self.payload
+        return self.pack_header(self.msg_type, self.my_user_id, self.stream_id, len(self.payload)) + self.payload
+
+    @classmethod
+    def pack_header(cls, msg_type: int, my_user_id: int, stream_id: int, length: int) -> bytes:
+        return struct.pack(cls.HEADER_FORMAT, msg_type, my_user_id, stream_id, length)
 
     @classmethod
     def from_socket(cls, conn: socket.socket):
+        header = cls.recv_header(conn)
+        if not header:
+            return None
+        return cls.recv_payload(conn, *header)
+
+    @classmethod
+    def recv_header(cls, conn: socket.socket):
+        """读取消息头，返回 (msg_type, my_user_id, 流 ID, 载荷长度)，连接关闭时返回 None"""
         header = cls._recv_exact(conn, cls.HEADER_SIZE)
         if not header:
             return None
-        msg_type, my_user_id, length = struct.unpack(cls.HEADER_FORMAT, header)
+        return struct.unpack(cls.HEADER_FORMAT, header)
+
+    @classmethod
+    def recv_payload(cls, conn: socket.socket, msg_type: int, my_user_id: int, stream_id: int, length: int):
         payload = cls._recv_exact(conn, length)
         if not payload:
             return None
-        return cls(msg_type, my_user_id, payload)
+        return cls(msg_type, my_user_id, payload, stream_id)
+
+    @staticmethod
+    def recv_into(conn: socket.socket, view: memoryview):
+        """把数据直接读满 view（例如内存映射的文件），大块数据读取期间的超时不打断这一帧"""
+        received = 0
+        while received < len(view):
+            try:
+                n = conn.recv_into(view[received:])
+            except socket.timeout:
+                continue
+            if not n:
+                raise ConnectionError("Connection closed")
+            received += n
+
+    @classmethod
+    def skip(cls, conn: socket.socket, size: int):
+        """丢弃 size 字节"""
+        with memoryview(bytearray(min(size, 1024 * 1024))) as buf:
+            while size > 0:
+                part = buf[:min(size, len(buf))]
+                cls.recv_into(conn, part)
+                size -= len(part)
 
     @staticmethod
     def _recv_exact(conn: socket.socket, size):
@@ -392,6 +891,101 @@ class P2PMessage:
             buf += part
         return buf
 
+class P2PEvent:
+    """P2P 层推送给上层（GUI）的事件"""
+    EVENT_MESSAGE = "message"    # data: {"message_id", "content"}
+    EVENT_ACK = "ack"            # data: {"message_id"}
+    EVENT_PRESENCE = "presence"  # data: {"online"}
+
+    def __init__(self, event_type: str, user_id: int, data: dict = None):
+        self.event_type = event_type
+        self.user_id = user_id
+        self.data = data or {}
+        self.timestamp = datetime.now()
+
+    def __repr__(self):
+        return f"P2PEvent({self.event_type}, user={self.user_id}, {self.data})"
+
+
+class P2PEventDispatcher:
+    """
+    线程安全的事件分发器
+    网络线程调用 publish() 入队，batch_interval 内的事件合并为一批，
+    由定时线程统一回调订阅者 callback(events: list[P2PEvent])
+    """
+    def __init__(self, batch_interval=0.05):
+        self._batch_interval = batch_interval
+        self._subscribers = []
+        self._pending = []
+        self._lock = threading.Lock()
+        self._timer = None
+
+    def subscribe(self, callback):
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def publish(self, event: P2PEvent):
+        with self._lock:
+            self._pending.append(event)
+            if self._timer is None:
+                self._timer = threading.Timer(self._batch_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """立即投递所有待发事件"""
+        with self._lock:
+            events, self._pending = self._pending, []
+            subscribers = list(self._subscribers)
+            self._timer = None
+        if not events:
+            return
+        for callback in subscribers:
+            try:
+                callback(events)
+            except Exception as e:
+                print(f"[Event] Subscriber error: {e}")
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+        self.flush()
+
+
+class P2PConnectionWriter:
+    """
+    一条连接专用的发送线程，写出读取线程要回复的控制帧
+    不占用 P2PThreadHandler 的线程池：那里的线程被各连接的读取循环长期占用，好友多时排队的回复永远轮不到
+    """
+    def __init__(self, endpoint, conn):
+        self._endpoint = endpoint
+        self._conn = conn
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def put(self, data: bytes):
+        self._queue.put(data)
+
+    def close(self):
+        self._queue.put(None)
+
+    def _run(self):
+        while (data := self._queue.get()) is not None:
+            try:
+                self._endpoint._send_bytes(self._conn, data)
+            except OSError as e:
+                print(f"[Send] Failed to send control frame: {e}")
+                return
+
+
 class P2PThreadHandler(Singleton):
     def __init__(self, max_workers=14):
         self.conn_lock_map = {}
@@ -423,6 +1017,10 @@ class P2PAPI(Singleton):
     
     def init_session(self, user_id, peer_ip, peer_port):
         return self.end_point.establish_connection(user_id, peer_ip, peer_port)
+
+    def init_session_async(self, user_id, peer_ip, peer_port):
+        """在后台建立会话，建立后通过 EVENT_PRESENCE 通知订阅者"""
+        self.end_point.establish_connection_async(user_id, peer_ip, peer_port)
     
     def _run(self):
         try:
@@ -437,13 +1035,56 @@ class P2PAPI(Singleton):
         if msg_type == "text":
             return self.end_point.send_message(user_id, msg)
         elif msg_type == "file":
-            return self.end_point.send_file(user_id, msg)
+            store = AttachmentStore()
+            attachment = store.import_file(msg)
+            return self.end_point.send_file(user_id, attachment.to_content(), store.path_of(attachment.sha256))
         else:
             raise Exception("Invalid message type")
         
+    def send_file(self, user_id, content, file_path, encrypt=None):
+        """
+        发送已存入附件存储的文件，返回传输 ID，未发出时返回 None
+        :param encrypt: 是否用会话密钥加密内容，None 时按 settings.FileTransferEncrypt
+        """
+        return self.end_point.send_file(user_id, content, file_path, encrypt)
+
+    def send_stego_image(self, user_id, msg, image_path):
+        """把文本藏入图片发送给好友，返回传输 ID，未发出时返回 None"""
+        return self.end_point.send_stego_image(user_id, msg, image_path)
+
+    def send_stego_file(self, user_id, msg, png_path):
+        """发送已在进程池中生成好的隐写图片，返回传输 ID，未发出时返回 None"""
+        return self.end_point.send_stego_file(user_id, msg, png_path)
+
+    def get_session_key(self, user_id):
+        """与好友当前 P2P 会话的 AES 密钥（base64），没有会话时返回 None"""
+        if not self.has_session(user_id):
+            return None
+        return self.end_point.get_session_key(user_id)
+
+    def send_queued_message(self, user_id, msg):
+        """投递发件箱中的文本消息（已在入队时记录），返回消息 ID，未发出时返回 None"""
+        try:
+            return self.end_point.send_text(user_id, msg)
+        except OSError as e:
+            print(f"[API] Send failed: {e}")
+            return None
+
+    def subscribe(self, callback):
+        """
+        订阅 P2P 事件（收到的消息、送达回执、在线状态变化）
+        :param callback: callback(events: list[P2PEvent])，在 P2P 事件线程中批量调用
+        """
+        self.end_point.events.subscribe(callback)
+
+    def unsubscribe(self, callback):
+        self.end_point.events.unsubscribe(callback)
+
+    def has_session(self, user_id):
+        return self.end_point._conn_of_user(user_id) is not None
+
     def exit_session(self, user_id):
-        self.end_point.close_passive_connection(user_id)
-        self.end_point.close_active_connection(user_id)
+        self.end_point.close_connection(user_id)
 
     def close(self):
         self.end_point.close_server_and_connections()
@@ -468,6 +1109,68 @@ class P2PAPI(Singleton):
     def get_storage(self):
         return self.end_point._storage
     
+def _benchmark_file_transfer(size=256 * 1024 * 1024):
+    """
+    对比附件三种发送方式在本机 socketpair 上每 GB 消耗的 CPU 时间（发送和接收两端合计，
+    process_time 统计本进程所有线程）：加密、明文普通读写、明文零拷贝
+    运行：python -m panel.p2p bench [MiB]
+    """
+    import shutil
+    import tempfile
+
+    workdir = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(workdir)  # 附件存储和数据库都用相对路径
+    try:
+        endpoint = P2PEndpoint("127.0.0.1", 0)
+        endpoint.my_user_id = 1
+        key = b64encode(os.urandom(32))
+        endpoint.session_keys[1] = endpoint.session_keys[2] = key
+        done = threading.Event()
+        endpoint.events.subscribe(lambda events: done.set())
+
+        source = os.path.join(workdir, "source.bin")
+        with open(source, "wb") as f:
+            for _ in range(size // (1024 * 1024)):
+                f.write(os.urandom(1024 * 1024))
+        store = AttachmentStore()
+        attachment = store.import_file(source)
+
+        print(f"{'mode':<16}{'wall s':>10}{'cpu s':>10}{'cpu s/GB':>12}")
+        for label, encrypt, zero_copy in (("encrypted", True, True),
+                                          ("plain buffered", False, False),
+                                          ("plain zero-copy", False, True)):
+            sender, receiver = socket.socketpair()
+            endpoint.connections[2] = sender
+            endpoint.ZERO_COPY = zero_copy
+            # 内容已存在时接收端不写盘，每轮都从空的存储开始
+            if store.has(attachment.sha256):
+                os.remove(store.path_of(attachment.sha256))
+            done.clear()
+            # 两端都要读取：接收端处理数据，发送端处理归还的窗口
+            readers = [threading.Thread(target=endpoint._handle_connection, args=(conn,), daemon=True)
+                       for conn in (sender, receiver)]
+            for conn, reader in zip((sender, receiver), readers):
+                endpoint.handle_threads_is_running[conn] = True
+                reader.start()
+            wall, cpu = time.perf_counter(), time.process_time()
+            endpoint.send_file(2, attachment.to_content(), source, encrypt)
+            done.wait()
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+            print(f"{label:<16}{wall:>10.2f}{cpu:>10.2f}{cpu * (1 << 30) / size:>12.2f}")
+            for conn, reader in zip((sender, receiver), readers):
+                endpoint.handle_threads_is_running[conn] = False
+                reader.join()
+                conn.close()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__" and sys.argv[1:2] == ["bench"]:
+    _benchmark_file_transfer(int(sys.argv[2]) * 1024 * 1024 if len(sys.argv) > 2 else 256 * 1024 * 1024)
+    os._exit(0)
+
 if __name__ == "__main__":
     api = P2PAPI()
     api.get_storage().save_my_user_id(2)
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from panel.Singleton import Singleton
+from settings import PresenceTTL
+
+
+class PresenceCache(Singleton):
+    """
+    好友在线状态的内存缓存
+    数据来源：后台定时同步的好友列表（带 TTL）和 P2P 会话状态（会话存在即在线）
+    发送消息时直接查询本缓存决定走 P2P 还是离线消息，不再请求服务器
+    """
+
+    def __init__(self, ttl=PresenceTTL):
+        if self.initialized:
+            return
+        self.initialized = True
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}      # user_id -> (online, 更新时间)
+        self._sessions = set()  # 存在 P2P 会话的 user_id
+        self._refreshed_at = None
+
+    def update_from_friends(self, friends):
+        """用完整的好友列表刷新缓存（每次同步后调用，即使没有变化也会刷新时间戳）"""
+        now = time.monotonic()
+        with self._lock:
+            self._entries = {
+                friend.get("userid"): (friend.get("user_status") == "online", now)
+                for friend in friends
+            }
+            self._refreshed_at = now
+
+    def set_online(self, user_id, online):
+        with self._lock:
+            self._entries[user_id] = (online, time.monotonic())
+
+    def mark_session(self, user_id, is_open):
+        """P2P 会话建立/断开"""
+        with self._lock:
+            if is_open:
+                self._sessions.add(user_id)
+            else:
+                self._sessions.discard(user_id)
+
+    def is_online(self, user_id):
+        """
+        返回好友是否在线
+        有 P2P 会话即在线；否则使用最近一次同步的结果（即使已过期，过期只会触发后台刷新）
+        """
+        with self._lock:
+            if user_id in self._sessions:
+                return True
+            entry = self._entries.get(user_id)
+            return entry[0] if entry else False
+
+    def needs_refresh(self):
+        """缓存是否已超过 TTL"""
+        with self._lock:
+            return self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.ttl
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sessions.clear()
+            self._refreshed_at = None
@@ -0,0 +1,148 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    令牌桶限速：每秒补充 rate 字节，最多积攒 burst 字节
+    reserve() 立即扣除令牌（允许扣成负数）并返回需要等待的时间，调用方自行决定是否等待
+    """
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: 字节/秒，None 或 0 表示不限速
+        :param burst: 桶容量，字节，默认为 1 秒的量
+        """
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, size):
+        """扣除 size 字节的令牌，返回发送前应等待的秒数"""
+        if not self.rate:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+            self._stamp = now
+            self._tokens -= size
+            return max(0.0, -self._tokens / self.rate)
+
+
+class SendScheduler:
+    """
+    P2P 发送调度
+    - 同一连接上一次只写出一帧，等待中的帧按优先级、同优先级按先后顺序写出；
+    - 任一连接上有等待写出的控制帧或文本时，所有连接上的批量帧（附件、隐写图片的数据块）都暂停，
+      大文件传输不会拖慢发给其他好友的聊天消息；
+    - 批量帧在写出前按全局和单个连接的令牌桶限速等待，等待期间不占用连接；
+      控制帧和文本照常计入用量但不等待
+    """
+    PRIORITY_CONTROL = 0  # 密钥交换、回执、传输的开始/结束帧
+    PRIORITY_TEXT = 1
+    PRIORITY_BULK = 2
+
+    def __init__(self, rate=None, peer_rate=None):
+        """
+        :param rate: 所有连接合计的上行限速，字节/秒，None 不限
+        :param peer_rate: 单个连接的上行限速，字节/秒，None 不限
+        """
+        self._global = TokenBucket(rate)
+        self._peer_rate = peer_rate
+        self._buckets = {}   # conn -> TokenBucket
+        self._waiting = {}   # conn -> [(优先级, 序号)]，小顶堆
+        self._busy = set()   # 正在写出的连接
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+
+    def send(self, conn, size, priority, write):
+        """
+        按优先级和限速写出一帧，返回 write() 的结果（在调用线程中执行，异常原样抛出）
+        :param size: 帧的字节数，用于限速
+        :param write: 实际写出整帧的函数，例如 lambda: conn.sendall(data)
+        """
+        if priority == self.PRIORITY_BULK:
+            delay = max(self._global.reserve(size), self._bucket(conn).reserve(size))
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            self._global.reserve(size)
+            self._bucket(conn).reserve(size)
+
+        ticket = (priority, next(self._seq))
+        with self._cond:
+            waiters = self._waiting.setdefault(conn, [])
+            heapq.heappush(waiters, ticket)
+            while conn in self._busy or waiters[0] != ticket or \
+                    (priority == self.PRIORITY_BULK and self._urgent_pending()):
+                self._cond.wait()
+            heapq.heappop(waiters)
+            self._busy.add(conn)
+        try:
+            return write()
+        finally:
+            with self._cond:
+                self._busy.discard(conn)
+                if not waiters:
+                    self._waiting.pop(conn, None)
+                self._cond.notify_all()
+
+    def _urgent_pending(self):
+        """是否有控制帧或文本在等待一个空闲的连接（连接正忙时暂停其他批量帧也无济于事）"""
+        return any(waiters and waiters[0][0] < self.PRIORITY_BULK and conn not in self._busy
+                   for conn, waiters in self._waiting.items())
+
+    def _bucket(self, conn):
+        with self._cond:
+            bucket = self._buckets.get(conn)
+            if bucket is None:
+                bucket = self._buckets[conn] = TokenBucket(self._peer_rate)
+            return bucket
+
+    def forget(self, conn):
+        """连接关闭后丢弃它的限速状态"""
+        with self._cond:
+            self._buckets.pop(conn, None)
+
+
+class StreamWindow:
+    """
+    一个传输流的发送窗口（按流的流量控制）
+    发送方每发出一个数据块扣除窗口，接收方处理完后用 MSG_TYPE_WINDOW_UPDATE 归还；
+    发送方最多领先接收方 size 字节，连接上积压的批量数据有上限，聊天消息不会排在几 MB 的文件数据之后，
+    接收方处理得慢的传输也只会拖慢自己的流
+    """
+    STALL_TIMEOUT = 30  # 对方这么久没有归还窗口时放弃传输，秒
+
+    def __init__(self, size):
+        self._size = size
+        self._available = size
+        self._closed = False
+        self._cond = threading.Condition()
+
+    def acquire(self, size):
+        """
+        等到窗口足够后扣除 size 字节；流或连接关闭时抛出 ConnectionError，对方长时间不归还时抛出 TimeoutError
+        比整个窗口还大的帧按整个窗口计算，否则永远等不到
+        """
+        size = min(size, self._size)
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._closed or self._available >= size, self.STALL_TIMEOUT):
+                raise TimeoutError("对方长时间没有归还发送窗口")
+            if self._closed:
+                raise ConnectionError("传输流已关闭")
+            self._available -= size
+
+    def release(self, size):
+        with self._cond:
+            self._available += size
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
@@ -0,0 +1,75 @@
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from settings import RequestTimeout, RequestRetries, RequestBackoff, RequestPoolSize
+
+# 进程内共享的 HTTP 会话：连接池 + keep-alive，所有接口复用同一组 TCP 连接
+_session = None
+_session_lock = threading.Lock()
+
+
+def _create_session():
+    retry = Retry(
+        total=RequestRetries,
+        backoff_factor=RequestBackoff,
+        status_forcelist=(502, 503, 504),
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS,  # 只对幂等方法重试状态码/读超时，POST 仅重试连接失败
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=RequestPoolSize,
+        pool_maxsize=RequestPoolSize,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def get_session():
+    """返回共享的 requests.Session"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _create_session()
+        return _session
+
+
+def set_auth_token(token):
+    """安装（或在 token 为 None 时移除）Authorization 头"""
+    session = get_session()
+    if token:
+        session.headers["Authorization"] = f"Token {token}"
+    else:
+        session.headers.pop("Authorization", None)
+
+
+def has_auth_token():
+    return "Authorization" in get_session().headers
+
+
+def request(method, url, **kwargs):
+    """带默认超时的请求"""
+    kwargs.setdefault("timeout", RequestTimeout)
+    return get_session().request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def close():
+    """关闭会话并释放连接池"""
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
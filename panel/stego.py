@@ -0,0 +1,612 @@
+"""
+LSB 隐写
+把载荷逐位写入像素 R、G、B 通道的最低位（不使用 Alpha 通道），每个通道藏 1 位
+载荷前有 8 字节头：魔数 + 载荷长度，用于识别图片中是否藏有数据
+所有运算都在 NumPy 数组上整块完成，不逐像素循环；只改写载荷实际占用的那几行像素
+
+除整图的 embed/extract 外，还提供按行分块的流式处理（P2P 传输隐写图片时使用）：
+  read_strips -> StripEmbedder -> PngStreamWriter  发送端边嵌入边编码
+  PngStreamReader -> StripExtractor                接收端边解码边提取
+任一时刻只有一个分块的像素在内存中（非 BMP 的载体图片需要先整体解码一次）
+encode_file/decode_file 把上述流程用于本地文件，可报告进度和取消（ui.stego_worker 在进程池中调用）
+"""
+
+import os
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image
+
+from panel.encrypt import CryptoManager
+
+MAGIC = b"LSB1"
+HEADER_FORMAT = "!4sI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+CHANNELS = 3  # 只使用 RGB 通道
+
+# 隐写结果必须无损保存，JPEG 等有损格式会破坏最低位
+LOSSLESS_FORMATS = {".png", ".bmp", ".tif", ".tiff"}
+
+
+def capacity(shape):
+    """
+    计算图片能藏的载荷字节数（已扣除头部）
+    :param shape: 像素数组的形状 (高, 宽, 通道数)，或 (高, 宽)
+    """
+    height, width = shape[:2]
+    return max(height * width * CHANNELS // 8 - HEADER_SIZE, 0)
+
+
+def _rgb(pixels):
+    if pixels.dtype != np.uint8 or pixels.ndim != 3 or pixels.shape[2] not in (3, 4):
+        raise ValueError(f"需要 uint8 的 RGB/RGBA 像素数组，收到 {pixels.dtype} {pixels.shape}")
+    return pixels[..., :CHANNELS]
+
+
+def _rows_for(bit_count, width):
+    """写入/读出 bit_count 位需要的像素行数"""
+    return -(-bit_count // (width * CHANNELS))
+
+
+def embed(pixels, payload):
+    """
+    把载荷藏入图片
+    :param pixels: (高, 宽, 3/4) 的 uint8 像素数组，不会被修改
+    :param payload: 要隐藏的字节（通常已加密）
+    :return: 藏入载荷后的新像素数组
+    """
+    rgb = _rgb(pixels)
+    limit = capacity(pixels.shape)
+    if len(payload) > limit:
+        raise ValueError(f"载荷 {len(payload)} 字节超出图片容量 {limit} 字节")
+
+    data = np.frombuffer(struct.pack(HEADER_FORMAT, MAGIC, len(payload)) + bytes(payload), dtype=np.uint8)
+    bits = np.unpackbits(data)
+    rows = _rows_for(bits.size, rgb.shape[1])
+
+    result = pixels.copy()
+    # 只取出载荷覆盖的行，展平为通道序列后整块替换最低位
+    channels = result[:rows, :, :CHANNELS].reshape(-1)
+    channels[:bits.size] = (channels[:bits.size] & 0xFE) | bits
+    result[:rows, :, :CHANNELS] = channels.reshape(rows, rgb.shape[1], CHANNELS)
+    return result
+
+
+def _read_bytes(rgb, offset, length):
+    """从第 offset 个字节开始读出 length 个字节"""
+    start, stop = offset * 8, (offset + length) * 8
+    rows = _rows_for(stop, rgb.shape[1])
+    channels = rgb[:rows].reshape(-1)
+    return np.packbits(channels[start:stop] & 1).tobytes()
+
+
+def extract(pixels):
+    """
+    读出 embed 藏入的载荷
+    :param pixels: (高, 宽, 3/4) 的 uint8 像素数组
+    :return: 载荷字节；图片中没有隐藏数据时抛出 ValueError
+    """
+    rgb = _rgb(pixels)
+    if capacity(pixels.shape) <= 0:
+        raise ValueError("图片太小，没有隐藏数据")
+    magic, length = struct.unpack(HEADER_FORMAT, _read_bytes(rgb, 0, HEADER_SIZE))
+    if magic != MAGIC or length > capacity(pixels.shape):
+        raise ValueError("图片中没有隐藏数据")
+    return _read_bytes(rgb, HEADER_SIZE, length)
+
+
+def hide_text(pixels, text, session_key_b64):
+    """用会话密钥 AES 加密文本后藏入图片"""
+    encrypted = CryptoManager().aes_encrypt_auto(text, session_key_b64)
+    return embed(pixels, encrypted["encrypted_message"].encode("ascii"))
+
+
+def reveal_text(pixels, session_key_b64):
+    """读出并解密 hide_text 藏入的文本"""
+    encrypted_message = extract(pixels).decode("ascii")
+    return CryptoManager().aes_decrypt_auto(encrypted_message, session_key_b64, "str")
+
+
+def load_pixels(path):
+    """读取图片为 RGB/RGBA 像素数组"""
+    with Image.open(path) as image:
+        mode = "RGBA" if "A" in image.getbands() else "RGB"
+        return np.asarray(image.convert(mode)).copy()
+
+
+def save_pixels(pixels, path):
+    """以无损格式保存像素数组"""
+    suffix = path[path.rfind("."):].lower() if "." in path else ""
+    if suffix not in LOSSLESS_FORMATS:
+        raise ValueError(f"隐写图片必须保存为无损格式 {sorted(LOSSLESS_FORMATS)}，收到 {path}")
+    Image.fromarray(pixels).save(path)
+
+
+def _payload_bits(data, start, stop):
+    """取出 data 的第 start 到 stop 位（高位在前），只展开这一段"""
+    first = start // 8
+    chunk = np.frombuffer(data, dtype=np.uint8, count=-(-stop // 8) - first, offset=first)
+    return np.unpackbits(chunk)[start - first * 8:stop - first * 8]
+
+
+class StripEmbedder:
+    """
+    按行分块嵌入载荷，结果与对整图调用 embed 相同
+    分块须按从上到下的顺序传入
+    """
+
+    def __init__(self, shape, payload):
+        limit = capacity(shape)
+        if len(payload) > limit:
+            raise ValueError(f"载荷 {len(payload)} 字节超出图片容量 {limit} 字节")
+        self._data = struct.pack(HEADER_FORMAT, MAGIC, len(payload)) + bytes(payload)
+        self._bit_count = len(self._data) * 8
+        self._position = 0  # 已经过的通道数
+
+    def embed(self, strip):
+        """返回嵌入了对应数据段的分块副本；载荷已写完后的分块原样返回"""
+        _rgb(strip)
+        start = self._position
+        self._position += strip.shape[0] * strip.shape[1] * CHANNELS
+        if start >= self._bit_count:
+            return strip
+        stop = min(self._position, self._bit_count)
+        bits = _payload_bits(self._data, start, stop)
+
+        result = strip.copy()
+        channels = result[..., :CHANNELS].reshape(-1)
+        channels[:bits.size] = (channels[:bits.size] & 0xFE) | bits
+        result[..., :CHANNELS] = channels.reshape(strip.shape[0], strip.shape[1], CHANNELS)
+        return result
+
+
+class StripExtractor:
+    """
+    按行分块提取载荷，分块须按从上到下的顺序传入
+    feed 返回 True 表示载荷已完整，之后的分块无需再传入
+    """
+
+    def __init__(self, shape):
+        self._capacity = capacity(shape)
+        self._buffer = bytearray()
+        self._leftover = np.empty(0, dtype=np.uint8)  # 不足一个字节的剩余位
+        self._length = None
+
+    @property
+    def done(self):
+        return self._length is not None and len(self._buffer) >= HEADER_SIZE + self._length
+
+    def feed(self, strip):
+        channels = _rgb(strip).reshape(-1)
+        offset = 0
+        while not self.done and offset < channels.size:
+            target = HEADER_SIZE if self._length is None else HEADER_SIZE + self._length
+            needed = target * 8 - len(self._buffer) * 8 - self._leftover.size
+            lsb = channels[offset:offset + needed] & 1
+            offset += lsb.size
+            bits = np.concatenate([self._leftover, lsb])
+            whole = bits.size // 8 * 8
+            self._buffer += np.packbits(bits[:whole]).tobytes()
+            self._leftover = bits[whole:]
+
+            if self._length is None and len(self._buffer) >= HEADER_SIZE:
+                magic, length = struct.unpack(HEADER_FORMAT, bytes(self._buffer[:HEADER_SIZE]))
+                if magic != MAGIC or length > self._capacity:
+                    raise ValueError("图片中没有隐藏数据")
+                self._length = length
+        return self.done
+
+    @property
+    def payload(self):
+        if not self.done:
+            raise ValueError("载荷尚未接收完整")
+        return bytes(self._buffer[HEADER_SIZE:])
+
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_COLOR_TYPES = {3: 2, 4: 6}  # 通道数 -> PNG 颜色类型（8 位 RGB / RGBA）
+PNG_MAX_CHUNK = 1 << 24         # 接收时允许的最大 PNG 块，避免对端让缓冲区无限增长
+
+
+def _png_chunk(kind, data):
+    return struct.pack("!I", len(data)) + kind + data + struct.pack("!I", zlib.crc32(kind + data))
+
+
+class PngStreamWriter:
+    """
+    按行分块编码 PNG（8 位 RGB/RGBA，行滤波固定为 None）
+    每个分块压缩后作为 IDAT 块输出，完整的编码结果不会同时存在于内存中
+    """
+
+    def __init__(self, shape, level=6):
+        self.height, self.width = shape[:2]
+        self.channels = shape[2] if len(shape) > 2 else 3
+        if self.channels not in PNG_COLOR_TYPES:
+            raise ValueError(f"只支持 RGB/RGBA 图片，收到 {self.channels} 个通道")
+        self._compressor = zlib.compressobj(level)
+        self._rows = 0
+
+    def header(self):
+        """PNG 签名和 IHDR"""
+        ihdr = struct.pack("!IIBBBBB", self.width, self.height, 8, PNG_COLOR_TYPES[self.channels], 0, 0, 0)
+        return PNG_SIGNATURE + _png_chunk(b"IHDR", ihdr)
+
+    def write(self, strip):
+        """编码一个分块，zlib 尚未输出数据时返回 b''"""
+        if strip.shape[1:] != (self.width, self.channels):
+            raise ValueError(f"分块形状 {strip.shape} 与图片 {self.width}x{self.channels} 不符")
+        rows = strip.shape[0]
+        raw = np.zeros((rows, 1 + self.width * self.channels), dtype=np.uint8)  # 每行前是滤波类型 0
+        raw[:, 1:] = strip.reshape(rows, -1)
+        self._rows += rows
+        data = self._compressor.compress(raw.tobytes())
+        return _png_chunk(b"IDAT", data) if data else b""
+
+    def finish(self):
+        """剩余的压缩数据和 IEND"""
+        if self._rows != self.height:
+            raise ValueError(f"只写入了 {self._rows}/{self.height} 行")
+        return _png_chunk(b"IDAT", self._compressor.flush()) + _png_chunk(b"IEND", b"")
+
+
+class PngStreamReader:
+    """
+    增量解码 PngStreamWriter 输出的 PNG 字节流
+    feed(data) 返回本次解出的像素分块列表，每块最多 strip_rows 行；
+    只支持 8 位 RGB/RGBA、非隔行、行滤波为 None 的图片
+    """
+
+    def __init__(self, strip_rows=64, max_pixels=None):
+        """
+        :param max_pixels: 允许的最大像素数（宽 × 高来自对端，决定解码缓冲区的大小），默认同 Pillow 的 Image.MAX_IMAGE_PIXELS
+        """
+        self.shape = None
+        self._max_pixels = max_pixels or Image.MAX_IMAGE_PIXELS
+        self.finished = False
+        self._strip_rows = strip_rows
+        self._buffer = bytearray()
+        self._signature_checked = False
+        self._decompressor = zlib.decompressobj()
+        self._pending = bytearray()  # 已解压但未凑满一行的数据
+        self._row_bytes = 0
+        self._rows = 0
+
+    def feed(self, data):
+        self._buffer += data
+        strips = []
+        if not self._signature_checked:
+            if len(self._buffer) < len(PNG_SIGNATURE):
+                return strips
+            if self._buffer[:len(PNG_SIGNATURE)] != PNG_SIGNATURE:
+                raise ValueError("不是 PNG 数据")
+            del self._buffer[:len(PNG_SIGNATURE)]
+            self._signature_checked = True
+
+        while len(self._buffer) >= 12 and not self.finished:
+            length = struct.unpack_from("!I", self._buffer)[0]
+            if length > PNG_MAX_CHUNK:
+                raise ValueError(f"PNG 块过大: {length} 字节")
+            if len(self._buffer) < 12 + length:
+                break
+            kind = bytes(self._buffer[4:8])
+            body = bytes(self._buffer[8:8 + length])
+            crc = struct.unpack_from("!I", self._buffer, 8 + length)[0]
+            del self._buffer[:12 + length]
+            if zlib.crc32(kind + body) != crc:
+                raise ValueError("PNG 数据校验失败")
+
+            if kind == b"IHDR":
+                self._read_header(body)
+            elif kind == b"IDAT":
+                if self.shape is None:
+                    raise ValueError("PNG 缺少 IHDR")
+                strips.extend(self._decode(body))
+            elif kind == b"IEND":
+                if self.shape is None or self._rows != self.shape[0]:
+                    raise ValueError("PNG 数据不完整")
+                self.finished = True
+        return strips
+
+    def _read_header(self, body):
+        if self.shape is not None:
+            raise ValueError("PNG 有多个 IHDR")
+        width, height, depth, color_type, _, _, interlace = struct.unpack("!IIBBBBB", body)
+        channels = {color: count for count, color in PNG_COLOR_TYPES.items()}.get(color_type)
+        if depth != 8 or channels is None or interlace:
+            raise ValueError("只支持 8 位、非隔行的 RGB/RGBA PNG")
+        if not width or not height:
+            raise ValueError("PNG 图片尺寸为 0")
+        if self._max_pixels and width * height > self._max_pixels:
+            raise ValueError(f"PNG 图片过大: {width}x{height}")
+        self.shape = (height, width, channels)
+        self._row_bytes = 1 + width * channels
+
+    def _decode(self, body):
+        """解压一个 IDAT 块，每次最多解出 strip_rows 行，解压结果不会超过一个分块的大小"""
+        strips = []
+        data = body
+        while data:
+            self._pending += self._decompressor.decompress(data, self._strip_rows * self._row_bytes)
+            data = self._decompressor.unconsumed_tail
+            rows = len(self._pending) // self._row_bytes
+            if not rows:
+                continue
+            if self._rows + rows > self.shape[0]:
+                raise ValueError("PNG 数据超出图片高度")
+            raw = np.frombuffer(bytes(self._pending[:rows * self._row_bytes]), dtype=np.uint8).reshape(rows, -1)
+            del self._pending[:rows * self._row_bytes]
+            if raw[:, 0].any():
+                raise ValueError("只支持行滤波为 None 的 PNG")
+            self._rows += rows
+            strips.append(raw[:, 1:].reshape(rows, self.shape[1], self.shape[2]))
+        return strips
+
+
+def _bmp_layout(path):
+    """
+    未压缩的 24/32 位 BMP 的像素布局，可直接内存映射；其他文件返回 None
+    :return: (像素数据偏移, 宽, 高, 是否自上而下存储, 每像素字节数, 每行字节数)
+    """
+    with open(path, "rb") as f:
+        head = f.read(54)
+    if len(head) < 54 or head[:2] != b"BM":
+        return None
+    offset = struct.unpack_from("<I", head, 10)[0]
+    header_size, width, height, _, bits, compression = struct.unpack_from("<IiiHHI", head, 14)
+    if header_size < 40 or bits not in (24, 32) or compression != 0 or width <= 0 or height == 0:
+        return None
+    stride = (width * bits + 31) // 32 * 4
+    return offset, width, abs(height), height < 0, bits // 8, stride
+
+
+def read_strips(path, strip_rows):
+    """
+    按行分块读取载体图片
+    未压缩的 BMP 通过内存映射逐块读取，不解码整张图；其他格式由 Pillow 解码后切分
+    :return: (图片形状, 从上到下的分块生成器)
+    """
+    layout = _bmp_layout(path)
+    if layout is None:
+        pixels = load_pixels(path)
+        return pixels.shape, (pixels[y:y + strip_rows] for y in range(0, pixels.shape[0], strip_rows))
+
+    offset, width, height, top_down, pixel_bytes, stride = layout
+
+    def strips():
+        mapped = np.memmap(path, dtype=np.uint8, mode="r", offset=offset, shape=(height, stride))
+        for y in range(0, height, strip_rows):
+            rows = min(strip_rows, height - y)
+            block = mapped[y:y + rows] if top_down else mapped[height - y - rows:height - y][::-1]
+            # BGR(X) -> RGB
+            yield np.ascontiguousarray(block[:, :width * pixel_bytes].reshape(rows, width, pixel_bytes)[..., 2::-1])
+
+    return (height, width, CHANNELS), strips()
+
+
+class StegoStreamReceiver:
+    """
+    接收隐写 PNG 字节流：原样写入文件，同时逐块解码并提取载荷
+    载荷取完后只写文件，不再解码；收到的字节数超过 max_size（对端声明不了大小，只能边收边计）时抛出 ValueError
+    """
+
+    def __init__(self, path, strip_rows=64, max_size=None):
+        self.path = path
+        self._file = open(path, "wb")
+        self._reader = PngStreamReader(strip_rows)
+        self._extractor = None
+        self._max_size = max_size
+        self._received = 0
+
+    def feed(self, data):
+        self._received += len(data)
+        if self._max_size is not None and self._received > self._max_size:
+            raise ValueError(f"隐写图片超出大小上限 {self._max_size} 字节")
+        self._file.write(data)
+        if self._extractor is not None and self._extractor.done:
+            return
+        for strip in self._reader.feed(data):
+            if self._extractor is None:
+                self._extractor = StripExtractor(self._reader.shape)
+            if self._extractor.feed(strip):
+                break
+
+    def finish(self):
+        """文件接收完毕，返回提取出的载荷"""
+        self._file.close()
+        if self._extractor is None or not self._extractor.done:
+            raise ValueError("图片中没有隐藏数据")
+        return self._extractor.payload
+
+    def abort(self):
+        """放弃接收并删除未完成的文件"""
+        self._file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class StegoCancelled(Exception):
+    """隐写任务被取消"""
+
+
+def encode_file(src, dst, payload, strip_rows=64, progress=None):
+    """
+    把载荷藏入图片，按分块流式写成 PNG（可直接按字节经 MSG_TYPE_LSB 发送）
+    :param progress: progress(已处理行数, 总行数)，返回 False 时删除输出文件并抛出 StegoCancelled
+    :return: 输出文件路径
+    """
+    shape, strips = read_strips(src, strip_rows)
+    embedder = StripEmbedder(shape, payload)
+    writer = PngStreamWriter(shape)
+    rows = 0
+    try:
+        with open(dst, "wb") as f:
+            f.write(writer.header())
+            for strip in strips:
+                f.write(writer.write(embedder.embed(strip)))
+                rows += strip.shape[0]
+                if progress is not None and progress(rows, shape[0]) is False:
+                    raise StegoCancelled(dst)
+            f.write(writer.finish())
+    except BaseException:
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        raise
+    return dst
+
+
+def decode_file(path, strip_rows=64, progress=None):
+    """
+    按分块读出图片中藏的载荷，载荷读完即停止
+    :param progress: 同 encode_file
+    :return: 载荷字节；没有隐藏数据时抛出 ValueError
+    """
+    shape, strips = read_strips(path, strip_rows)
+    extractor = StripExtractor(shape)
+    rows = 0
+    for strip in strips:
+        if extractor.feed(strip):
+            break
+        rows += strip.shape[0]
+        if progress is not None and progress(rows, shape[0]) is False:
+            raise StegoCancelled(path)
+    return extractor.payload
+
+
+def _embed_per_pixel(pixels, payload):
+    """逐通道循环的参考实现，仅用于基准对比"""
+    result = pixels.copy()
+    data = struct.pack(HEADER_FORMAT, MAGIC, len(payload)) + bytes(payload)
+    width = pixels.shape[1]
+    position = 0
+    for byte in data:
+        for shift in range(7, -1, -1):
+            y, rest = divmod(position, width * CHANNELS)
+            x, c = divmod(rest, CHANNELS)
+            result[y, x, c] = (result[y, x, c] & 0xFE) | ((byte >> shift) & 1)
+            position += 1
+    return result
+
+
+if __name__ == "__main__":
+    import os
+    import tempfile
+    import time
+
+    def timed(fn, *args, repeat=5):
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args)
+            best = min(best, time.perf_counter() - start)
+        return result, best
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(2160, 3840, 3), dtype=np.uint8)  # 4K
+    print(f"4K 图片容量: {capacity(image.shape) / 1024 / 1024:.2f} MiB")
+
+    for size in (1024, 64 * 1024, 1024 * 1024, capacity(image.shape)):
+        payload = os.urandom(size)
+        stego, embed_time = timed(embed, image, payload)
+        extracted, extract_time = timed(extract, stego)
+        assert extracted == payload
+        changed = np.count_nonzero(stego != image)
+        assert np.abs(stego.astype(np.int16) - image).max() <= 1
+        print(f"载荷 {size:>8} 字节: 嵌入 {embed_time * 1000:7.2f}ms，提取 {extract_time * 1000:7.2f}ms，"
+              f"改动 {changed} 个通道值")
+
+    payload = os.urandom(64 * 1024)
+    reference, loop_time = timed(_embed_per_pixel, image, payload, repeat=1)
+    vectorized, vector_time = timed(embed, image, payload)
+    assert np.array_equal(reference, vectorized)
+    print(f"64KiB 载荷: 逐像素循环 {loop_time * 1000:.0f}ms，NumPy {vector_time * 1000:.2f}ms，"
+          f"快 {loop_time / vector_time:.0f} 倍")
+
+    # 带 Alpha 通道的图片、加密文本和 PNG 文件往返
+    rgba = rng.integers(0, 256, size=(64, 64, 4), dtype=np.uint8)
+    stego = embed(rgba, b"hello")
+    assert np.array_equal(stego[..., 3], rgba[..., 3]) and extract(stego) == b"hello"
+    session_key = CryptoManager().encrypt_session_key_for_friend(CryptoManager().public_key_str)["session_key"]
+    stego = hide_text(rgba, "你好，隐写", session_key)
+    assert b"\xe4\xbd\xa0" not in extract(stego)
+    assert reveal_text(stego, session_key) == "你好，隐写"
+    try:
+        extract(rgba)
+    except ValueError as e:
+        print(f"未藏数据的图片: {e}")
+    try:
+        embed(rgba, os.urandom(capacity(rgba.shape) + 1))
+    except ValueError as e:
+        print(f"超出容量: {e}")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stego.png")
+        save_pixels(stego, path)
+        assert reveal_text(load_pixels(path), session_key) == "你好，隐写"
+        # 分块流式嵌入/提取与整图结果一致，BMP 载体通过内存映射读取
+        carrier = rng.integers(0, 256, size=(301, 257, 3), dtype=np.uint8)
+        payload = os.urandom(capacity(carrier.shape))
+        bmp_path = os.path.join(directory, "carrier.bmp")
+        Image.fromarray(carrier).save(bmp_path)
+        shape, strips = read_strips(bmp_path, 16)
+        embedder = StripEmbedder(shape, payload)
+        writer = PngStreamWriter(shape)
+        receiver = StegoStreamReceiver(os.path.join(directory, "received.png"), strip_rows=7)
+        receiver.feed(writer.header())
+        for strip in strips:
+            data = writer.write(embedder.embed(strip))
+            for i in range(0, len(data), 1000):  # 模拟网络分片
+                receiver.feed(data[i:i + 1000])
+        receiver.feed(writer.finish())
+        assert receiver.finish() == payload
+        assert np.array_equal(load_pixels(receiver.path), embed(carrier, payload))
+
+        # 对端声明的尺寸和发送的总字节数都有上限
+        for shape in ((16, 0, 3), (0, 16, 3), (1 << 16, 1 << 16, 3)):
+            try:
+                PngStreamReader().feed(PngStreamWriter(shape).header())
+                raise AssertionError(f"{shape} 应被拒绝")
+            except ValueError as e:
+                print(f"拒绝 {shape[1]}x{shape[0]} 的 PNG: {e}")
+        header = PngStreamWriter((4, 4, 3)).header()
+        receiver = StegoStreamReceiver(os.path.join(directory, "capped.png"), max_size=len(header))
+        receiver.feed(header)
+        try:
+            receiver.feed(b"\0")
+            raise AssertionError("超出上限的数据应被拒绝")
+        except ValueError:
+            receiver.abort()
+
+        # 4K BMP 载体流式发送/接收的峰值内存（整图解码一次即 24 MiB）
+        import tracemalloc
+        bmp_path = os.path.join(directory, "carrier_4k.bmp")
+        Image.fromarray(image).save(bmp_path)
+        payload = os.urandom(1024 * 1024)
+        tracemalloc.start()
+        start = time.perf_counter()
+        shape, strips = read_strips(bmp_path, 64)
+        embedder = StripEmbedder(shape, payload)
+        writer = PngStreamWriter(shape)
+        receiver = StegoStreamReceiver(os.path.join(directory, "received_4k.png"))
+        receiver.feed(writer.header())
+        for strip in strips:
+            receiver.feed(writer.write(embedder.embed(strip)))
+        receiver.feed(writer.finish())
+        assert receiver.finish() == payload
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print(f"4K BMP 流式嵌入+编码+接收提取 1MiB 载荷: {time.perf_counter() - start:.2f}s，"
+              f"峰值内存 {peak / 1024 / 1024:.1f} MiB")
+
+        # 文件编码/解码及中途取消
+        png_path = os.path.join(directory, "encoded.png")
+        encode_file(bmp_path, png_path, payload)
+        assert decode_file(png_path) == payload
+        try:
+            encode_file(bmp_path, png_path, payload, progress=lambda rows, total: rows < total // 2)
+        except StegoCancelled:
+            assert not os.path.exists(png_path)
+    print("✅ 隐写测试通过！")
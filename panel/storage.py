@@ -11,6 +11,9 @@ class SecureStorage(Singleton):
     storable_data = [str, bytes]
 
     def __init__(self):
+        # 建表、迁移和清理只在进程内第一次构造时执行（之后各处的 SecureStorage() 都是同一个实例）
+        if self.initialized:
+            return
         self.db_path = "db"
         self._init_db()
     
@@ -51,6 +54,42 @@ class SecureStorage(Singleton):
             )
 
             
+            # 发件箱：每条待发送消息的投递状态，重启后继续投递
+            cursor.execute(
+                '''
+                    create table if not exists outbox (
+                        id integer primary key autoincrement,
+                        user_id integer not null,
+                        username text not null,
+                        message text not null,
+                        state varchar(10) not null default 'pending',
+                        attempts integer not null default 0,
+                        next_attempt real not null default 0,
+                        wire_id text,
+                        created varchar(20) not null
+                    )
+                '''
+            )
+
+            cursor.execute(
+                '''
+                    create index if not exists outbox_due on outbox (state, next_attempt)
+                '''
+            )
+
+            cursor.execute(
+                '''
+                    create index if not exists outbox_wire_id on outbox (wire_id)
+                '''
+            )
+
+            # 送达的消息不再保留在发件箱中（旧版本会留下 delivered 状态的行）
+            cursor.execute(
+                '''
+                    delete from outbox where state = 'delivered'
+                '''
+            )
+
             cursor.execute(
                 '''           
                     create table if not exists my_userid (
@@ -76,9 +115,44 @@ class SecureStorage(Singleton):
                         alter table my_userid add column token text NULL
                     '''
                 )
+
+            # recv_messages 增加 message_id 列，用于离线消息去重
+            cursor.execute(
+                '''
+                    PRAGMA table_info(recv_messages)
+                '''
+            )
+            column_names = [column[1] for column in cursor.fetchall()]
+
+            if 'message_id' not in column_names:
+                cursor.execute(
+                    '''
+                        alter table recv_messages add column message_id text NULL
+                    '''
+                )
+
+            cursor.execute(
+                '''
+                    create unique index if not exists recv_messages_message_id
+                    on recv_messages (message_id)
+                '''
+            )
+
+            # 聊天记录按好友和时间分页读取
+            cursor.execute(
+                '''
+                    create index if not exists recv_messages_user_time on recv_messages (user_id, time)
+                '''
+            )
+            cursor.execute(
+                '''
+                    create index if not exists sent_messages_user_time on sent_messages (user_id, time)
+                '''
+            )
                 
             conn.commit()
             conn.close()
+            self.initialized = True  # 失败时下次构造重试
         except Exception as e:
             print(f"Error initializing database: {e}")
         
@@ -135,6 +209,22 @@ class SecureStorage(Singleton):
         
         return public_key
 
+    def get_public_keys(self):
+        """一次查询读出全部好友公钥，返回 {user_id: public_key}"""
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                select user_id, public_key from friends
+            ''')
+            public_keys = dict(cursor.fetchall())
+            conn.close()
+        except Exception as e:
+            print(f"Error getting public keys: {e}")
+            public_keys = {}
+
+        return public_keys
+
     def get_session_key(self, user_id):
         try:
             conn = sqlite3.connect(self.db_path)
@@ -310,20 +400,170 @@ class SecureStorage(Singleton):
             message = None
         return message
     
+    def save_recv_messages(self, messages):
+        """
+        在一个事务中批量保存收到的消息，按 message_id 幂等去重
+        :param messages: [(message_id, user_id, message, timestamp), ...]
+        :return: 本次新插入的 message_id 列表（已存在的不会重复插入）
+        """
+        inserted = []
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            for message_id, user_id, message, timestamp in messages:
+                time_str = (timestamp or datetime.now()).strftime("%Y-%m-%d %H:%M:%S")
+                cursor.execute('''
+                    insert or ignore into recv_messages (user_id, message, time, message_id) values (?, ?, ?, ?)
+                ''', (user_id, message, time_str, message_id))
+                if cursor.rowcount:
+                    inserted.append(message_id)
+            conn.commit()
+        except Exception as e:
+            print(f"Error saving messages: {e}")
+            raise
+        finally:
+            if conn:
+                conn.close()
+        return inserted
+
     def read_message_with_offline(self,user_id:str):
+        """先把服务器上的离线消息合并进本地记录，再读取与该好友的收到消息"""
+        from panel.connect import sync_offline_inbox
+        try:
+            sync_offline_inbox()
+        except Exception as e:
+            print(f"Error syncing offline messages: {e}")
+        return self.read_recv_data(user_id)
+    
+    def read_history(self, user_id: int, before=None, limit=50):
+        """
+        按时间倒序读取与某个好友的一页聊天记录（收到和发出的合并）
+        使用键集分页，翻页耗时与记录总数无关
+        :param before: 上一页最后一行的游标 (time, is_me, rowid)，None 表示从最新的记录开始
+        :return: [(time, is_me, rowid, message), ...]，最新的在前；最后一行即下一页的游标
+        """
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            query = '''
+                select time, is_me, rowid, message from (
+                    select time, 0 as is_me, rowid, message from recv_messages where user_id = ?
+                    union all
+                    select time, 1 as is_me, rowid, message from sent_messages where user_id = ?
+                )
+            '''
+            params = [user_id, user_id]
+            if before is not None:
+                query += ' where (time, is_me, rowid) < (?, ?, ?)'
+                params.extend(before)
+            query += ' order by time desc, is_me desc, rowid desc limit ?'
+            params.append(limit)
+            cursor.execute(query, params)
+            return cursor.fetchall()
+        except Exception as e:
+            print(f"Error reading history: {e}")
+            return []
+        finally:
+            if conn:
+                conn.close()
+
+    OUTBOX_PENDING = "pending"      # 等待投递
+    OUTBOX_SENT = "sent"            # 已经通过 P2P 发出，等待对方回执
+    OUTBOX_DELIVERED = "delivered"  # 对方已确认或服务器已接收，此时从发件箱中删除
+
+    def enqueue_outbox(self, user_id: int, username: str, message: str):
+        """把一条待发送消息加入发件箱，同时记入已发送消息，返回发件箱 ID"""
+        conn = None
         try:
+            time_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             conn = sqlite3.connect(self.db_path)
             cursor = conn.cursor()
             cursor.execute('''
-                select * from messages where user_id = ?
-            ''', (user_id,))
-            message = cursor.fetchall()
+                insert into outbox (user_id, username, message, state, created) values (?, ?, ?, ?, ?)
+            ''', (user_id, username, message, self.OUTBOX_PENDING, time_str))
+            outbox_id = cursor.lastrowid
+            cursor.execute('''
+                insert into sent_messages (user_id, message, time) values (?, ?, ?)
+            ''', (user_id, message, time_str))
+            conn.commit()
+            return outbox_id
+        except Exception as e:
+            print(f"Error enqueueing message: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
+    def get_undelivered_outbox(self, limit=500):
+        """
+        取出尚未送达的消息，按入队顺序
+        返回 [(id, user_id, username, message, state, attempts, next_attempt), ...]
+        """
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            # order by +id：按 outbox_due 索引查出未送达的行再排序，而不是按主键扫描整张表
+            cursor.execute('''
+                select id, user_id, username, message, state, attempts, next_attempt from outbox
+                where state in (?, ?) order by +id limit ?
+            ''', (self.OUTBOX_PENDING, self.OUTBOX_SENT, limit))
+            entries = cursor.fetchall()
             conn.close()
         except Exception as e:
-            print(f"Error reading message: {e}")
-            message = None
-        return message
-    
+            print(f"Error reading outbox: {e}")
+            entries = []
+        return entries
+
+    def update_outbox(self, outbox_id: int, state: str, next_attempt=0, attempts=None, wire_id=None):
+        """更新发件箱中一条消息的投递状态，送达时删除"""
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            if state == self.OUTBOX_DELIVERED:
+                cursor.execute('''
+                    delete from outbox where id = ?
+                ''', (outbox_id,))
+                conn.commit()
+                return
+            cursor.execute('''
+                update outbox set state = ?, next_attempt = ?,
+                    attempts = coalesce(?, attempts), wire_id = coalesce(?, wire_id)
+                where id = ?
+            ''', (state, next_attempt, attempts, wire_id, outbox_id))
+            conn.commit()
+        except Exception as e:
+            print(f"Error updating outbox: {e}")
+        finally:
+            if conn:
+                conn.close()
+
+    def mark_outbox_delivered_by_wire_id(self, wire_id: str):
+        """收到 P2P 回执，按消息 ID 标记送达（从发件箱中删除），返回对应的发件箱 ID（没有则为 None）"""
+        conn = None
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+            cursor.execute('''
+                select id from outbox where wire_id = ?
+            ''', (wire_id,))
+            result = cursor.fetchone()
+            if not result:
+                return None
+            cursor.execute('''
+                delete from outbox where id = ?
+            ''', (result[0],))
+            conn.commit()
+            return result[0]
+        except Exception as e:
+            print(f"Error updating outbox: {e}")
+            return None
+        finally:
+            if conn:
+                conn.close()
+
     def save_token(self, user_id: int, token: str):
         try:
             conn = sqlite3.connect(self.db_path)
@@ -347,9 +587,7 @@ class SecureStorage(Singleton):
             ''', (user_id,))
             result = cursor.fetchone()
             if result:
-                token = result[0]
-                logging.info(f"Reading Database: Token for user {user_id} is {token}")
-                return token
+                return result[0]
             else:
                 return None
         except Exception as e:
@@ -0,0 +1,412 @@
+"""
+本地替身服务器：在内存中模拟后端 /api/contact 接口的一个子集，
+用于在没有真实后端时调试和验证 panel.connect 的同步逻辑
+
+在项目根目录运行自测：python -m panel.stub_server
+"""
+import itertools
+import json
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+class StubServer:
+    def __init__(self, token="stub-token", host="127.0.0.1", port=0):
+        self.token = token
+        self.lock = threading.Lock()
+        self.version = 0
+        self.friends = {}      # userid -> 好友字典
+        self.updated = {}      # userid -> 最后修改的版本号
+        self.removed = {}      # userid -> 删除时的版本号
+        self.requests = []     # (method, path) 请求记录
+        self.events = []       # 通知事件日志，下标 + 1 即事件 id
+        self.events_changed = threading.Condition(self.lock)
+        self.offline_inbox = {}  # 离线消息 id -> 消息，发给当前用户
+        self.offline_sent = []   # 当前用户发出的离线消息
+        self.offline_ids = itertools.count(1)  # 离线消息 ID 和服务器一样自增，删除后不复用
+        self.routes = {
+            ("GET", "/api/contact/getlist/"): self.handle_getlist,
+            ("GET", "/api/contact/notifications/"): self.handle_notifications,
+            ("POST", "/api/contact/offlinemessages/"): self.handle_get_offline,
+            ("POST", "/api/contact/ackofflinemessages/"): self.handle_ack_offline,
+            ("POST", "/api/contact/getofflinemessage/"): self.handle_get_offline_legacy,
+            ("POST", "/api/contact/deleteofflinemessage/"): self.handle_delete_offline_legacy,
+            ("POST", "/api/contact/sendofflinemessage/"): self.handle_send_offline,
+            ("POST", "/api/contact/sendofflinemessages/"): self.handle_send_offline_batch,
+        }
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    # ---- 数据变更 ----
+    def put_friend(self, user_id, **fields):
+        """新增或修改好友，fields 为 username/nickname/userpk/user_status/user_ipaddr/user_port"""
+        with self.lock:
+            self.version += 1
+            friend = dict(self.friends.get(user_id) or {
+                "userid": user_id,
+                "username": f"user{user_id}",
+                "nickname": "",
+                "userpk": "",
+                "user_status": "offline",
+                "user_ipaddr": "",
+                "user_port": "",
+            })
+            friend.update(fields)
+            self.friends[user_id] = friend
+            self.updated[user_id] = self.version
+            self.removed.pop(user_id, None)
+
+    def push_event(self, event_type, **data):
+        """追加一条通知事件并唤醒挂起的长轮询"""
+        with self.lock:
+            self.events.append({"id": len(self.events) + 1, "type": event_type, "data": data})
+            self.events_changed.notify_all()
+
+    def put_offline_message(self, sender_id, content):
+        """投递一条发给当前用户的离线消息"""
+        with self.lock:
+            message_id = next(self.offline_ids)
+            self.offline_inbox[message_id] = {
+                "id": message_id,
+                "senderid": sender_id,
+                "sendername": self.friends.get(sender_id, {}).get("username", f"user{sender_id}"),
+                "content": content,
+                "time": "2026-01-01 12:00:00",
+            }
+            return message_id
+
+    def remove_friend(self, user_id):
+        with self.lock:
+            self.version += 1
+            self.friends.pop(user_id, None)
+            self.updated.pop(user_id, None)
+            self.removed[user_id] = self.version
+
+    # ---- 接口 ----
+    def handle_getlist(self, handler, query, body):
+        with self.lock:
+            etag = f'"{self.version}"'
+            if handler.headers.get("If-None-Match") == etag:
+                return 304, None, {"ETag": etag}
+
+            since = query.get("since")
+            if since is not None:
+                since = int(since)
+                friends = [self.friends[uid] for uid, version in self.updated.items() if version > since]
+                removed = [uid for uid, version in self.removed.items() if version > since]
+                data = {"friends": friends, "removed": removed, "incremental": True, "version": self.version}
+            else:
+                data = {"friends": list(self.friends.values()), "version": self.version}
+            return 200, data, {"ETag": etag}
+
+    def handle_notifications(self, handler, query, body):
+        cursor = int(query.get("cursor", 0))
+        timeout = float(query.get("timeout", 25))
+        with self.lock:
+            self.events_changed.wait_for(lambda: len(self.events) > cursor, timeout)
+            events = self.events[cursor:]
+            return 200, {"events": events, "cursor": cursor + len(events)}, None
+
+    def handle_get_offline(self, handler, query, body):
+        after = body.get("after") or 0
+        limit = body.get("limit", 100)
+        with self.lock:
+            pending = [self.offline_inbox[i] for i in sorted(self.offline_inbox) if i > after]
+            page = pending[:limit]
+            next_cursor = page[-1]["id"] if len(pending) > limit else None
+            return 200, {"messages": page, "next": next_cursor}, None
+
+    def handle_ack_offline(self, handler, query, body):
+        with self.lock:
+            ids = body.get("ids", [])
+            for message_id in ids:
+                self.offline_inbox.pop(message_id, None)
+            return 200, {"deleted": len(ids)}, None
+
+    def handle_get_offline_legacy(self, handler, query, body):
+        """旧接口：忽略请求体，返回全部离线消息"""
+        with self.lock:
+            return 200, {"messages": [self.offline_inbox[i] for i in sorted(self.offline_inbox)]}, None
+
+    def handle_delete_offline_legacy(self, handler, query, body):
+        """旧接口：忽略请求体，删除全部离线消息"""
+        with self.lock:
+            count = len(self.offline_inbox)
+            self.offline_inbox.clear()
+            return 200, {"deleted": count}, None
+
+    def handle_send_offline(self, handler, query, body):
+        with self.lock:
+            self.offline_sent.append(body)
+            return 201, {"message": "发送成功"}, None
+
+    def handle_send_offline_batch(self, handler, query, body):
+        with self.lock:
+            self.offline_sent.extend(body.get("messages", []))
+            return 201, {"message": "发送成功", "count": len(body.get("messages", []))}, None
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self, method):
+                parsed = urlparse(self.path)
+                server.requests.append((method, parsed.path))
+                length = int(self.headers.get("Content-Length") or 0)
+                body = json.loads(self.rfile.read(length)) if length else {}
+                query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+                route = server.routes.get((method, parsed.path))
+                if route is None:
+                    self._reply(404, {"message": "not found"})
+                elif self.headers.get("Authorization") != f"Token {server.token}":
+                    self._reply(401, {"message": "未认证"})
+                else:
+                    self._reply(*route(self, query, body))
+
+            def _reply(self, status, data, headers=None):
+                payload = json.dumps(data).encode() if data is not None else b""
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def use_stub_server(server):
+    """让 panel.connect 指向替身服务器，并以替身 token 登录"""
+    from panel import connect, session
+    from panel.credentials import Credentials
+    connect.Url = f"{server.url}/api/contact"
+    Credentials().set(1, server.token)
+    session.set_auth_token(server.token)
+
+
+def test_friend_sync():
+    from panel import connect
+    from panel.storage import SecureStorage
+
+    server = StubServer().start()
+    use_stub_server(server)
+
+    saved_keys = []
+    storage = SecureStorage()
+    original_save_key = storage.save_key
+    storage.save_key = lambda user_id, public_key, session_key=None: saved_keys.append(user_id)
+
+    try:
+        for user_id in range(2, 102):
+            server.put_friend(user_id, userpk=f"pk{user_id}")
+
+        result = connect.sync_friends()
+        assert len(result["friends"]) == 100 and len(saved_keys) == 100
+
+        # 无变化：304，不写数据库
+        saved_keys.clear()
+        result = connect.sync_friends()
+        assert result["changed"] == [] and saved_keys == []
+
+        # 只改在线状态：公钥不变，不调用 save_key
+        server.put_friend(5, user_status="online")
+        result = connect.sync_friends()
+        assert [f["userid"] for f in result["changed"]] == [5] and saved_keys == []
+
+        # 改公钥、删好友
+        server.put_friend(6, userpk="pk6-new")
+        server.remove_friend(7)
+        result = connect.sync_friends()
+        assert saved_keys == [6] and result["removed"] == [7] and len(result["friends"]) == 99
+        print("✅ 好友增量同步测试通过！")
+    finally:
+        storage.save_key = original_save_key
+        server.stop()
+
+
+def test_notification_channel():
+    import time
+    from panel import connect
+    from panel.presence import PresenceCache
+
+    server = StubServer().start()
+    use_stub_server(server)
+    channel = connect.NotificationChannel(poll_timeout=1)
+    received = []
+    channel.subscribe(received.extend)
+    channel.start()
+
+    try:
+        time.sleep(0.3)
+        sent_at = time.monotonic()
+        server.push_event(connect.NotificationChannel.EVENT_PRESENCE, userid=5, user_status="online")
+        server.push_event(connect.NotificationChannel.EVENT_FRIEND_REQUEST, username="carol")
+        while len(received) < 2 and time.monotonic() - sent_at < 2:
+            time.sleep(0.01)
+        latency = time.monotonic() - sent_at
+
+        assert [event["type"] for event in received] == ["presence", "friend_request"]
+        assert PresenceCache().is_online(5)
+        assert latency < 1, latency
+        print(f"✅ 通知通道测试通过！延迟 {latency * 1000:.1f} ms")
+    finally:
+        channel.stop()
+        server.stop()
+
+
+def test_offline_inbox():
+    from panel import connect
+    from panel.storage import SecureStorage
+
+    server = StubServer().start()
+    use_stub_server(server)
+    storage = SecureStorage()
+
+    try:
+        for i in range(250):
+            server.put_offline_message(2, f"offline {i}")
+
+        # 第一页保存后确认失败：消息留在服务器上
+        original_ack = connect.ack_offline_messages
+        connect.ack_offline_messages = lambda ids: {"error": "确认失败", "message": "模拟断网"}
+        try:
+            connect.sync_offline_inbox()
+        except ConnectionError:
+            pass
+        connect.ack_offline_messages = original_ack
+        assert len(server.offline_inbox) == 250
+
+        # 重新同步：已保存的第一页不会重复插入，全部确认后服务器清空
+        saved = connect.sync_offline_inbox()
+        fetches = [r for r in server.requests if r[1].endswith("/offlinemessages/")]
+        assert len(saved) == 150 and not server.offline_inbox, (len(saved), len(server.offline_inbox))
+        assert len(fetches) == 4
+        assert len([m for m in storage.read_recv_data(2) if m[1].startswith("offline ")]) == 250
+
+        # 无法解密的消息和发送者未知的消息不保存也不确认，留在服务器上
+        broken_id = server.put_offline_message(2, "E2E1:broken:broken")
+        stranger_id = server.put_offline_message(None, "from stranger")
+        server.offline_inbox[stranger_id]["sendername"] = "stranger"
+        normal_id = server.put_offline_message(2, "offline after")
+        saved = connect.sync_offline_inbox()
+        assert [m["id"] for m in saved] == [normal_id], saved
+        assert sorted(server.offline_inbox) == [broken_id, stranger_id], sorted(server.offline_inbox)
+
+        # 服务器只有旧接口：有消息无法保存时不能删除全部，都保存后才删除
+        del server.routes[("POST", "/api/contact/offlinemessages/")]
+        legacy_id = server.put_offline_message(2, "offline legacy")
+        saved = connect.sync_offline_inbox()
+        assert [m["id"] for m in saved] == [legacy_id], saved
+        assert sorted(server.offline_inbox) == [broken_id, stranger_id, legacy_id]
+        for message_id in (broken_id, stranger_id):
+            del server.offline_inbox[message_id]
+        server.offline_inbox[next(server.offline_ids)] = {"sendername": "user2", "senderid": 2, "content": "no id"}
+        assert connect.sync_offline_inbox() == [] and len(server.offline_inbox) == 2
+        del server.offline_inbox[max(server.offline_inbox)]
+        assert connect.sync_offline_inbox() == [] and not server.offline_inbox
+        print("✅ 离线消息分页同步测试通过！")
+    finally:
+        server.stop()
+
+
+def test_outbox():
+    import time
+    from panel.outbox import OutboxWorker
+    from panel.storage import SecureStorage
+    from panel.encrypt import CryptoManager
+    from settings import OutboxRetryBase
+
+    server = StubServer().start()
+    use_stub_server(server)
+    crypto_manager = CryptoManager()
+    storage = SecureStorage()
+    # 好友 2、3 的公钥用本机公钥代替，便于验证解密
+    for user_id in (2, 3):
+        storage.save_key(user_id, crypto_manager.public_key_str)
+    outbox = OutboxWorker()
+    states = []
+    outbox.subscribe(lambda outbox_id, state: states.append((outbox_id, state)))
+    batch_route = ("POST", "/api/contact/sendofflinemessages/")
+
+    try:
+        # 服务器不可用：消息留在发件箱中等待重试
+        handler = server.routes[batch_route]
+        server.routes[batch_route] = lambda *args: (503, {"message": "忙"}, None)
+        ids = [outbox.enqueue(2 + i % 2, f"user{2 + i % 2}", f"burst {i}") for i in range(20)]
+        outbox.deliver_due()
+        pending = [entry[0] for entry in storage.get_undelivered_outbox()]
+        assert not states and set(ids) <= set(pending)
+
+        # 服务器恢复后（退避结束）发给两个好友的消息在一个请求中加密上传
+        server.routes[batch_route] = handler
+        time.sleep(OutboxRetryBase + 0.1)
+        uploads_before = server.requests.count(batch_route)
+        outbox.deliver_due()
+        pending = [entry[0] for entry in storage.get_undelivered_outbox()]
+        assert not set(ids) & set(pending)
+        assert server.requests.count(batch_route) - uploads_before == 1
+        uploaded = server.offline_sent[-20:]
+        assert all(not message["content"].startswith("burst") for message in uploaded)
+        assert [crypto_manager.decrypt_from_friend(message["content"]) for message in uploaded] == \
+            [f"burst {i}" for i in range(20)]
+        assert len([state for _, state in states if state == SecureStorage.OUTBOX_DELIVERED]) == 20
+
+        # 服务器没有批量接口：逐条发送中途失败，已发出的消息不会重发
+        del server.routes[batch_route]
+        single_route = ("POST", "/api/contact/sendofflinemessage/")
+        single_handler = server.routes[single_route]
+        calls = []
+
+        def flaky_single(*args):
+            calls.append(1)
+            return (503, {"message": "忙"}, None) if len(calls) == 3 else single_handler(*args)
+
+        server.routes[single_route] = flaky_single
+        ids = [outbox.enqueue(2, "user2", f"single {i}") for i in range(5)]
+        outbox.deliver_due()
+        pending = [entry[0] for entry in storage.get_undelivered_outbox()]
+        assert pending == ids[2:], (pending, ids)
+        time.sleep(OutboxRetryBase + 0.1)
+        outbox.deliver_due()
+        assert not storage.get_undelivered_outbox()
+        assert [crypto_manager.decrypt_from_friend(message["content"]) for message in server.offline_sent[-5:]] == \
+            [f"single {i}" for i in range(5)]
+        print("✅ 发件箱加密批量投递测试通过！")
+    finally:
+        outbox.stop()
+        server.stop()
+
+
+if __name__ == "__main__":
+    test_friend_sync()
+    test_notification_channel()
+    test_offline_inbox()
+    test_outbox()
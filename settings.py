@@ -1 +1,53 @@
-BaseUrl = "http://localhost:8000"
\ No newline at end of file
+BaseUrl = "http://localhost:8000"
+
+# HTTP 客户端参数（panel.session）
+RequestTimeout = (3.05, 10)  # (连接超时, 读取超时) 秒
+RequestRetries = 3           # 幂等请求及连接失败的最大重试次数
+RequestBackoff = 0.5         # 重试退避系数：0.5s, 1s, 2s ...
+RequestPoolSize = 10         # 连接池大小，需覆盖后台线程数
+
+# 在线状态缓存（panel.presence）
+PresenceTTL = 30              # 服务器返回的在线状态有效期，秒
+PresenceRefreshInterval = 15  # 后台刷新好友在线状态的间隔，秒
+
+# 通知通道（panel.connect.NotificationChannel）
+NotificationPollTimeout = 25  # 长轮询在服务器端最多挂起的时间，秒
+NotificationMaxBackoff = 30   # 连接失败后的最大重连间隔，秒
+
+# 离线消息分页大小（panel.connect.sync_offline_inbox）
+OfflinePageSize = 100
+
+# 发件箱投递（panel.outbox）
+OutboxPollInterval = 5   # 没有新消息时检查到期重试的间隔，秒
+OutboxAckTimeout = 10    # P2P 发出后等待回执的时间，超时则重新投递，秒
+OutboxRetryBase = 1      # 投递失败后的首次重试间隔，之后指数退避，秒
+OutboxRetryMax = 60      # 最大重试间隔，秒
+OutboxBatchSize = 50     # 一次批量上传的离线消息条数上限
+
+# 聊天记录分页大小（ChatWindow 选择好友和向上滚动时加载）
+HistoryPageSize = 50
+
+# 会话缓存（ui.conversation_cache），超出任一限制时淘汰最久未查看的会话
+ConversationCacheSize = 10                  # 最多缓存的会话数
+ConversationCacheBudget = 16 * 1024 * 1024  # 缓存消息的内存预算，字节
+
+# 界面更新按帧合并（ui.update_scheduler），每秒最多刷新的次数
+UiFrameRate = 60
+
+# 隐写图片传输（panel.p2p，MSG_TYPE_LSB）
+StegoStripRows = 64                  # 载体图片按行分块嵌入和编码，每块的行数
+StegoReceiveDir = "received_images"  # 收到的隐写图片保存目录
+StegoOutboxDir = "stego_outbox"      # 发送前在进程池中生成的隐写图片，发出后删除
+StegoWorkers = None                  # 隐写进程池的进程数，None 为 CPU 核数
+
+# 附件（panel.attachments），按内容 SHA-256 存放，同样的文件只存一份
+AttachmentDir = "attachments"
+MaxAttachmentSize = 2 * 1024 * 1024 * 1024  # 单个附件的大小上限，字节；对方声明的大小超过时拒绝接收
+ThumbnailSize = 200  # 聊天记录中图片缩略图的最长边，逻辑像素
+FileTransferEncrypt = True  # 附件内容是否逐块用会话密钥加密；局域网内传输本身已加密的内容时可关闭，改为明文零拷贝发送
+TransferThreads = 4  # 附件和隐写图片的 P2P 发送线程数，与服务器请求的线程池分开，大文件传输不会挡住界面的请求
+
+# P2P 上行限速（panel.send_scheduler），只让附件和隐写图片的数据块等待，文本和控制帧不受影响
+SendRateLimit = None      # 所有好友合计，字节/秒，None 不限
+PeerSendRateLimit = None  # 每个好友，字节/秒，None 不限
+StreamWindowSize = 2 * 1024 * 1024  # 每个传输流的流量控制窗口：发送方最多领先接收方处理进度的字节数
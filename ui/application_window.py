@@ -7,6 +7,7 @@ from PyQt6.QtGui import QFont, QIcon
 
 from widgets.application_item import FriendRequestWidget
 from panel.connect import create_friend_request, deletefriend, show_friend_request_list, deal_friend_request
+from ui.task_runner import TaskRunner
 
 class FriendRequestWindow(QMainWindow):
     """好友申请管理主窗口"""
@@ -19,6 +20,7 @@ class FriendRequestWindow(QMainWindow):
         self.current_user = current_user
         self.setWindowTitle("好友申请管理")
         self.setGeometry(300, 300, 400, 500)
+        self.task_runner = TaskRunner(self)
         self.setup_ui()
         self.respond_request.connect(self.on_respond_request)
 
@@ -131,25 +133,30 @@ class FriendRequestWindow(QMainWindow):
             QMessageBox.warning(self, "提示", "请输入用户名或邮箱")
             return
 
-        try:
-            self.add_btn.setEnabled(False)
-            self.add_btn.setIcon(QIcon("icons/loading.png"))  # 加载中图标
-            
-            response = create_friend_request(search_text)
-            
-            if 'error' in response:
-                QMessageBox.critical(self, "错误", response['error'])
-            else:
-                QMessageBox.information(self, "成功", "好友申请已发送")
-                self.search_input.clear()
-                
-        except ConnectionError:
-            QMessageBox.critical(self, "网络错误", "无法连接到服务器，请检查网络连接")
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"发生未知错误: {str(e)}")
-        finally:
-            self.add_btn.setEnabled(True)
-            self.add_btn.setIcon(QIcon("icons/add_friend.png"))
+        self.add_btn.setEnabled(False)
+        self.add_btn.setIcon(QIcon("icons/loading.png"))  # 加载中图标
+        self.task_runner.submit(
+            create_friend_request, search_text,
+            on_done=self.on_request_sent,
+            on_error=self.on_request_failed
+        )
+
+    def on_request_sent(self, response):
+        """好友申请发送完成"""
+        if 'error' in response:
+            QMessageBox.critical(self, "错误", response['error'])
+        else:
+            QMessageBox.information(self, "成功", "好友申请已发送")
+            self.search_input.clear()
+        self._reset_add_btn()
+
+    def on_request_failed(self, error):
+        QMessageBox.critical(self, "错误", f"发生未知错误: {error}")
+        self._reset_add_btn()
+
+    def _reset_add_btn(self):
+        self.add_btn.setEnabled(True)
+        self.add_btn.setIcon(QIcon("icons/add_friend.png"))
 
     def on_delete_friend(self):
         """处理删除好友请求"""
@@ -158,44 +165,59 @@ class FriendRequestWindow(QMainWindow):
             QMessageBox.warning(self, "提示", "请输入用户名或邮箱")
             return
 
-        try:
-            reply = QMessageBox.question(
-                self,
-                "确认删除",
-                f"确定要删除好友 {search_text} 吗?",
-                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-                QMessageBox.StandardButton.No
-            )
-            
-            if reply == QMessageBox.StandardButton.No:
-                return
-
-            self.delete_btn.setEnabled(False)
-            self.delete_btn.setIcon(QIcon("icons/loading.png"))  # 加载中图标
-            
-            is_email = "@" in search_text and "." in search_text
-            response = deletefriend("email" if is_email else "username", search_text)
-            
-            if "error" in response:
-                QMessageBox.warning(self, "失败", response.get('error', '未知错误'))
-            else:
-                QMessageBox.information(self, "成功", f"已删除好友 {search_text}")
-                self.search_input.clear()
-                # 发射信号并传递被删除的用户名
-                self.friend_deleted.emit(search_text)
-                
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"删除好友时出错: {str(e)}")
-        finally:
-            self.delete_btn.setEnabled(True)
-            self.delete_btn.setIcon(QIcon("icons/delete_friend.png"))
+        reply = QMessageBox.question(
+            self,
+            "确认删除",
+            f"确定要删除好友 {search_text} 吗?",
+            QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+            QMessageBox.StandardButton.No
+        )
+        
+        if reply == QMessageBox.StandardButton.No:
+            return
+
+        self.delete_btn.setEnabled(False)
+        self.delete_btn.setIcon(QIcon("icons/loading.png"))  # 加载中图标
+        
+        is_email = "@" in search_text and "." in search_text
+        self.task_runner.submit(
+            deletefriend, "email" if is_email else "username", search_text,
+            on_done=lambda response: self.on_friend_deleted(search_text, response),
+            on_error=self.on_delete_failed
+        )
+
+    def on_friend_deleted(self, search_text, response):
+        """删除好友完成"""
+        if "error" in response:
+            QMessageBox.warning(self, "失败", response.get('error', '未知错误'))
+        else:
+            QMessageBox.information(self, "成功", f"已删除好友 {search_text}")
+            self.search_input.clear()
+            # 发射信号并传递被删除的用户名
+            self.friend_deleted.emit(search_text)
+        self._reset_delete_btn()
+
+    def on_delete_failed(self, error):
+        QMessageBox.critical(self, "错误", f"删除好友时出错: {error}")
+        self._reset_delete_btn()
+
+    def _reset_delete_btn(self):
+        self.delete_btn.setEnabled(True)
+        self.delete_btn.setIcon(QIcon("icons/delete_friend.png"))
 
     def load_friend_requests(self, test_mode=False):
         """加载好友申请列表"""
+        self.task_runner.submit(
+            show_friend_request_list,
+            on_done=self.on_friend_requests_loaded,
+            on_error=lambda error: QMessageBox.critical(self, "错误", f"加载好友申请时出错: {error}")
+        )
+
+    def on_friend_requests_loaded(self, response):
+        """好友申请列表加载完成"""
         self.clear_requests()
-        
+
         try:
-            response = show_friend_request_list()
             # 先判断返回结构
             if isinstance(response, dict) and "data" in response and isinstance(response["data"], list):
                 for request in response["data"]:
@@ -230,10 +252,16 @@ class FriendRequestWindow(QMainWindow):
 
     def on_respond_request(self, username, accepted):
         """处理好友申请响应"""
+        action = 1 if accepted else 0
+        self.task_runner.submit(
+            deal_friend_request, username, action,
+            on_done=lambda response: self.on_request_dealt(username, accepted, response),
+            on_error=lambda error: QMessageBox.critical(self, "错误", f"处理好友申请时出错: {error}")
+        )
+
+    def on_request_dealt(self, username, accepted, response):
+        """好友申请处理完成"""
         try:
-            action = 1 if accepted else 0
-            response = deal_friend_request(username, action)
-            
             if 'error' in response: 
                 QMessageBox.warning(self, "失败", response.get('error', '未知错误'))
             else:
@@ -244,6 +272,11 @@ class FriendRequestWindow(QMainWindow):
         except Exception as e:
             QMessageBox.critical(self, "错误", f"处理好友申请时出错: {str(e)}")
 
+    def closeEvent(self, event):
+        """关闭窗口时取消未完成的请求"""
+        self.task_runner.cancel_all()
+        super().closeEvent(event)
+
     def _remove_request(self, username):
         """从列表中移除指定的好友申请"""
         for i in range(self.list_layout.count()):
@@ -3,26 +3,38 @@ from pathlib import Path
 from datetime import datetime
 import os
 from PyQt6.QtWidgets import (
-    QMainWindow, QSplitter, QListWidget, QListWidgetItem, 
-    QScrollArea, QWidget, QVBoxLayout, QHBoxLayout, 
+    QMainWindow, QSplitter,
+    QWidget, QVBoxLayout, QHBoxLayout, 
     QLineEdit, QPushButton, QLabel, QSizePolicy, QApplication, QDialog, QMessageBox
 )
-from PyQt6.QtCore import Qt, QSize, QTimer, pyqtSignal
-from PyQt6.QtGui import QFont
+from PyQt6.QtCore import Qt, QSize, QTimer, QUrl, pyqtSignal
+from PyQt6.QtGui import QFont, QDesktopServices
 from panel.auth import logout
-from panel.connect import getlist, addfriend, deletefriend, updateinfo, get_user_profile, send_offline_message, get_offline_message, delete_offline_message
+from panel.connect import NotificationChannel, getlist, sync_friends, sync_offline_inbox, addfriend, deletefriend, updateinfo, get_user_profile
+from panel.p2p import P2PAPI
+from panel.presence import PresenceCache
+from panel.outbox import OutboxWorker
+from panel.storage import SecureStorage
+from panel.attachments import AttachmentStore
+from settings import PresenceRefreshInterval, HistoryPageSize, ConversationCacheSize, ConversationCacheBudget, StegoOutboxDir, TransferThreads
 from widgets.profile_widget import ProfileDialog
 
 # 添加项目根目录到Python路径
 sys.path.append(str(Path(__file__).parent.parent))
 
-from models.friend import Friend
-from widgets.avatar_label import AvatarLabel
-from widgets.chat_bubble import ChatBubble
-from widgets.friend_item import FriendItemWidget
+from models.chat_message import ChatMessage
+from widgets.chat_view import ChatView, ChatMessageModel
+from widgets.friend_list import FriendListModel, FriendFilterProxyModel, FriendListView
 from widgets.friend_list_header import FriendListHeader
 from widgets.profile_widget import ProfileWidget
 from widgets.chat_input import ChatInputWidget
+from ui.p2p_bridge import P2PSignalBridge
+from ui.notification_bridge import NotificationBridge
+from ui.outbox_bridge import OutboxBridge
+from ui.task_runner import TaskRunner
+from ui.conversation_cache import ConversationCache
+from ui.update_scheduler import UiUpdateScheduler
+from ui.stego_worker import StegoWorker
 
 class ChatWindow(QMainWindow):
     logout_requested = pyqtSignal() 
@@ -30,21 +42,32 @@ class ChatWindow(QMainWindow):
     def __init__(self, username):
         super().__init__()
         self.current_user = username
-        self.friends = []  # 好友列表
-        self.friends_list = []  # 好友用户名列表
+        self.friend_model = FriendListModel()  # 好友列表，以 user_id 为键增量更新
+        self.friends_data = {}  # username -> 资料卡数据
         self.current_friend = None
+        # 最近查看的会话（消息、翻页游标、滚动位置），切回时直接复用
+        self.conversations = ConversationCache(ConversationCacheSize, ConversationCacheBudget)
+        self.current_conversation = None
+        self.p2p_api = None
         self.setWindowTitle(f"我的QQ - {username}")
         self.setGeometry(100, 100, 800, 600)
+        # 所有服务器请求都在后台线程中执行
+        self.task_runner = TaskRunner(self)
+        # P2P 文件传输可能持续很久，使用单独的线程池
+        self.transfer_runner = TaskRunner(self, max_threads=TransferThreads)
+        # 高频事件（消息、在线状态、状态栏）按帧合并后再更新界面
+        self.ui_updates = UiUpdateScheduler(self)
+        # 隐写的嵌入/提取在进程池中执行
+        self.stego_worker = StegoWorker(self)
+        self.stego_job = None
 
-        # 用户数据初始化
-        self.user_data = get_user_profile()
-        if "error" in self.user_data:
-            QMessageBox.critical(self, "错误", self.user_data["message"])
-            self.user_data = {
-                "username": self.current_user,
-                "nickname": "",  # fallback
-                "email": ""
-            }
+        # 用户数据初始化（先用默认值，资料在后台加载）
+        self.user_data = {
+            "username": self.current_user,
+            "nickname": "",  # fallback
+            "email": ""
+        }
+        self.task_runner.submit(get_user_profile, on_done=self.on_user_profile_loaded)
         
         # 主分割布局
         self.splitter = QSplitter(Qt.Orientation.Horizontal)
@@ -57,13 +80,23 @@ class ChatWindow(QMainWindow):
         # 设置初始分割比例
         self.splitter.setSizes([200, 600])
         # 底部状态栏
-        self.statusBar().showMessage("状态: 已连接")
+        self.show_status("状态: 已连接")
         
         # 设置聊天区域和输入区域的比例为7:3
         self.chat_layout.setStretch(1, 3)
         
         # 初始化好友列表
         self.init_friends()
+        # 启动 P2P 服务并订阅消息推送
+        self.init_p2p()
+        # 启动发件箱投递
+        self.init_outbox()
+        # 订阅服务器推送的通知（在线状态、好友申请、离线消息）
+        self.init_notifications()
+        # 通知通道断开时，定时在后台刷新好友在线状态
+        self.presence_timer = QTimer(self)
+        self.presence_timer.timeout.connect(self.refresh_presence)
+        self.presence_timer.start(PresenceRefreshInterval * 1000)
 
         # 连接头像点击事件
         self.friend_list_header.avatar_clicked.connect(
@@ -85,25 +118,13 @@ class ChatWindow(QMainWindow):
         left_layout.addWidget(self.friend_list_header)
         
         # 好友列表
-        self.friend_list = QListWidget()
-        self.friend_list.setStyleSheet("""
-            QListWidget {
-                border: none;
-                background: #f5f5f5;
-                font-family: Microsoft YaHei;
-            }
-            QListWidget::item {
-                height: 50px;
-                border-bottom: 1px solid #e0e0e0;
-            }
-            QListWidget::item:hover {
-                background: #e6e6e6;
-            }
-            QListWidget::item:selected {
-                background: #d6d6d6;
-            }
-        """)
-        self.friend_list.itemClicked.connect(self.on_friend_selected)
+        # 搜索框输入经代理模型过滤，不重建任何列表项
+        self.friend_proxy = FriendFilterProxyModel(self)
+        self.friend_proxy.setSourceModel(self.friend_model)
+        self.friend_list_header.search_changed.connect(self.friend_proxy.set_query)
+        self.friend_list = FriendListView()
+        self.friend_list.setModel(self.friend_proxy)
+        self.friend_list.clicked.connect(self.on_friend_selected)
         
         left_layout.addWidget(self.friend_list)
         self.splitter.addWidget(left_widget)
@@ -129,21 +150,12 @@ class ChatWindow(QMainWindow):
         """)
         self.chat_layout.addWidget(self.chat_title)
         
-        # 聊天内容区域
-        self.chat_scroll = QScrollArea()
-        self.chat_scroll.setWidgetResizable(True)
-        self.chat_scroll.setStyleSheet("background: #f5f5f5; border: none;")
-        
-        self.chat_content = QWidget()
-        self.chat_content_layout = QVBoxLayout()
-        self.chat_content_layout.setAlignment(Qt.AlignmentFlag.AlignTop)
-        self.chat_content_layout.setContentsMargins(20, 20, 20, 20)
-        self.chat_content_layout.setSpacing(10)
-        self.chat_content.setLayout(self.chat_content_layout)
-        
-        self.chat_content_layout.addStretch()
-        self.chat_scroll.setWidget(self.chat_content)
-        self.chat_layout.addWidget(self.chat_scroll)
+        # 聊天内容区域：模型/委托绘制，只绘制可见的消息
+        self.chat_view = ChatView()
+        self.chat_view.avatar_clicked.connect(self.show_profile)
+        self.chat_view.attachment_clicked.connect(self.open_attachment)
+        self.chat_view.top_reached.connect(self.load_older_history)
+        self.chat_layout.addWidget(self.chat_view)
         
         # 输入区域
         self.create_input_area()
@@ -155,147 +167,428 @@ class ChatWindow(QMainWindow):
         self.input_area = ChatInputWidget()
         self.input_area.send_message_signal.connect(self.send_message_from_input)
         self.input_area.send_file_signal.connect(self.handle_file_selected)
+        self.input_area.send_stego_signal.connect(self.handle_stego_selected)
+        self.input_area.reveal_stego_signal.connect(self.handle_stego_reveal)
+        self.input_area.stego_cancel_requested.connect(self.cancel_stego)
         self.chat_layout.addWidget(self.input_area)
 
     def handle_file_selected(self, file_path):
-        """处理选择的文件"""
-        if self.current_friend:
-            file_name = os.path.basename(file_path)
-            self.append_message(self.username, f"[文件] {file_name}", True)
+        """发送文件或图片：后台存入附件存储（计算摘要、去重）后通过 P2P 发送"""
+        friend = self.current_friend
+        if friend is None:
+            QMessageBox.warning(self, "错误", "请先选择聊天对象")
+            return
+        if self.p2p_api is None or not self.p2p_api.has_session(friend.user_id):
+            QMessageBox.warning(self, "错误", "文件只能发送给已建立 P2P 会话的好友")
+            return
+        self.task_runner.submit(
+            AttachmentStore().import_file, file_path,
+            on_done=lambda attachment: self.on_attachment_imported(friend, attachment),
+            on_error=lambda error: self.show_status(f"状态: 读取文件失败 {error}")
+        )
+
+    def on_attachment_imported(self, friend, attachment):
+        content = attachment.to_content()
+        if friend is self.current_friend:
+            self.append_message(self.current_user, content, True)
+        self.transfer_runner.submit(
+            self.p2p_api.send_file, friend.user_id, content, AttachmentStore().path_of(attachment.sha256),
+            on_done=lambda transfer_id: transfer_id is None and self.show_status(f"状态: {attachment.name} 发送失败"),
+            on_error=lambda error: self.show_status(f"状态: {attachment.name} 发送失败 {error}")
+        )
+
+    def open_attachment(self, attachment):
+        """用系统默认程序打开附件"""
+        store = AttachmentStore()
+        if not store.has(attachment.sha256):
+            self.show_status(f"状态: 本地没有 {attachment.name}")
+            return
+        QDesktopServices.openUrl(QUrl.fromLocalFile(os.path.abspath(store.named_path(attachment))))
+
+    def stego_session_key(self, friend):
+        """隐写图片只通过 P2P 收发，内容用当前会话密钥加密"""
+        if friend is None or self.p2p_api is None:
+            return None
+        return self.p2p_api.get_session_key(friend.user_id)
+
+    def handle_stego_selected(self, message, image_path):
+        """把文字加密后藏入图片：在进程池中生成隐写 PNG，完成后通过 P2P 发送"""
+        friend = self.current_friend
+        session_key = self.stego_session_key(friend)
+        if session_key is None:
+            QMessageBox.warning(self, "错误", "隐写图片只能发送给已建立 P2P 会话的好友")
+            return
+        payload = self.p2p_api.get_crypto_manager().aes_encrypt_auto(message, session_key)["encrypted_message"].encode()
+        os.makedirs(StegoOutboxDir, exist_ok=True)
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        output_path = os.path.join(StegoOutboxDir, f"{datetime.now():%Y%m%d%H%M%S%f}_{name}.png")
+        job = self.stego_worker.encode(
+            image_path, output_path, payload,
+            on_done=lambda path: self.on_stego_prepared(friend, message, path),
+            on_error=lambda error: self.on_stego_failed("生成隐写图片失败", error)
+        )
+        # 任务刚完成时取消，输出文件已经生成
+        job.cancelled.connect(lambda: os.path.exists(output_path) and os.remove(output_path))
+        self.start_stego_job(job)
+
+    def handle_stego_reveal(self, image_path):
+        """在进程池中读取图片隐藏的内容，用与当前好友的会话密钥解密"""
+        friend = self.current_friend
+        self.start_stego_job(self.stego_worker.decode(
+            image_path,
+            on_done=lambda payload: self.on_stego_revealed(friend, payload),
+            on_error=lambda error: self.on_stego_failed("读取隐写内容失败", error)
+        ))
+
+    def start_stego_job(self, job):
+        self.stego_job = job
+        job.progress.connect(self.input_area.set_stego_progress)
+        job.done.connect(self.on_stego_job_done)
+        self.input_area.set_stego_progress(0)
+
+    def cancel_stego(self):
+        if self.stego_job is not None:
+            self.stego_job.cancel()
+            self.show_status("状态: 已取消隐写")
+
+    def on_stego_job_done(self):
+        self.stego_job = None
+        self.input_area.finish_stego()
+
+    def on_stego_prepared(self, friend, message, path):
+        """隐写图片已生成，在传输线程池中发送，发出后删除临时文件"""
+        def send():
+            try:
+                return self.p2p_api.send_stego_file(friend.user_id, message, path)
+            finally:
+                os.remove(path)
+
+        self.transfer_runner.submit(
+            send,
+            on_done=lambda transfer_id: self.on_stego_sent(friend, message, transfer_id),
+            on_error=lambda error: self.on_stego_failed("发送隐写图片失败", error)
+        )
+
+    def on_stego_sent(self, friend, message, transfer_id):
+        if transfer_id is None:
+            self.show_status("状态: 发送隐写图片失败，P2P 会话已断开")
+        elif friend is self.current_friend:
+            self.append_message(self.current_user, f"[隐写图片] {message}", True)
+
+    def on_stego_revealed(self, friend, payload):
+        session_key = self.stego_session_key(friend)
+        try:
+            if session_key is None:
+                raise ValueError("没有与当前好友的 P2P 会话")
+            content = self.p2p_api.get_crypto_manager().aes_decrypt_auto(payload.decode("ascii"), session_key, "str")
+        except Exception as e:
+            self.show_status(f"状态: 无法解密图片中的内容 {e}")
+            return
+        QMessageBox.information(self, "隐写内容", content)
+
+    def on_stego_failed(self, action, error):
+        self.show_status(f"状态: {action} {error}")
+
+    def on_user_profile_loaded(self, user_data):
+        """后台加载个人资料完成"""
+        if "error" in user_data:
+            QMessageBox.critical(self, "错误", user_data["message"])
+            return
+        self.user_data = user_data
 
     def init_friends(self):
-        if not hasattr(self, "friends_data"):
-            self.friends_data = {}
-        """初始化好友列表数据"""
+        """在后台获取好友列表"""
+        if getattr(self, "_friends_task", None):
+            self._friends_task.cancel()
+        self._friends_task = self.task_runner.submit(
+            getlist,
+            on_done=self.apply_friend_list,
+            on_error=self.on_friends_failed
+        )
+
+    def on_friends_failed(self, message):
+        self._friends_task = None
+        QMessageBox.critical(self, "错误", f"加载好友列表时出错: {message}")
+
+    def refresh_presence(self):
+        """
+        后台增量同步好友列表，在线状态缓存随之刷新；只有列表变化时才更新界面
+        通知通道在线时状态由推送更新，不再轮询
+        """
+        if self.notification_channel.is_connected():
+            return
+        if getattr(self, "_friends_task", None) or not PresenceCache().needs_refresh():
+            return
+        self._friends_task = self.task_runner.submit(
+            sync_friends,
+            on_done=self.on_friends_synced,
+            on_error=lambda message: self.on_friends_synced({"error": message})
+        )
+
+    def on_friends_synced(self, response):
+        self._friends_task = None
+        if "error" in response:
+            self.show_status("状态: 刷新好友状态失败")
+        elif response["changed"] or response["removed"]:
+            self.friend_model.apply_changes(response["changed"], response["removed"])
+            self.update_friends_data(response["changed"])
+
+    def apply_friend_list(self, response):
+        """用服务器返回的完整好友列表刷新界面，只更新变化的行"""
+        self._friends_task = None
+        if "error" in response:
+            QMessageBox.warning(self, "错误", "获取好友列表失败")
+            return
         try:
-            response = getlist()
-            
-            self.friends.clear()
-            self.friend_list.clear()
-            self.friends_list = []
-            
-            if "error" in response:
-                QMessageBox.warning(self, "错误", "获取好友列表失败")
-                return
-            
-            for friend_data in response.get("friends", []):
-                try:
-                    friend = Friend(
-                        user_id=friend_data.get("userid"),
-                        username=friend_data.get("username"),
-                        nickname=friend_data.get("nickname", ""),
-                        status=friend_data.get("user_status", ""),
-                        ip=friend_data.get("user_ipaddr", ""),
-                        port=friend_data.get("user_port", ""),
-                    )
-                    self.friends.append(friend)
-                    self.friends_list.append(friend.username)
-                    self.add_friend_item(friend)
-                    
-                    # 保存好友数据
-                    self.friends_data[friend.username] = {
-                        "username": friend.username,
-                        "nickname": friend.nickname,
-                        "email": "",
-                        "friends": []
-                    }
-                except Exception as e:
-                    print(f"[错误] 好友数据字段缺失: {e}, 数据内容: {friend_data}")
-                    continue
+            friends = response.get("friends", [])
+            self.friend_model.set_friends(friends)
+            self.update_friends_data(friends)
+            # 好友列表加载前发送者无法识别的离线消息留在服务器上，现在重新合并
+            self.sync_offline_messages()
         except Exception as e:
             QMessageBox.critical(self, "错误", f"加载好友列表时出错: {str(e)}")
+
+    def update_friends_data(self, friends):
+        """保存好友资料卡数据"""
+        for friend_data in friends:
+            username = friend_data.get("username")
+            if username:
+                self.friends_data[username] = {
+                    "username": username,
+                    "nickname": friend_data.get("nickname", ""),
+                    "email": "",
+                    "friends": []
+                }
+
+    def init_p2p(self):
+        """启动 P2P 服务，并通过信号桥接收 P2P 线程推送的事件"""
+        try:
+            self.p2p_api = P2PAPI()
+        except Exception as e:
+            print(f"[P2P] 启动失败: {e}")
+            return
+
+        self.p2p_bridge = P2PSignalBridge(self.p2p_api, self)
+        self.p2p_bridge.messages_received.connect(self.on_p2p_messages)
+        self.p2p_bridge.presence_changed.connect(self.on_p2p_presence)
+
+    def init_outbox(self):
+        """启动发件箱投递线程，所有发出的消息都经发件箱投递"""
+        self.outbox = OutboxWorker(self.p2p_api)
+        self.outbox_bridge = OutboxBridge(self.outbox, self)
+        self.outbox_bridge.state_changed.connect(self.on_outbox_state_changed)
+        self.outbox.start()
+
+    def on_outbox_state_changed(self, outbox_id, state):
+        """发件箱中的消息投递状态变化"""
+        if state == SecureStorage.OUTBOX_DELIVERED:
+            self.show_status("状态: 消息已送达")
+
+    def init_notifications(self):
+        """启动长轮询通知通道"""
+        self.notification_channel = NotificationChannel()
+        self.notification_bridge = NotificationBridge(self.notification_channel, self)
+        self.notification_bridge.presence_changed.connect(self.on_presence_notified)
+        self.notification_bridge.friend_requests_received.connect(self.on_friend_requests_notified)
+        self.notification_bridge.offline_messages_received.connect(self.on_offline_messages_notified)
+        self.notification_channel.start()
+        # 登录后先合并一次离线期间积压的消息
+        self.sync_offline_messages()
+
+    def on_presence_notified(self, events):
+        """服务器推送的好友在线状态变化"""
+        for event in events:
+            data = event.get("data", {})
+            self.set_friend_online(data.get("userid"), data.get("user_status") == "online")
+
+    def on_friend_requests_notified(self, events):
+        """服务器推送的新好友申请"""
+        self.show_status(f"状态: 收到 {len(events)} 条新的好友申请")
+        request_window = getattr(self.friend_list_header, "friend_request_window", None)
+        if request_window is not None:
+            request_window.load_friend_requests()
+
+    def on_offline_messages_notified(self, events):
+        """服务器推送的离线消息到达通知"""
+        self.sync_offline_messages()
+
+    def sync_offline_messages(self):
+        """在后台分页拉取离线消息并合并进本地记录"""
+        if getattr(self, "_offline_task", None):
+            return
+        self._offline_task = self.task_runner.submit(
+            sync_offline_inbox,
+            on_done=self.on_offline_messages_synced,
+            on_error=self.on_offline_sync_failed
+        )
+
+    def on_offline_messages_synced(self, messages):
+        """显示新合并的离线消息"""
+        self._offline_task = None
+        unread = 0
+        for message in messages:
+            friend = self.find_friend_by_username(message.get("sendername"))
+            if friend is None:
+                continue
+            if not self.receive_message(friend, message.get("content", "")):
+                unread += 1
+        if unread:
+            self.show_status(f"状态: 收到 {unread} 条离线消息")
+
+    def on_offline_sync_failed(self, message):
+        self._offline_task = None
+        self.show_status(f"状态: 获取离线消息失败 {message}")
+
+    def set_friend_online(self, user_id, online):
+        """更新好友在线状态及其列表项（按帧合并，同一好友只取最后的状态）"""
+        self.ui_updates.queue("presence", (user_id, online), self.apply_presence)
+
+    def apply_presence(self, changes):
+        for user_id, online in dict(changes).items():
+            self.friend_model.set_online(user_id, online)
+
+    def find_friend(self, user_id):
+        """按用户 ID 查找好友"""
+        return self.friend_model.find(user_id)
+
+    def find_friend_by_username(self, username):
+        return self.friend_model.find_by_username(username)
+
+    def receive_message(self, friend, content):
+        """
+        显示收到的消息；不是当前会话时追加到缓存的会话中
+        :return: 是否在当前会话中显示
+        """
+        if self.current_friend and friend.user_id == self.current_friend.user_id:
+            self.append_message(friend.username, content, False)
+            return True
+        conversation = self.conversations.get(friend.user_id)
+        if conversation is not None:
+            self.queue_message(conversation.model, ChatMessage(friend.username, content, False, datetime.now()))
+        return False
+
+    def on_p2p_messages(self, events):
+        """批量处理收到的 P2P 消息"""
+        unread = 0
+        for event in events:
+            friend = self.find_friend(event.user_id)
+            if friend is None:
+                continue
+            content = event.data["content"]
+            if "image_path" in event.data:
+                content = f"[隐写图片] {content}"
+            if not self.receive_message(friend, content):
+                unread += 1
+        if unread:
+            self.show_status(f"状态: 收到 {unread} 条新消息")
+
+    def on_p2p_presence(self, events):
+        """批量处理好友在线状态变化"""
+        for event in events:
+            self.set_friend_online(event.user_id, event.data["online"])
     
-    def add_friend_item(self, friend):
-        """添加好友到列表"""
-        item = QListWidgetItem()
-        item.setSizeHint(QSize(200, 50))
-        
-        widget = FriendItemWidget(friend)
-        self.friend_list.addItem(item)
-        self.friend_list.setItemWidget(item, widget)
-    
-    def on_friend_selected(self, item):
+    def on_friend_selected(self, index):
         """好友选择事件处理"""
-        index = self.friend_list.row(item)
-        if index < len(self.friends):
-            self.current_friend = self.friends[index]
-            self.chat_title.setText(f"与 {self.current_friend.nickname or self.current_friend.username} 聊天中")
+        friend = index.data(FriendListModel.FriendRole) if index.isValid() else None
+        if friend is None:
+            return
+        if self.current_friend is not None and friend.user_id == self.current_friend.user_id:
+            return
+        self.current_friend = friend
+        self.chat_title.setText(f"与 {self.current_friend.nickname or self.current_friend.username} 聊天中")
+        self.load_history()
+
+    def load_history(self):
+        """
+        切换会话：缓存中有则直接换上它的模型和滚动位置，
+        否则换上空模型并在后台读取最新一页记录
+        """
+        if self.current_conversation is not None:
+            value, follow_bottom = self.chat_view.scroll_state()
+            self.current_conversation.scroll_value = value
+            self.current_conversation.follow_bottom = follow_bottom
+
+        conversation, cached = self.conversations.open(self.current_friend.user_id)
+        self.current_conversation = conversation
+        self.chat_view.set_conversation(conversation.model, conversation.scroll_value, conversation.follow_bottom)
+        if not cached:
+            self.load_older_history()
+
+    def load_older_history(self):
+        """在后台读取当前会话更早的一页记录，结果插入到顶部"""
+        conversation = self.current_conversation
+        if conversation is None or conversation.history_task or conversation.history_exhausted:
+            return
+        friend = self.current_friend
+        conversation.history_task = self.task_runner.submit(
+            SecureStorage().read_history, friend.user_id, conversation.history_cursor, HistoryPageSize,
+            on_done=lambda rows: self.on_history_loaded(conversation, friend, rows),
+            on_error=lambda message: self.on_history_failed(conversation, message)
+        )
+
+    def on_history_loaded(self, conversation, friend, rows):
+        """rows 按时间倒序，最后一行是下一页的游标"""
+        conversation.history_task = None
+        if len(rows) < HistoryPageSize:
+            conversation.history_exhausted = True
+        if not rows:
+            return
+        conversation.history_cursor = rows[-1][:3]
+        messages = []
+        for time_str, is_me, rowid, message in reversed(rows):
+            messages.append(ChatMessage(
+                self.current_user if is_me else friend.username,
+                message,
+                bool(is_me),
+                datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S"),
+                message_id=f"{'sent' if is_me else 'recv'}:{rowid}"
+            ))
+        if conversation is self.current_conversation:
+            self.chat_view.prepend_messages(messages)
+        else:
+            conversation.model.prepend_messages(messages)
+        self.conversations.trim(keep=self.current_conversation and self.current_conversation.user_id)
+
+    def on_history_failed(self, conversation, message):
+        conversation.history_task = None
+        self.show_status(f"状态: 读取聊天记录失败 {message}")
     
     def clear_chat_area(self):
-        """清空聊天区域"""
-        while self.chat_content_layout.count() > 1:
-            item = self.chat_content_layout.takeAt(0)
-            if item.widget():
-                item.widget().deleteLater()
+        """清空聊天区域，丢弃当前会话的缓存"""
+        if self.current_conversation is not None:
+            self.conversations.remove(self.current_conversation.user_id)
+            self.current_conversation = None
+        self.chat_view.set_conversation(ChatMessageModel(self))
     
     def send_message_from_input(self, message):
         """发送消息处理"""
         if message and self.current_friend:
             self.append_message(self.current_user, message, True)
-            # 获取好友在线状态
-            reponse = getlist()
-            for friend_data in reponse.get("friends", []):
-                if friend_data.get("username") == self.current_friend.username:
-                    friend_status = friend_data.get("user_status", "")
-                    if friend_status == "online":
-                        try:
-                            send_message(self.current_freind.username, message)  # 调用后端p2p发送消息接口
-                            break
-                        except Exception as e:
-                            QMessageBox.critical(self, "错误", f"发送消息时出错: {str(e)}")
-                            break
-                    else:
-                        try:
-                            send_offline_message(self.current_friend.username, content=message)  #调用后端发送离线消息接口
-                        except Exception as e:
-                            QMessageBox.critical(self, "错误", f"发送离线消息时出错: {str(e)}")
-                        break
+            # 写入发件箱后由投递线程负责 P2P/离线消息投递和重试
+            self.task_runner.submit(
+                self.outbox.enqueue, self.current_friend.user_id, self.current_friend.username, message,
+                on_error=lambda error: QMessageBox.critical(self, "错误", f"发送消息时出错: {error}")
+            )
         else :
             QMessageBox.warning(self, "错误", "消息不能为空或者对象未选择")
 
     def append_message(self, sender, message, is_me):
-        """添加消息到聊天区域"""
-        time_label = QLabel(datetime.now().strftime("%H:%M"))
-        time_label.setStyleSheet("""
-            QLabel {
-                font-family: Microsoft YaHei;
-                font-size: 10px;
-                color: gray;
-                background: transparent;
-            }
-        """)
-        time_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        
-        message_widget = QWidget()
-        message_widget.setStyleSheet("background: transparent;")
-        message_layout = QHBoxLayout()
-        message_widget.setLayout(message_layout)
-        
-        avatar = AvatarLabel(sender, size=40)
-        avatar.clicked.connect(lambda *args, u=sender, m=is_me: self.show_profile(u, m))
-        
-        bubble = ChatBubble(message, is_me)
-        
-        if is_me:
-            message_layout.addStretch()
-            message_layout.addWidget(bubble)
-            message_layout.addWidget(avatar)
-        else:
-            message_layout.addWidget(avatar)
-            message_layout.addWidget(bubble)
-            message_layout.addStretch()
-        
-        self.chat_content_layout.insertWidget(
-            self.chat_content_layout.count() - 1,
-            time_label
-        )
-        self.chat_content_layout.insertWidget(
-            self.chat_content_layout.count() - 1,
-            message_widget
-        )
-        
+        """添加消息到聊天区域，同一帧内的消息合并为一次插入"""
+        self.queue_message(self.chat_view.model(), ChatMessage(sender, message, is_me, datetime.now()))
         self.scroll_to_bottom()
 
+    def queue_message(self, model, message):
+        """登记要追加到某个会话模型的消息，下一帧批量插入"""
+        self.ui_updates.queue(("messages", id(model)), message, lambda messages: self.flush_messages(model, messages))
+
+    def flush_messages(self, model, messages):
+        model.append_messages(messages)
+        self.conversations.trim(keep=self.current_conversation and self.current_conversation.user_id)
+
+    def show_status(self, text):
+        """更新状态栏，一帧内只显示最后一条"""
+        self.ui_updates.post("status", lambda: self.statusBar().showMessage(text))
+
     def show_profile(self, username, is_current_user=False):
         """显示用户资料对话框"""
         if is_current_user:
@@ -303,7 +596,7 @@ class ChatWindow(QMainWindow):
                 'username': self.current_user,
                 'nickname': self.user_data.get('nickname', self.current_user),
                 'email': self.user_data.get('email', ''),
-                'friends': self.friends_list
+                'friends': [friend.username for friend in self.friend_model.friends()]
             }
         else:
             profile_data = self.friends_data.get(username, {
@@ -333,28 +626,52 @@ class ChatWindow(QMainWindow):
         profile_dialog.exec()
 
     def handle_logout(self):
-        """处理登出请求"""
-        try:
-            response = logout()
-            if 'error' not in response:
-                # 登出成功
-                self.logout_requested.emit()  # 通知主窗口
-                self.close()  # 关闭聊天窗口
-                
-                # 清理数据
-                self.cleanup_session_data()
-                
-                # 显示登录界面
-                self.show_login_window()
-            else:
-                QMessageBox.warning(self, "错误", response.get('error', '登出失败'))
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"登出时出错: {str(e)}")
+        """处理登出请求（后台提交）"""
+        if getattr(self, "_logout_task", None):
+            return
+        self._logout_task = self.task_runner.submit(
+            logout,
+            on_done=self.on_logged_out,
+            on_error=self.on_logout_failed
+        )
+
+    def on_logged_out(self, response):
+        """登出请求完成"""
+        self._logout_task = None
+        if 'error' in response:
+            QMessageBox.warning(self, "错误", response.get('error', '登出失败'))
+            return
+        self.logout_requested.emit()  # 通知主窗口
+        self.close()  # 关闭聊天窗口，closeEvent 中清理会话数据
+
+        # 显示登录界面
+        self.show_login_window()
+
+    def on_logout_failed(self, message):
+        self._logout_task = None
+        QMessageBox.critical(self, "错误", f"登出时出错: {message}")
 
     def cleanup_session_data(self):
-        """清理会话数据"""
+        """清理会话数据（只执行一次）"""
+        if getattr(self, "_session_cleaned", False):
+            return
+        self._session_cleaned = True
         # 这里可以添加清理本地缓存、cookie等逻辑
-        pass
+        if hasattr(self, "p2p_bridge"):
+            self.p2p_bridge.close()
+        self.notification_bridge.close()
+        self.notification_channel.stop()
+        self.outbox_bridge.close()
+        self.outbox.stop()
+
+    def closeEvent(self, event):
+        """关闭窗口时取消后台任务和 P2P 事件订阅"""
+        self.task_runner.cancel_all()
+        self.transfer_runner.cancel_all()
+        self.ui_updates.cancel()
+        self.stego_worker.shutdown()
+        self.cleanup_session_data()
+        super().closeEvent(event)
 
     def show_login_window(self):
         """显示登录窗口"""
@@ -363,14 +680,19 @@ class ChatWindow(QMainWindow):
         login_window.show()
 
     def update_profile(self, updated_data):
-        """更新个人资料"""
+        """更新个人资料（后台提交）"""
+        valid_data = {
+            'nickname': updated_data.get('nickname', self.user_data.get('nickname'))
+        }
+        self.task_runner.submit(
+            updateinfo, valid_data["nickname"],
+            on_done=lambda response: self.on_profile_updated(valid_data, response),
+            on_error=lambda error: QMessageBox.critical(self, "错误", f"更新资料时出错: {error}")
+        )
+
+    def on_profile_updated(self, valid_data, response):
+        """个人资料提交完成"""
         try:
-            valid_data = {
-                'nickname': updated_data.get('nickname', self.user_data.get('nickname'))
-            }
-            
-            response = updateinfo(valid_data["nickname"])
-            
             if response.get('success'):
                 self.user_data['nickname'] = valid_data['nickname']
                 
@@ -387,29 +709,37 @@ class ChatWindow(QMainWindow):
             QMessageBox.critical(self, "错误", f"更新资料时出错: {str(e)}")
         
     def scroll_to_bottom(self):
-        """滚动聊天区域到底部"""
-        scrollbar = self.chat_scroll.verticalScrollBar()
-        scrollbar.setValue(scrollbar.maximum())
-        QTimer.singleShot(50, lambda: scrollbar.setValue(scrollbar.maximum()))
+        """滚动聊天区域到底部（按帧合并；已切换到其他会话时不再滚动）"""
+        model = self.chat_view.model()
+        self.ui_updates.post("scroll", lambda: self.chat_view.model() is model and self.chat_view.scroll_to_bottom())
 
     def send_friend_request(self, username):
         """发送好友请求"""
-        try:
-            response = addfriend(self.current_user, username)
-            if "error" in response:
-                QMessageBox.warning(self, "错误", response["error"])
-            else:
-                QMessageBox.information(self, "成功", "好友请求已发送")
-        except Exception as e:
-            QMessageBox.critical(self, "错误", f"发送好友请求时出错: {str(e)}")
+        self.task_runner.submit(
+            addfriend, self.current_user, username,
+            on_done=self.on_friend_request_sent,
+            on_error=lambda error: QMessageBox.critical(self, "错误", f"发送好友请求时出错: {error}")
+        )
+
+    def on_friend_request_sent(self, response):
+        if "error" in response:
+            QMessageBox.warning(self, "错误", response["error"])
+        else:
+            QMessageBox.information(self, "成功", "好友请求已发送")
 
     def start_private_chat(self, username):
         """开始私聊"""
-        for i, friend in enumerate(self.friends):
-            if friend.username == username:
-                self.friend_list.setCurrentRow(i)
-                self.on_friend_selected(self.friend_list.currentItem())
-                break
+        friend = self.friend_model.find_by_username(username)
+        if friend is None:
+            return
+        index = self.friend_proxy.mapFromSource(self.friend_model.index_of(friend.user_id))
+        if not index.isValid():
+            # 被搜索条件过滤掉了，清空搜索后再选中
+            self.friend_list_header.clear_search()
+            index = self.friend_proxy.mapFromSource(self.friend_model.index_of(friend.user_id))
+        self.friend_list.setCurrentIndex(index)
+        self.friend_list.scrollTo(index)
+        self.on_friend_selected(index)
 
 
 if __name__ == "__main__":
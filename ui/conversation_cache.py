@@ -0,0 +1,78 @@
+from collections import OrderedDict
+
+from widgets.chat_view import ChatMessageModel
+
+
+class Conversation:
+    """一个会话在界面上的状态：已加载的消息、翻页游标和滚动位置"""
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.model = ChatMessageModel()
+        self.history_cursor = None      # 已加载的最早一条记录，向上翻页的游标
+        self.history_exhausted = False  # 记录已全部加载
+        self.history_task = None        # 正在进行的翻页任务
+        self.scroll_value = 0
+        self.follow_bottom = True       # 切回时是否停在底部
+
+
+class ConversationCache:
+    """
+    最近查看的会话的 LRU 缓存
+    切回缓存中的会话时直接换上它的模型和滚动位置，不再读库和重新排版；
+    会话数或消息占用的内存超出预算时，淘汰最久未查看的会话（正在查看的除外）
+    """
+
+    def __init__(self, max_conversations, memory_budget):
+        self.max_conversations = max_conversations
+        self.memory_budget = memory_budget
+        self._conversations = OrderedDict()
+
+    def get(self, user_id):
+        """取出缓存的会话，不改变 LRU 顺序（用于后台追加消息）"""
+        return self._conversations.get(user_id)
+
+    def open(self, user_id):
+        """
+        打开会话并标记为最近使用
+        :return: (Conversation, 是否命中缓存)
+        """
+        conversation = self._conversations.get(user_id)
+        if conversation is not None:
+            self._conversations.move_to_end(user_id)
+            return conversation, True
+        conversation = self._conversations[user_id] = Conversation(user_id)
+        self._evict(keep=user_id)
+        return conversation, False
+
+    def remove(self, user_id):
+        self._conversations.pop(user_id, None)
+
+    def clear(self):
+        self._conversations.clear()
+
+    def memory_size(self):
+        return sum(conversation.model.memory_size() for conversation in self._conversations.values())
+
+    def trim(self, keep=None):
+        """消息增加后检查内存预算"""
+        self._evict(keep)
+
+    def _evict(self, keep):
+        while len(self._conversations) > 1:
+            if len(self._conversations) <= self.max_conversations and self.memory_size() <= self.memory_budget:
+                return
+            oldest = next(iter(self._conversations))
+            if oldest == keep:
+                # 正在查看的会话即使单独超出预算也保留，淘汰下一个
+                candidates = [user_id for user_id in self._conversations if user_id != keep]
+                oldest = candidates[0]
+            conversation = self._conversations.pop(oldest)
+            if conversation.history_task:
+                conversation.history_task.cancel()
+
+    def __contains__(self, user_id):
+        return user_id in self._conversations
+
+    def __len__(self):
+        return len(self._conversations)
@@ -0,0 +1,47 @@
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+
+from panel.connect import NotificationChannel
+
+
+class NotificationBridge(QObject):
+    """
+    通知通道到 Qt 信号的桥接
+    长轮询线程收到的事件经队列连接转发到 GUI 线程，再按类型分组发出
+    """
+    presence_changed = pyqtSignal(list)           # list[dict]，好友在线状态变化
+    friend_requests_received = pyqtSignal(list)   # list[dict]，新的好友申请
+    offline_messages_received = pyqtSignal(list)  # list[dict]，新的离线消息
+
+    _events_ready = pyqtSignal(list)
+
+    def __init__(self, channel, parent=None):
+        super().__init__(parent)
+        self._channel = channel
+        self._events_ready.connect(self._dispatch, Qt.ConnectionType.QueuedConnection)
+        self._channel.subscribe(self._on_events)
+
+    def _on_events(self, events):
+        """在通知线程中调用，只负责投递到 GUI 线程"""
+        self._events_ready.emit(events)
+
+    def _dispatch(self, events):
+        """在 GUI 线程中按事件类型分组发出信号"""
+        groups = {
+            NotificationChannel.EVENT_PRESENCE: [],
+            NotificationChannel.EVENT_FRIEND_REQUEST: [],
+            NotificationChannel.EVENT_OFFLINE_MESSAGE: [],
+        }
+        for event in events:
+            if event.get("type") in groups:
+                groups[event["type"]].append(event)
+
+        if groups[NotificationChannel.EVENT_PRESENCE]:
+            self.presence_changed.emit(groups[NotificationChannel.EVENT_PRESENCE])
+        if groups[NotificationChannel.EVENT_FRIEND_REQUEST]:
+            self.friend_requests_received.emit(groups[NotificationChannel.EVENT_FRIEND_REQUEST])
+        if groups[NotificationChannel.EVENT_OFFLINE_MESSAGE]:
+            self.offline_messages_received.emit(groups[NotificationChannel.EVENT_OFFLINE_MESSAGE])
+
+    def close(self):
+        """取消订阅"""
+        self._channel.unsubscribe(self._on_events)
@@ -0,0 +1,22 @@
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+
+
+class OutboxBridge(QObject):
+    """发件箱投递状态到 Qt 信号的桥接，投递线程中的回调经队列连接转发到 GUI 线程"""
+    state_changed = pyqtSignal(int, str)  # (outbox_id, state)
+
+    _state_ready = pyqtSignal(int, str)
+
+    def __init__(self, outbox, parent=None):
+        super().__init__(parent)
+        self._outbox = outbox
+        self._state_ready.connect(self.state_changed, Qt.ConnectionType.QueuedConnection)
+        self._outbox.subscribe(self._on_state)
+
+    def _on_state(self, outbox_id, state):
+        """在投递线程中调用"""
+        self._state_ready.emit(outbox_id, state)
+
+    def close(self):
+        """取消订阅"""
+        self._outbox.unsubscribe(self._on_state)
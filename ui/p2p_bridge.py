@@ -0,0 +1,47 @@
+from PyQt6.QtCore import QObject, Qt, pyqtSignal
+
+from panel.p2p import P2PEvent
+
+
+class P2PSignalBridge(QObject):
+    """
+    P2P 事件到 Qt 信号的桥接
+    P2P 线程中批量到达的事件经队列连接转发到 GUI 线程，再按类型分组发出
+    """
+    messages_received = pyqtSignal(list)  # list[P2PEvent]，收到的消息
+    acks_received = pyqtSignal(list)      # list[P2PEvent]，送达回执
+    presence_changed = pyqtSignal(list)   # list[P2PEvent]，在线状态变化
+
+    _events_ready = pyqtSignal(list)
+
+    def __init__(self, p2p_api, parent=None):
+        super().__init__(parent)
+        self._p2p_api = p2p_api
+        self._events_ready.connect(self._dispatch, Qt.ConnectionType.QueuedConnection)
+        self._p2p_api.subscribe(self._on_events)
+
+    def _on_events(self, events):
+        """在 P2P 事件线程中调用，只负责投递到 GUI 线程"""
+        self._events_ready.emit(events)
+
+    def _dispatch(self, events):
+        """在 GUI 线程中按事件类型分组发出信号"""
+        messages, acks, presence = [], [], []
+        for event in events:
+            if event.event_type == P2PEvent.EVENT_MESSAGE:
+                messages.append(event)
+            elif event.event_type == P2PEvent.EVENT_ACK:
+                acks.append(event)
+            elif event.event_type == P2PEvent.EVENT_PRESENCE:
+                presence.append(event)
+
+        if messages:
+            self.messages_received.emit(messages)
+        if acks:
+            self.acks_received.emit(acks)
+        if presence:
+            self.presence_changed.emit(presence)
+
+    def close(self):
+        """取消订阅"""
+        self._p2p_api.unsubscribe(self._on_events)
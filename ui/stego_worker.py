@@ -0,0 +1,162 @@
+import multiprocessing
+import queue
+from concurrent.futures import ProcessPoolExecutor
+
+from PyQt6.QtCore import QObject, QTimer, Qt, pyqtSignal
+
+from panel.stego import encode_file, decode_file, StegoCancelled
+from settings import StegoWorkers, StegoStripRows
+
+
+def _progress_reporter(job_id, progress_queue, cancel_event):
+    """工作进程中的进度回调：百分比变化时上报，返回 False 表示任务已被取消"""
+    last = -1
+
+    def report(rows, total):
+        nonlocal last
+        percent = rows * 100 // total
+        if percent != last:
+            last = percent
+            progress_queue.put((job_id, percent))
+        return not cancel_event.is_set()
+    return report
+
+
+def _encode_job(job_id, progress_queue, cancel_event, src, dst, payload):
+    return encode_file(src, dst, payload, StegoStripRows, _progress_reporter(job_id, progress_queue, cancel_event))
+
+
+def _decode_job(job_id, progress_queue, cancel_event, path):
+    return decode_file(path, StegoStripRows, _progress_reporter(job_id, progress_queue, cancel_event))
+
+
+class StegoJob(QObject):
+    """一次隐写任务，所有信号都在 GUI 线程中发出"""
+    progress = pyqtSignal(int)     # 百分比
+    finished = pyqtSignal(object)  # 嵌入：输出文件路径；提取：载荷字节
+    failed = pyqtSignal(str)       # 异常信息
+    cancelled = pyqtSignal()
+    done = pyqtSignal()            # 任务结束（包括失败和取消）
+
+    _completed = pyqtSignal(object)  # 进程池线程 -> GUI 线程
+
+    def __init__(self, cancel_event, parent=None):
+        super().__init__(parent)
+        self.future = None
+        self._cancel_event = cancel_event
+        self._cancel_requested = False
+        self._completed.connect(self._on_completed, Qt.ConnectionType.QueuedConnection)
+
+    def cancel(self):
+        """
+        取消任务
+        尚未开始的任务不再执行；正在执行的任务在处理完当前分块后停止并删除输出文件
+        """
+        self._cancel_requested = True
+        self._cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def _on_completed(self, future):
+        try:
+            if self._cancel_requested or future.cancelled():
+                self.cancelled.emit()
+                return
+            error = future.exception()
+            if isinstance(error, StegoCancelled):
+                self.cancelled.emit()
+            elif error is not None:
+                self.failed.emit(str(error))
+            else:
+                self.finished.emit(future.result())
+        finally:
+            self.done.emit()
+
+
+class StegoWorker(QObject):
+    """
+    隐写任务的进程池
+    嵌入和提取是 CPU 密集的 NumPy/zlib 运算，放在独立进程中执行，不阻塞 GUI 线程，也不受 GIL 限制；
+    多个任务分布在多个核上。进度经共享队列回传，由定时器在 GUI 线程中分发
+    """
+    POLL_INTERVAL = 50  # 读取进度队列的间隔，毫秒
+
+    def __init__(self, parent=None, max_workers=StegoWorkers):
+        super().__init__(parent)
+        self._max_workers = max_workers
+        self._executor = None
+        self._manager = None
+        self._progress_queue = None
+        self._jobs = {}
+        self._next_id = 0
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.POLL_INTERVAL)
+        self._timer.timeout.connect(self._poll_progress)
+
+    def _ensure_pool(self):
+        """第一次提交任务时才启动进程"""
+        if self._executor is None:
+            # 不 fork 已经运行着 Qt 和网络线程的进程
+            context = multiprocessing.get_context("spawn")
+            self._manager = context.Manager()
+            self._progress_queue = self._manager.Queue()
+            self._executor = ProcessPoolExecutor(self._max_workers, mp_context=context)
+
+    def encode(self, src, dst, payload, on_done=None, on_error=None, on_progress=None):
+        """
+        把载荷藏入图片并写成 PNG
+        :param payload: 要藏入的字节（应已加密）
+        :param on_done: on_done(输出文件路径)，在 GUI 线程中调用
+        :param on_error: on_error(message)
+        :param on_progress: on_progress(百分比)
+        :return: StegoJob，可调用 cancel()
+        """
+        return self._submit(_encode_job, (src, dst, payload), on_done, on_error, on_progress)
+
+    def decode(self, path, on_done=None, on_error=None, on_progress=None):
+        """读出图片中藏的载荷，on_done(载荷字节)"""
+        return self._submit(_decode_job, (path,), on_done, on_error, on_progress)
+
+    def _submit(self, fn, args, on_done, on_error, on_progress):
+        self._ensure_pool()
+        job_id = self._next_id
+        self._next_id += 1
+        job = StegoJob(self._manager.Event(), self)
+        if on_done:
+            job.finished.connect(on_done)
+        if on_error:
+            job.failed.connect(on_error)
+        if on_progress:
+            job.progress.connect(on_progress)
+        job.done.connect(lambda: self._jobs.pop(job_id, None))
+        self._jobs[job_id] = job
+        job.future = self._executor.submit(fn, job_id, self._progress_queue, job._cancel_event, *args)
+        job.future.add_done_callback(job._completed.emit)
+        self._timer.start()
+        return job
+
+    def _poll_progress(self):
+        try:
+            while True:
+                job_id, percent = self._progress_queue.get_nowait()
+                job = self._jobs.get(job_id)
+                if job is not None:
+                    job.progress.emit(percent)
+        except queue.Empty:
+            pass
+        if not self._jobs:
+            self._timer.stop()
+
+    def cancel_all(self):
+        for job in list(self._jobs.values()):
+            job.cancel()
+
+    def shutdown(self):
+        """取消所有任务并关闭进程池（窗口关闭时）"""
+        self.cancel_all()
+        self._timer.stop()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._manager.shutdown()
+            self._executor = None
+            self._manager = None
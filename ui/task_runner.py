@@ -0,0 +1,90 @@
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+
+class TaskSignals(QObject):
+    """后台任务的完成信号，对象归属 GUI 线程，跨线程发射时自动排队"""
+    finished = pyqtSignal(object)  # 函数返回值
+    failed = pyqtSignal(str)       # 异常信息
+    done = pyqtSignal()            # 任务结束（包括被取消）
+
+
+class ApiTask(QRunnable):
+    """在线程池中执行一次阻塞调用（通常是 panel.connect 中的接口）"""
+
+    def __init__(self, fn, *args, **kwargs):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.signals = TaskSignals()
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        """
+        取消任务
+        尚未开始的任务不再执行；正在执行的 HTTP 请求无法中断，但结果会被丢弃
+        """
+        self._cancelled.set()
+
+    def is_cancelled(self):
+        return self._cancelled.is_set()
+
+    def run(self):
+        try:
+            if self.is_cancelled():
+                return
+            try:
+                result = self.fn(*self.args, **self.kwargs)
+            except Exception as e:
+                if not self.is_cancelled():
+                    self.signals.failed.emit(str(e))
+                return
+            if not self.is_cancelled():
+                self.signals.finished.emit(result)
+        finally:
+            self.signals.done.emit()
+
+
+class TaskRunner(QObject):
+    """
+    窗口级的后台任务调度器
+    submit() 把阻塞调用放进线程池，回调在 GUI 线程中执行；窗口关闭时 cancel_all()
+    """
+
+    def __init__(self, parent=None, max_threads=4):
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max_threads)
+        self._tasks = set()
+
+    def submit(self, fn, *args, on_done=None, on_error=None, **kwargs):
+        """
+        提交后台任务
+        :param fn: 在工作线程中执行的函数，不能访问任何控件
+        :param on_done: on_done(result)，在 GUI 线程中调用
+        :param on_error: on_error(message)，在 GUI 线程中调用
+        :return: ApiTask，可调用 cancel()
+        """
+        task = ApiTask(fn, *args, **kwargs)
+        task.setAutoDelete(False)
+        if on_done:
+            task.signals.finished.connect(on_done)
+        if on_error:
+            task.signals.failed.connect(on_error)
+        # 运行中的任务必须保持引用，直到工作线程退出 run()
+        task.signals.done.connect(lambda: self._tasks.discard(task))
+        self._tasks.add(task)
+        self._pool.start(task)
+        return task
+
+    def cancel_all(self):
+        """取消所有未完成的任务，尚未开始的任务直接移出线程池（它们不会再发出 done）"""
+        for task in list(self._tasks):
+            task.cancel()
+            if self._pool.tryTake(task):
+                self._tasks.discard(task)
+
+    def wait_for_done(self, msecs=-1):
+        return self._pool.waitForDone(msecs)
@@ -0,0 +1,69 @@
+import time
+from collections import OrderedDict
+
+from PyQt6.QtCore import QObject, QTimer
+
+from settings import UiFrameRate
+
+
+class UiUpdateScheduler(QObject):
+    """
+    按帧合并界面更新
+    事件到达时只登记要做的更新，每帧最多执行一次：
+      - post(key, fn)：同一个 key 在一帧内只执行最后登记的 fn（滚动、状态栏文字等）
+      - queue(key, item, flush)：同一个 key 的 item 攒成列表，一帧调用一次 flush(items)（批量插入消息等）
+    一帧内的更新按首次登记的顺序执行；只能在 GUI 线程中使用
+    """
+
+    def __init__(self, parent=None, frame_rate=UiFrameRate):
+        super().__init__(parent)
+        self._interval = 1.0 / frame_rate
+        self._pending = OrderedDict()  # key -> [fn, items 或 None]
+        self._last_flush = 0.0
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self.flush)
+
+    def post(self, key, fn):
+        """登记一次无参数更新，同一帧内后登记的覆盖先登记的"""
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [fn, None]
+        else:
+            entry[0] = fn
+        self._schedule()
+
+    def queue(self, key, item, flush):
+        """登记一个待批量处理的条目，下一帧调用 flush(items)"""
+        entry = self._pending.get(key)
+        if entry is None:
+            self._pending[key] = [flush, [item]]
+        else:
+            entry[0] = flush
+            entry[1].append(item)
+        self._schedule()
+
+    def _schedule(self):
+        if self._timer.isActive():
+            return
+        elapsed = time.monotonic() - self._last_flush
+        self._timer.start(max(0, int((self._interval - elapsed) * 1000)))
+
+    def flush(self):
+        """立即执行所有已登记的更新"""
+        self._timer.stop()
+        pending, self._pending = self._pending, OrderedDict()
+        self._last_flush = time.monotonic()
+        for fn, items in pending.values():
+            try:
+                if items is None:
+                    fn()
+                else:
+                    fn(items)
+            except Exception as e:
+                print(f"[UI] Update error: {e}")
+
+    def cancel(self):
+        """丢弃尚未执行的更新（窗口关闭时）"""
+        self._timer.stop()
+        self._pending.clear()
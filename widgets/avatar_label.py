@@ -2,6 +2,94 @@ from PyQt6.QtWidgets import QLabel
 from PyQt6.QtGui import QPainter, QColor, QFont, QImage, QPixmap, QBrush
 from PyQt6.QtCore import Qt, QSize, pyqtSignal
 import hashlib
+from collections import OrderedDict
+
+# 进程内共享的头像缓存：(用户名, 尺寸, 设备像素比) -> QPixmap
+# 只在 GUI 线程中使用；同一个人的头像只绘制一次，所有控件和委托共享同一个 QPixmap
+_avatar_cache = OrderedDict()
+AVATAR_CACHE_SIZE = 256
+
+
+def get_avatar(username, size, device_pixel_ratio=1.0):
+    """
+    取得用户名首字母头像，未缓存时绘制一次
+    :param username: 用户名，决定颜色和首字母
+    :param size: 头像尺寸（正方形边长，逻辑像素）
+    :param device_pixel_ratio: 目标屏幕的设备像素比，高分屏上按物理像素绘制
+    :return: QPixmap
+    """
+    key = (username, size, device_pixel_ratio)
+    pixmap = _avatar_cache.get(key)
+    if pixmap is not None:
+        _avatar_cache.move_to_end(key)
+        return pixmap
+
+    pixmap = _avatar_cache[key] = render_avatar(username, size, device_pixel_ratio)
+    if len(_avatar_cache) > AVATAR_CACHE_SIZE:
+        _avatar_cache.popitem(last=False)
+    return pixmap
+
+
+def render_avatar(username, size, device_pixel_ratio=1.0):
+    """
+    绘制用户名首字母头像，一般应通过 get_avatar() 取得缓存的结果
+    :param username: 用户名，决定颜色和首字母
+    :param size: 头像尺寸（正方形边长，逻辑像素）
+    :param device_pixel_ratio: 设备像素比
+    :return: QPixmap
+    """
+    # 创建透明背景的图像（物理像素），之后按逻辑坐标绘制
+    physical_size = round(size * device_pixel_ratio)
+    image = QImage(physical_size, physical_size, QImage.Format.Format_ARGB32)
+    image.setDevicePixelRatio(device_pixel_ratio)
+    image.fill(Qt.GlobalColor.transparent)
+
+    painter = QPainter(image)
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+    # 1. 生成确定性颜色（基于用户名哈希）
+    color = _generate_color_from_username(username)
+    painter.setBrush(QBrush(color))
+
+    # 2. 绘制正方形背景（不再是圆形）
+    painter.drawRect(0, 0, size, size)
+
+    # 3. 绘制首字母
+    painter.setPen(Qt.GlobalColor.white)
+    font = QFont("Microsoft YaHei", int(size * 0.4))  # 字体大小为尺寸的40%
+    font.setBold(True)
+    painter.setFont(font)
+
+    # 获取用户名的第一个字符（支持中文）
+    initial = username[0].upper() if username else "?"
+    font_metrics = painter.fontMetrics()
+    text_width = font_metrics.horizontalAdvance(initial)
+    text_height = font_metrics.height()
+
+    # 居中绘制文字
+    painter.drawText(
+        (size - text_width) // 2,
+        (size - text_height) // 2 + font_metrics.ascent(),
+        initial
+    )
+
+    painter.end()
+    return QPixmap.fromImage(image)
+
+
+def _generate_color_from_username(username):
+    """根据用户名生成确定性颜色"""
+    # 使用MD5哈希确保相同用户名总是相同颜色
+    hash_obj = hashlib.md5(username.encode('utf-8'))
+    hash_int = int(hash_obj.hexdigest(), 16)
+
+    # 从哈希值生成RGB颜色
+    r = (hash_int & 0xFF) % 180 + 50  # 50-230
+    g = ((hash_int >> 8) & 0xFF) % 180 + 50
+    b = ((hash_int >> 16) & 0xFF) % 180 + 50
+
+    return QColor(r, g, b)
+
 
 class AvatarLabel(QLabel):
     clicked = pyqtSignal()
@@ -26,56 +114,7 @@ class AvatarLabel(QLabel):
     
     def generate_avatar(self):
         """生成正方形头像，包含用户名的首字母"""
-        # 创建透明背景的图像
-        image = QImage(self.size, self.size, QImage.Format.Format_ARGB32)
-        image.fill(Qt.GlobalColor.transparent)
-
-        painter = QPainter(image)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-
-        # 1. 生成确定性颜色（基于用户名哈希）
-        color = self._generate_color_from_username()
-        painter.setBrush(QBrush(color))
-
-        # 2. 绘制正方形背景（不再是圆形）
-        painter.drawRect(0, 0, self.size, self.size)
-
-        # 3. 绘制首字母
-        painter.setPen(Qt.GlobalColor.white)
-        font = QFont("Microsoft YaHei", int(self.size * 0.4))  # 字体大小为尺寸的40%
-        font.setBold(True)
-        painter.setFont(font)
-
-        # 获取用户名的第一个字符（支持中文）
-        initial = self.username[0].upper() if self.username else "?"
-        font_metrics = painter.fontMetrics()
-        text_width = font_metrics.horizontalAdvance(initial)
-        text_height = font_metrics.height()
-
-        # 居中绘制文字
-        painter.drawText(
-            (self.size - text_width) // 2,
-            (self.size - text_height) // 2 + font_metrics.ascent(),
-            initial
-        )
-
-        painter.end()
-
-        # 设置生成的图像
-        self.setPixmap(QPixmap.fromImage(image))
-
-    def _generate_color_from_username(self):
-        """根据用户名生成确定性颜色"""
-        # 使用MD5哈希确保相同用户名总是相同颜色
-        hash_obj = hashlib.md5(self.username.encode('utf-8'))
-        hash_int = int(hash_obj.hexdigest(), 16)
-        
-        # 从哈希值生成RGB颜色
-        r = (hash_int & 0xFF) % 180 + 50  # 50-230
-        g = ((hash_int >> 8) & 0xFF) % 180 + 50
-        b = ((hash_int >> 16) & 0xFF) % 180 + 50
-        
-        return QColor(r, g, b)
+        self.setPixmap(get_avatar(self.username, self.size, self.devicePixelRatioF()))
 
     def mousePressEvent(self, event):
         """重写鼠标点击事件"""
@@ -1,11 +1,117 @@
-from PyQt6.QtWidgets import QFrame, QTextEdit, QHBoxLayout, QSizePolicy
-from PyQt6.QtGui import QPainter, QPainterPath, QColor, QTextDocument
-from PyQt6.QtCore import Qt, QRectF, QSize
+import html
+from collections import OrderedDict
 
-class ChatBubble(QFrame):
+from PyQt6.QtWidgets import QWidget, QSizePolicy
+from PyQt6.QtGui import QPainter, QPainterPath, QColor, QFont, QFontMetrics, QStaticText
+from PyQt6.QtCore import Qt, QRect, QRectF, QSize, QPoint
+
+PADDING_X = 12          # 气泡内边距
+PADDING_Y = 8
+MAX_BUBBLE_WIDTH = 300  # 气泡最大宽度
+RADIUS = 15
+ME_COLOR = QColor(154, 217, 105)           # 绿色气泡
+OTHER_COLOR = QColor(Qt.GlobalColor.white)  # 白色气泡
+TEXT_SIZE_CACHE_SIZE = 20000                # 缓存的文本尺寸数量（布局时每条消息都要用到）
+TEXT_LAYOUT_CACHE_SIZE = 2000               # 缓存的 QStaticText 数量（只有绘制过的消息才有）
+
+# 以下缓存均以 (文本, 可用宽度) 为键，ChatBubble 和聊天视图的委托共享
+_text_sizes = OrderedDict()    # -> QSize
+_text_layouts = OrderedDict()  # -> QStaticText
+_font = None
+_metrics = None
+
+
+def bubble_font():
+    """气泡文本字体（需要 QApplication 已创建）"""
+    global _font, _metrics
+    if _font is None:
+        _font = QFont("Microsoft YaHei")
+        _font.setPixelSize(14)
+        _metrics = QFontMetrics(_font)
+    return _font
+
+
+def _cache_get(cache, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+
+def _cache_put(cache, key, value, max_size):
+    cache[key] = value
+    if len(cache) > max_size:
+        cache.popitem(last=False)
+    return value
+
+
+def _display_text(text):
+    """测量和绘制用的文本：制表符展开为空格（富文本与 QFontMetrics 的制表位不同）"""
+    return text.expandtabs(4)
+
+
+def text_size(text, max_width):
+    """
+    计算气泡文本折行后的大小，同一文本在同一宽度下只计算一次
+    布局只需要尺寸，不创建 QStaticText
+    """
+    key = (text, max_width)
+    size = _cache_get(_text_sizes, key)
+    if size is None:
+        bubble_font()
+        size = _metrics.boundingRect(
+            QRect(0, 0, max_width, 1 << 24), Qt.TextFlag.TextWordWrap, _display_text(text)
+        ).size()
+        _cache_put(_text_sizes, key, size, TEXT_SIZE_CACHE_SIZE)
+    return size
+
+
+def layout_text(text, max_width):
+    """
+    排版气泡文本用于绘制，同一文本在同一宽度下只排版一次
+    :param text: 消息文本
+    :param max_width: 文本可用的最大宽度
+    :return: (QStaticText, QSize)，QSize 是文本实际占用的大小
+    """
+    size = text_size(text, max_width)
+    key = (text, max_width)
+    static_text = _cache_get(_text_layouts, key)
+    if static_text is None:
+        # 纯文本模式的 QStaticText 不处理换行符，转义后按富文本排版；
+        # pre-wrap 保留连续空格、行首空格和换行，与 text_size() 的测量一致（代码片段、字符画不走样）
+        static_text = QStaticText(f'<span style="white-space: pre-wrap">{html.escape(_display_text(text))}</span>')
+        static_text.setTextFormat(Qt.TextFormat.RichText)
+        static_text.setTextWidth(max(size.width(), 1))
+        static_text.prepare(font=bubble_font())
+        _cache_put(_text_layouts, key, static_text, TEXT_LAYOUT_CACHE_SIZE)
+    return static_text, size
+
+
+def bubble_size(size):
+    """文本大小加上内边距即气泡大小"""
+    return QSize(size.width() + 2 * PADDING_X, size.height() + 2 * PADDING_Y)
+
+
+def paint_bubble(painter, rect, static_text, is_me):
+    """在 rect 中绘制圆角气泡和文本"""
+    painter.save()
+    painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+    path = QPainterPath()
+    path.addRoundedRect(QRectF(rect), RADIUS, RADIUS)
+    painter.fillPath(path, ME_COLOR if is_me else OTHER_COLOR)
+
+    painter.setFont(bubble_font())
+    painter.setPen(QColor(Qt.GlobalColor.black))
+    painter.drawStaticText(QPoint(rect.left() + PADDING_X, rect.top() + PADDING_Y), static_text)
+    painter.restore()
+
+
+class ChatBubble(QWidget):
     def __init__(self, text, is_me, parent=None):
         """
         聊天气泡控件
+        直接绘制缓存的 QStaticText，不再为每条消息创建 QTextEdit
         :param text: 消息文本
         :param is_me: 是否是自己发送的消息
         :param parent: 父组件
@@ -13,73 +119,73 @@ class ChatBubble(QFrame):
         super().__init__(parent)
         self.is_me = is_me
         self.text = text
-        self.setSizePolicy(QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Fixed)
-        self.setStyleSheet("background: transparent; border: none;")
-        
-        # 气泡内文本
-        self.text_edit = QTextEdit()
-        self.text_edit.setReadOnly(True)
-        self.text_edit.setPlainText(text)
-        self.text_edit.setStyleSheet("""
-            QTextEdit {
-                background: transparent;
-                border: none;
-                padding: 8px;
-                font-family: Microsoft YaHei;
-                font-size: 14px;
-                color: black;
-            }
-        """)
-        
-        # 禁用滚动条
-        self.text_edit.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        self.text_edit.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
-        
-        # 自动调整大小
-        doc = self.text_edit.document()
-        doc.documentLayout().documentSizeChanged.connect(self.adjust_size)
-        
-        # 布局
-        layout = QHBoxLayout()
-        layout.addWidget(self.text_edit)
-        layout.setContentsMargins(0, 0, 0, 0)
-        self.setLayout(layout)
-        
-        # 初始大小调整
-        self.adjust_size()
-    
-    def adjust_size(self):
-        """根据文本内容调整气泡大小"""
-        doc = self.text_edit.document()
-        doc.setTextWidth(self.text_edit.width())
-        new_height = doc.size().height()
-        
-        # 设置最小高度（包含padding）
-        self.setMinimumHeight(int(new_height) + 16)
-        self.updateGeometry()
-    
-    def paintEvent(self, event):
-        painter = QPainter(self)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-        
-        # 气泡颜色
-        if self.is_me:
-            color = QColor(154, 217, 105)  # 绿色气泡
-        else:
-            color = Qt.GlobalColor.white  # 白色气泡
-        
-        # 绘制圆角矩形
-        rect = self.rect().adjusted(0, 0, -1, -1)
-        rect_f = QRectF(rect)  # 转换为QRectF
-        
-        path = QPainterPath()
-        path.addRoundedRect(rect_f, 15, 15)
-
-        painter.fillPath(path, color)
-    
+        policy = QSizePolicy(QSizePolicy.Policy.Preferred, QSizePolicy.Policy.Fixed)
+        policy.setHeightForWidth(True)
+        self.setSizePolicy(policy)
+
+    def _text_width(self, width):
+        return max(min(width, MAX_BUBBLE_WIDTH) - 2 * PADDING_X, 1)
+
+    def hasHeightForWidth(self):
+        return True
+
+    def heightForWidth(self, width):
+        """宽度变化时按缓存的排版计算高度"""
+        return bubble_size(text_size(self.text, self._text_width(width))).height()
+
     def sizeHint(self):
         """返回建议大小"""
-        doc = self.text_edit.document()
-        width = min(doc.idealWidth() + 30, 300)  # 最大宽度300
-        height = doc.size().height() + 16
-        return QSize(int(width), int(height))
\ No newline at end of file
+        return bubble_size(text_size(self.text, self._text_width(MAX_BUBBLE_WIDTH)))
+
+    def minimumSizeHint(self):
+        return QSize(2 * PADDING_X + 1, bubble_font().pixelSize() + 2 * PADDING_Y)
+
+    def paintEvent(self, event):
+        static_text, size = layout_text(self.text, self._text_width(self.width()))
+        size = bubble_size(size)
+        # 气泡贴近头像一侧
+        x = self.width() - size.width() if self.is_me else 0
+        painter = QPainter(self)
+        paint_bubble(painter, QRect(x, 0, size.width(), size.height()), static_text, self.is_me)
+        painter.end()
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+    from PyQt6.QtWidgets import QApplication, QTextEdit, QVBoxLayout
+
+    app = QApplication(sys.argv)
+    count = 10000
+    texts = [f"消息 {i} " + "内容" * (i % 40) + ("\n第二行" if i % 7 == 0 else "") for i in range(count)]
+
+    def benchmark(name, create):
+        container = QWidget()
+        layout = QVBoxLayout(container)
+        start = time.perf_counter()
+        for i, text in enumerate(texts):
+            layout.addWidget(create(text, i % 2 == 0))
+        created = time.perf_counter() - start
+        container.resize(400, 600)
+        start = time.perf_counter()
+        layout.activate()
+        container.resize(600, 600)
+        layout.activate()
+        relayout = time.perf_counter() - start
+        print(f"{name}: 创建 {count} 个气泡 {created:.3f}s，两次重新布局 {relayout:.3f}s")
+        container.deleteLater()
+        return created + relayout
+
+    def text_edit_bubble(text, is_me):
+        """原实现：每条消息一个只读 QTextEdit"""
+        text_edit = QTextEdit()
+        text_edit.setReadOnly(True)
+        text_edit.setPlainText(text)
+        text_edit.setStyleSheet("QTextEdit { background: transparent; border: none; padding: 8px; }")
+        text_edit.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        text_edit.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        return text_edit
+
+    painted = benchmark("ChatBubble (QStaticText)", ChatBubble)
+    baseline = benchmark("QTextEdit 气泡", text_edit_bubble)
+    print(f"耗时降低为原来的 1/{baseline / painted:.1f}")
@@ -1,7 +1,7 @@
 from PyQt6.QtCore import pyqtSignal
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QTextEdit,
-    QPushButton, QToolButton, QDialog, QGridLayout, QFileDialog
+    QPushButton, QToolButton, QDialog, QGridLayout, QFileDialog, QProgressBar
 )
 from PyQt6.QtGui import QIcon
 
@@ -38,6 +38,9 @@ class EmojiDialog(QDialog):
 class ChatInputWidget(QWidget):
     send_message_signal = pyqtSignal(str)
     send_file_signal = pyqtSignal(str)
+    send_stego_signal = pyqtSignal(str, str)  # 要藏入的文字, 载体图片路径
+    reveal_stego_signal = pyqtSignal(str)     # 要读取隐藏内容的图片路径
+    stego_cancel_requested = pyqtSignal()
 
     def __init__(self, parent=None):
         super().__init__(parent)
@@ -78,6 +81,7 @@ class ChatInputWidget(QWidget):
         self.image_btn = QToolButton()
         self.image_btn.setIcon(QIcon("icons/image.png"))
         self.image_btn.setToolTip("图片")
+        self.image_btn.clicked.connect(self.select_image)
 
         btn_layout.addWidget(self.emoji_btn)
         btn_layout.addWidget(self.file_btn)
@@ -124,6 +128,18 @@ class ChatInputWidget(QWidget):
         """)
         self.stego_btn.clicked.connect(self.choose_stego_image)
 
+        # 隐写任务在后台进程中执行，期间显示进度，可以取消，输入框照常可用
+        self.stego_progress = QProgressBar()
+        self.stego_progress.setRange(0, 100)
+        self.stego_progress.setFixedWidth(120)
+        self.stego_progress.setFormat("隐写 %p%")
+        self.stego_progress.hide()
+        self.stego_cancel_btn = QToolButton()
+        self.stego_cancel_btn.setText("取消")
+        self.stego_cancel_btn.setToolTip("取消隐写")
+        self.stego_cancel_btn.clicked.connect(self.stego_cancel_requested)
+        self.stego_cancel_btn.hide()
+
         self.send_btn = QPushButton("发送")
         self.send_btn.setStyleSheet("""
             QPushButton {
@@ -145,6 +161,8 @@ class ChatInputWidget(QWidget):
         """)
         self.send_btn.clicked.connect(self.on_send)
         
+        send_layout.addWidget(self.stego_progress)
+        send_layout.addWidget(self.stego_cancel_btn)
         send_layout.addStretch()
         send_layout.addWidget(self.stego_btn)
         send_layout.addWidget(self.send_btn)
@@ -176,10 +194,36 @@ class ChatInputWidget(QWidget):
         if file_path:
             self.send_file_signal.emit(file_path)
 
+    def select_image(self):
+        """图片和文件走同一条附件流程，接收方按图片显示缩略图"""
+        image_path, _ = QFileDialog.getOpenFileName(
+            self, "选择图片", "", "图片文件 (*.png *.jpg *.jpeg *.bmp *.gif *.webp)"
+        )
+        if image_path:
+            self.send_file_signal.emit(image_path)
+
     def choose_stego_image(self):
         image_path, _ = QFileDialog.getOpenFileName(
             self, "选择要隐写的图片", "", "图片文件 (*.png *.jpg *.bmp)"
         )
-        if image_path:
-            print(f"你选择了用于隐写的图片: {image_path}")
-            # 未来可添加：读取 self.input_field 中的内容进行隐写处理
+        if not image_path:
+            return
+        # 输入框有内容时把它藏入图片发送，否则读取图片中隐藏的内容
+        message = self.input_field.toPlainText().strip()
+        if message:
+            self.send_stego_signal.emit(message, image_path)
+            self.input_field.clear()
+        else:
+            self.reveal_stego_signal.emit(image_path)
+
+    def set_stego_progress(self, percent):
+        """显示隐写任务进度，任务进行中不能再开始新的隐写"""
+        self.stego_progress.setValue(percent)
+        self.stego_progress.show()
+        self.stego_cancel_btn.show()
+        self.stego_btn.setEnabled(False)
+
+    def finish_stego(self):
+        self.stego_progress.hide()
+        self.stego_cancel_btn.hide()
+        self.stego_btn.setEnabled(True)
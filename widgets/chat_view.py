@@ -0,0 +1,347 @@
+import sys
+
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView
+from PyQt6.QtGui import QColor, QFont, QPainter, QPainterPath
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QRect, QRectF, QSize, QEvent, pyqtSignal
+
+from settings import ThumbnailSize
+from widgets.avatar_label import get_avatar
+from widgets.chat_bubble import (
+    text_size, layout_text, bubble_size, paint_bubble, bubble_font,
+    PADDING_X, PADDING_Y, MAX_BUBBLE_WIDTH, RADIUS, ME_COLOR, OTHER_COLOR
+)
+from widgets.thumbnail_loader import ThumbnailLoader
+
+__all__ = ['ChatMessageModel', 'ChatBubbleDelegate', 'ChatView']
+
+
+class ChatMessageModel(QAbstractListModel):
+    """
+    一个会话的聊天记录
+    每行是一个 models.chat_message.ChatMessage，视图只为可见行调用委托绘制
+    """
+    MessageRole = Qt.ItemDataRole.UserRole + 1
+    MESSAGE_OVERHEAD = 400  # 每条消息除文本外的大致内存占用（对象、时间、发送者），字节
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._messages = []
+        self._memory_size = 0
+
+    def memory_size(self):
+        """消息占用内存的估计值，字节"""
+        return self._memory_size
+
+    def _message_size(self, messages):
+        return sum(sys.getsizeof(message.content) + self.MESSAGE_OVERHEAD for message in messages)
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._messages)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._messages):
+            return None
+        message = self._messages[index.row()]
+        if role == self.MessageRole:
+            return message
+        if role == Qt.ItemDataRole.DisplayRole:
+            return message.content
+        return None
+
+    def append_message(self, message):
+        self.append_messages([message])
+
+    def append_messages(self, messages):
+        """在末尾追加多条消息，只发出一次行插入通知"""
+        if not messages:
+            return
+        first = len(self._messages)
+        self.beginInsertRows(QModelIndex(), first, first + len(messages) - 1)
+        self._messages.extend(messages)
+        self._memory_size += self._message_size(messages)
+        self.endInsertRows()
+
+    def prepend_messages(self, messages):
+        """在开头插入更早的消息（按时间正序）"""
+        if not messages:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(messages) - 1)
+        self._messages[0:0] = messages
+        self._memory_size += self._message_size(messages)
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self._messages = []
+        self._memory_size = 0
+        self.endResetModel()
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
+
+
+class ChatBubbleDelegate(QStyledItemDelegate):
+    """
+    直接绘制时间、头像和气泡，不为消息创建任何控件
+    气泡文本的排版结果由 widgets.chat_bubble 按 (文本, 可用宽度) 缓存，滚动和重绘时不再重新排版；
+    图片附件按消息中记录的宽高预留位置，缩略图在绘制到时才由 ThumbnailLoader 在后台加载
+    """
+    avatar_clicked = pyqtSignal(str, bool)  # 发送者用户名, 是否是自己
+    attachment_clicked = pyqtSignal(object)  # models.attachment.Attachment
+
+    MARGIN = 20            # 左右边距
+    SPACING = 10           # 头像与气泡、消息与消息之间的间距
+    AVATAR_SIZE = 40
+    TIME_HEIGHT = 20       # 时间标签高度
+    FILE_CARD_SIZE = QSize(220, 60)
+    PLACEHOLDER_COLOR = QColor("#e0e0e0")
+
+    def __init__(self, parent=None, thumbnails=None):
+        super().__init__(parent)
+        self.time_font = QFont("Microsoft YaHei")
+        self.time_font.setPixelSize(10)
+        self.detail_font = QFont("Microsoft YaHei")
+        self.detail_font.setPixelSize(11)
+        self.thumbnails = thumbnails
+
+    def _text_width(self, view_width):
+        """气泡内文本可用的最大宽度"""
+        available = view_width - 2 * self.MARGIN - self.AVATAR_SIZE - self.SPACING - 2 * PADDING_X
+        return max(min(available, MAX_BUBBLE_WIDTH - 2 * PADDING_X), 40)
+
+    def _thumbnail_size(self, attachment, view_width):
+        """图片缩略图的显示大小：按原图比例缩小到 ThumbnailSize 以内，不放大"""
+        limit = min(ThumbnailSize, self._text_width(view_width) + 2 * PADDING_X)
+        scale = min(1.0, limit / attachment.width, limit / attachment.height)
+        return QSize(max(round(attachment.width * scale), 1), max(round(attachment.height * scale), 1))
+
+    def _content_size(self, message, view_width):
+        """气泡（或缩略图、文件卡片）的大小，只用消息中的数据计算，不读取附件文件"""
+        attachment = message.attachment
+        if attachment is None:
+            return bubble_size(text_size(message.content, self._text_width(view_width)))
+        if attachment.is_image:
+            return self._thumbnail_size(attachment, view_width)
+        return self.FILE_CARD_SIZE
+
+    def _geometry(self, message, rect):
+        """计算一行中时间、头像、气泡和文本的位置，附件消息没有 static_text"""
+        if message.attachment is None:
+            static_text, size = layout_text(message.content, self._text_width(rect.width()))
+            size = bubble_size(size)
+        else:
+            static_text, size = None, self._content_size(message, rect.width())
+        top = rect.top() + self.TIME_HEIGHT
+        bubble_width, bubble_height = size.width(), size.height()
+
+        if message.is_me:
+            avatar_x = rect.right() - self.MARGIN - self.AVATAR_SIZE
+            bubble_x = avatar_x - self.SPACING - bubble_width
+        else:
+            avatar_x = rect.left() + self.MARGIN
+            bubble_x = avatar_x + self.AVATAR_SIZE + self.SPACING
+
+        avatar_rect = QRect(avatar_x, top, self.AVATAR_SIZE, self.AVATAR_SIZE)
+        bubble_rect = QRect(bubble_x, top, bubble_width, bubble_height)
+        return static_text, avatar_rect, bubble_rect
+
+    def row_height(self, message, width):
+        size = self._content_size(message, width)
+        return self.TIME_HEIGHT + max(self.AVATAR_SIZE, size.height()) + self.SPACING
+
+    def sizeHint(self, option, index):
+        message = index.data(ChatMessageModel.MessageRole)
+        view = self.parent()
+        width = view.viewport().width() if view is not None else option.rect.width()
+        return QSize(width, self.row_height(message, width))
+
+    def paint(self, painter, option, index):
+        message = index.data(ChatMessageModel.MessageRole)
+        rect = option.rect
+        static_text, avatar_rect, bubble_rect = self._geometry(message, rect)
+
+        painter.save()
+
+        # 时间
+        painter.setFont(self.time_font)
+        painter.setPen(QColor(Qt.GlobalColor.gray))
+        painter.drawText(
+            QRect(rect.left(), rect.top(), rect.width(), self.TIME_HEIGHT),
+            Qt.AlignmentFlag.AlignCenter,
+            message.time.strftime("%H:%M")
+        )
+
+        # 头像
+        painter.drawPixmap(avatar_rect, get_avatar(message.sender, self.AVATAR_SIZE, painter.device().devicePixelRatioF()))
+
+        # 气泡和文本，或附件
+        if message.attachment is None:
+            paint_bubble(painter, bubble_rect, static_text, message.is_me)
+        elif message.attachment.is_image:
+            self._paint_image(painter, bubble_rect, message.attachment)
+        else:
+            self._paint_file_card(painter, bubble_rect, message.attachment, message.is_me)
+        painter.restore()
+
+    def _paint_image(self, painter, rect, attachment):
+        """绘制缩略图；还没加载好时画占位框，加载完成后视图会重绘"""
+        pixmap = None
+        if self.thumbnails is not None:
+            size = round(ThumbnailSize * painter.device().devicePixelRatioF())
+            pixmap = self.thumbnails.get(attachment.sha256, size)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        path = QPainterPath()
+        path.addRoundedRect(QRectF(rect), 6, 6)
+        if pixmap is None:
+            painter.fillPath(path, self.PLACEHOLDER_COLOR)
+            return
+        painter.setClipPath(path)
+        painter.drawPixmap(rect, pixmap)
+        painter.setClipping(False)
+
+    def _paint_file_card(self, painter, rect, attachment, is_me):
+        """文件卡片：文件名和大小"""
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        path = QPainterPath()
+        path.addRoundedRect(QRectF(rect), RADIUS, RADIUS)
+        painter.fillPath(path, ME_COLOR if is_me else OTHER_COLOR)
+
+        inner = rect.adjusted(PADDING_X, PADDING_Y, -PADDING_X, -PADDING_Y)
+        painter.setPen(QColor(Qt.GlobalColor.black))
+        painter.setFont(bubble_font())
+        name = painter.fontMetrics().elidedText(attachment.name, Qt.TextElideMode.ElideMiddle, inner.width())
+        painter.drawText(inner, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft, name)
+        painter.setPen(QColor(Qt.GlobalColor.darkGray))
+        painter.setFont(self.detail_font)
+        painter.drawText(inner, Qt.AlignmentFlag.AlignBottom | Qt.AlignmentFlag.AlignLeft, _format_size(attachment.size))
+
+    def editorEvent(self, event, model, option, index):
+        """点击头像时发出 avatar_clicked，点击附件时发出 attachment_clicked"""
+        if event.type() == QEvent.Type.MouseButtonRelease:
+            message = index.data(ChatMessageModel.MessageRole)
+            _, avatar_rect, bubble_rect = self._geometry(message, option.rect)
+            position = event.position().toPoint()
+            if avatar_rect.contains(position):
+                self.avatar_clicked.emit(message.sender, message.is_me)
+                return True
+            if message.attachment is not None and bubble_rect.contains(position):
+                self.attachment_clicked.emit(message.attachment)
+                return True
+        return super().editorEvent(event, model, option, index)
+
+
+class ChatView(QListView):
+    """
+    虚拟化的聊天记录视图
+    消息保存在 ChatMessageModel 中，只有可见行会被绘制，内存和滚动耗时不随记录数增长
+    """
+    avatar_clicked = pyqtSignal(str, bool)  # 发送者用户名, 是否是自己
+    attachment_clicked = pyqtSignal(object) # models.attachment.Attachment
+    top_reached = pyqtSignal()              # 滚动到顶部，需要加载更早的记录
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet("""
+            QListView {
+                background: #f5f5f5;
+                border: none;
+            }
+        """)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.setFocusPolicy(Qt.FocusPolicy.NoFocus)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.verticalScrollBar().setSingleStep(20)
+        # 宽度变化时重新计算行高；长记录分批布局，不阻塞界面
+        self.setResizeMode(QListView.ResizeMode.Adjust)
+        self.setLayoutMode(QListView.LayoutMode.Batched)
+        self.setBatchSize(200)
+
+        # 缩略图加载完成后只需重绘可见区域，行高在加载前已按图片宽高确定
+        self.thumbnails = ThumbnailLoader(self)
+        self.thumbnails.thumbnail_ready.connect(lambda _: self.viewport().update())
+        self.delegate = ChatBubbleDelegate(self, self.thumbnails)
+        self.delegate.avatar_clicked.connect(self.avatar_clicked)
+        self.delegate.attachment_clicked.connect(self.attachment_clicked)
+        self.setItemDelegate(self.delegate)
+        self.setModel(ChatMessageModel(self))
+
+        # 停在底部时，新消息和分批布局撑高内容后仍保持在底部
+        self._follow_bottom = True
+        # 在顶部插入记录后要恢复的滚动位置，等分批布局把内容撑到足够高时再设置
+        self._pending_value = None
+        self.verticalScrollBar().rangeChanged.connect(self._on_range_changed)
+        self.verticalScrollBar().valueChanged.connect(self._on_value_changed)
+
+    def _on_range_changed(self, minimum, maximum):
+        if self._pending_value is not None:
+            if maximum >= self._pending_value:
+                value, self._pending_value = self._pending_value, None
+                self.verticalScrollBar().setValue(value)
+        elif self._follow_bottom:
+            self.verticalScrollBar().setValue(maximum)
+
+    def _on_value_changed(self, value):
+        scrollbar = self.verticalScrollBar()
+        self._follow_bottom = value >= scrollbar.maximum()
+        if value <= scrollbar.minimum() < scrollbar.maximum() and self._pending_value is None:
+            self.top_reached.emit()
+
+    def prepend_messages(self, messages):
+        """
+        在顶部插入更早的记录，保持当前看到的内容不动
+        新插入行的高度由委托直接算出，滚动条相应下移
+        """
+        if not messages:
+            return
+        width = self.viewport().width()
+        added = sum(self.delegate.row_height(message, width) for message in messages)
+        scrollbar = self.verticalScrollBar()
+        if not self._follow_bottom:
+            self._pending_value = scrollbar.value() + added
+        self.model().prepend_messages(messages)
+        if self._pending_value is not None and scrollbar.maximum() >= self._pending_value:
+            self._on_range_changed(scrollbar.minimum(), scrollbar.maximum())
+
+    def set_conversation(self, model, scroll_value=0, follow_bottom=True):
+        """
+        换上另一个会话的模型并恢复它的滚动位置
+        长会话分批布局，滚动位置在内容撑到足够高时再恢复
+        """
+        old_selection_model = self.selectionModel()
+        self._pending_value = None
+        self.thumbnails.clear_pending()
+        self.setModel(model)
+        if old_selection_model is not None:
+            old_selection_model.deleteLater()
+        if follow_bottom:
+            self.scroll_to_bottom()
+        else:
+            self._follow_bottom = False
+            self._pending_value = scroll_value
+            scrollbar = self.verticalScrollBar()
+            self._on_range_changed(scrollbar.minimum(), scrollbar.maximum())
+
+    def scroll_state(self):
+        """返回 (滚动位置, 是否停在底部)，用于切回会话时恢复"""
+        if self._pending_value is not None:
+            return self._pending_value, False
+        return self.verticalScrollBar().value(), self._follow_bottom
+
+    def is_at_bottom(self):
+        scrollbar = self.verticalScrollBar()
+        return scrollbar.value() >= scrollbar.maximum()
+
+    def scroll_to_bottom(self):
+        """滚动到底部，并在布局完成前持续跟随底部"""
+        self._follow_bottom = True
+        self.scrollToBottom()
@@ -0,0 +1,362 @@
+from PyQt6.QtWidgets import QListView, QStyledItemDelegate, QStyle, QAbstractItemView
+from PyQt6.QtGui import QPainter, QColor, QFont, QPen
+from PyQt6.QtCore import Qt, QAbstractListModel, QSortFilterProxyModel, QModelIndex, QRect, QSize
+from bisect import bisect_right
+
+from models.friend import Friend
+
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:  # 可选依赖，没有时用 GB2312 一级汉字的拼音区间估算首字母
+    lazy_pinyin = None
+
+__all__ = ['FriendListModel', 'FriendFilterProxyModel', 'FriendItemDelegate', 'FriendListView', 'pinyin_initials']
+
+# GB2312 一级汉字按拼音排序，每个首字母对应一段连续的区位码
+_GB2312_INITIAL_STARTS = [
+    0xB0A1, 0xB0C5, 0xB2C1, 0xB4EE, 0xB6EA, 0xB7A2, 0xB8C1, 0xB9FE, 0xBBF7,
+    0xBFA6, 0xC0AC, 0xC2E8, 0xC4C3, 0xC5B6, 0xC5BE, 0xC6DA, 0xC8BB, 0xC8F6,
+    0xCBFA, 0xCDDA, 0xCEF4, 0xD1B9, 0xD4D1,
+]
+_GB2312_INITIALS = "abcdefghjklmnopqrstwxyz"
+_GB2312_LEVEL1_END = 0xD7F9
+
+
+def _initial_from_gb2312(char):
+    try:
+        encoded = char.encode("gb2312")
+    except UnicodeEncodeError:
+        return ""
+    if len(encoded) != 2:
+        return ""
+    code = encoded[0] << 8 | encoded[1]
+    if not _GB2312_INITIAL_STARTS[0] <= code <= _GB2312_LEVEL1_END:
+        return ""  # 二级汉字按部首排序，无法估算
+    return _GB2312_INITIALS[bisect_right(_GB2312_INITIAL_STARTS, code) - 1]
+
+
+def pinyin_initials(text):
+    """
+    汉字的拼音首字母，其他字符原样保留（小写），如 "张三abc" -> "zsabc"
+    安装了 pypinyin 时使用它，否则只能识别常用的 GB2312 一级汉字
+    """
+    if lazy_pinyin is not None:
+        return "".join(lazy_pinyin(text, style=Style.FIRST_LETTER, errors="default")).lower()
+    initials = []
+    for char in text:
+        if "\u4e00" <= char <= "\u9fff":
+            initials.append(_initial_from_gb2312(char))
+        else:
+            initials.append(char.lower())
+    return "".join(initials)
+
+
+def _search_key(friend):
+    """搜索时匹配的文本：用户名、昵称及昵称的拼音首字母"""
+    nickname = friend.nickname or ""
+    return "\n".join([
+        (friend.username or "").lower(),
+        nickname.lower(),
+        pinyin_initials(nickname or friend.username or ""),
+    ])
+
+
+def _friend_fields(friend_data):
+    """服务器好友字典 -> Friend 构造参数"""
+    return dict(
+        user_id=friend_data.get("userid"),
+        username=friend_data.get("username"),
+        nickname=friend_data.get("nickname", ""),
+        status=friend_data.get("user_status", ""),
+        ip=friend_data.get("user_ipaddr", ""),
+        port=friend_data.get("user_port", ""),
+    )
+
+
+class FriendListModel(QAbstractListModel):
+    """
+    好友列表，以 user_id 为键
+    刷新时只对新增、删除和变化的行发出通知，不重置模型，选中项和滚动位置保持不变；
+    同一好友的 Friend 对象在刷新前后保持同一个实例
+    """
+    FriendRole = Qt.ItemDataRole.UserRole + 1
+    UserIdRole = Qt.ItemDataRole.UserRole + 2
+    OnlineRole = Qt.ItemDataRole.UserRole + 3
+    SearchRole = Qt.ItemDataRole.UserRole + 4
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._friends = []
+        self._rows = {}          # user_id -> 行号
+        self._usernames = {}     # username -> user_id
+        self._search_keys = {}   # user_id -> 搜索文本，好友变化时重新计算
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._friends)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or not 0 <= index.row() < len(self._friends):
+            return None
+        friend = self._friends[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return friend.nickname or friend.username
+        if role == self.FriendRole:
+            return friend
+        if role == self.UserIdRole:
+            return friend.user_id
+        if role == self.OnlineRole:
+            return friend.online
+        if role == self.SearchRole:
+            return self._search_keys[friend.user_id]
+        return None
+
+    def friends(self):
+        return list(self._friends)
+
+    def friend_at(self, row):
+        if 0 <= row < len(self._friends):
+            return self._friends[row]
+        return None
+
+    def search_key_at(self, row):
+        """过滤时逐行调用，直接取预先算好的搜索文本，避免构造 QModelIndex"""
+        return self._search_keys[self._friends[row].user_id]
+
+    def find(self, user_id):
+        row = self._rows.get(user_id)
+        return self._friends[row] if row is not None else None
+
+    def find_by_username(self, username):
+        return self.find(self._usernames.get(username))
+
+    def index_of(self, user_id):
+        row = self._rows.get(user_id)
+        return self.index(row) if row is not None else QModelIndex()
+
+    def set_friends(self, friends):
+        """
+        用完整好友列表刷新，计算出差异后只更新变化的行
+        :param friends: 服务器返回的好友字典列表
+        """
+        new_ids = {friend.get("userid") for friend in friends}
+        removed = [user_id for user_id in self._rows if user_id not in new_ids]
+        self.apply_changes(friends, removed)
+
+    def apply_changes(self, changed, removed):
+        """
+        应用增量变化
+        :param changed: 新增或变化的好友字典列表
+        :param removed: 被删除的好友 user_id 列表
+        """
+        for user_id in removed:
+            row = self._rows.get(user_id)
+            if row is None:
+                continue
+            self.beginRemoveRows(QModelIndex(), row, row)
+            friend = self._friends.pop(row)
+            del self._rows[user_id]
+            self._unindex(friend)
+            self._reindex(row)
+            self.endRemoveRows()
+
+        added = []
+        for friend_data in changed:
+            try:
+                fields = _friend_fields(friend_data)
+            except Exception as e:
+                print(f"[错误] 好友数据字段缺失: {e}, 数据内容: {friend_data}")
+                continue
+            row = self._rows.get(fields["user_id"])
+            if row is None:
+                friend = Friend(**fields)
+                self._index(friend)
+                added.append(friend)
+            else:
+                friend = self._friends[row]
+                # 索引只依赖用户名和昵称，在线状态、地址变化时不用重建（拼音首字母计算较慢）
+                old_names = (friend.username, friend.nickname)
+                changed_row = self._update(friend, fields)
+                if changed_row and (friend.username, friend.nickname) != old_names:
+                    self._unindex_username(old_names[0], friend.user_id)
+                    self._index(friend)
+                if changed_row:
+                    index = self.index(row)
+                    self.dataChanged.emit(index, index)
+
+        if added:
+            first = len(self._friends)
+            self.beginInsertRows(QModelIndex(), first, first + len(added) - 1)
+            self._friends.extend(added)
+            self._reindex(first)
+            self.endInsertRows()
+
+    def set_online(self, user_id, online):
+        """更新在线状态，只重绘该行"""
+        row = self._rows.get(user_id)
+        if row is None or self._friends[row].online == online:
+            return
+        self._friends[row].online = online
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [self.OnlineRole])
+
+    def clear(self):
+        self.beginResetModel()
+        self._friends = []
+        self._rows = {}
+        self._usernames = {}
+        self._search_keys = {}
+        self.endResetModel()
+
+    def _index(self, friend):
+        """登记用户名和搜索文本索引"""
+        self._usernames[friend.username] = friend.user_id
+        self._search_keys[friend.user_id] = _search_key(friend)
+
+    def _unindex(self, friend):
+        self._unindex_username(friend.username, friend.user_id)
+        self._search_keys.pop(friend.user_id, None)
+
+    def _unindex_username(self, username, user_id):
+        if self._usernames.get(username) == user_id:
+            del self._usernames[username]
+
+    def _reindex(self, first):
+        """从 first 行起重新登记行号（删除的好友已由调用方移出 _rows）"""
+        for row in range(first, len(self._friends)):
+            self._rows[self._friends[row].user_id] = row
+
+    @staticmethod
+    def _update(friend, fields):
+        """原地更新 Friend，返回是否有变化"""
+        online = fields["status"] == "online"
+        new_values = {
+            "username": fields["username"],
+            "nickname": fields["nickname"],
+            "user_ipaddr": fields["ip"],
+            "user_port": fields["port"],
+            "online": online,
+        }
+        changed = any(getattr(friend, name) != value for name, value in new_values.items())
+        for name, value in new_values.items():
+            setattr(friend, name, value)
+        return changed
+
+
+class FriendFilterProxyModel(QSortFilterProxyModel):
+    """
+    按搜索框输入过滤好友：匹配用户名、昵称或拼音首字母（不区分大小写）
+    只比较模型中预先算好的搜索文本，每次按键不创建任何控件
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._query = ""
+        self.setDynamicSortFilter(True)
+
+    def set_query(self, text):
+        query = text.strip().lower()
+        if query == self._query:
+            return
+        self._query = query
+        self.invalidateFilter()
+
+    def query(self):
+        return self._query
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return not self._query or self._query in self.sourceModel().search_key_at(source_row)
+
+
+class FriendItemDelegate(QStyledItemDelegate):
+    """绘制好友列表项：在线状态圆点和昵称"""
+    ROW_HEIGHT = 50
+    DOT_SIZE = 10
+    MARGIN = 15
+    ONLINE_COLOR = QColor("#00c800")
+    OFFLINE_COLOR = QColor(Qt.GlobalColor.gray)
+    HOVER_COLOR = QColor("#e6e6e6")
+    SELECTED_COLOR = QColor("#d6d6d6")
+    BORDER_COLOR = QColor("#e0e0e0")
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont("Microsoft YaHei", 12)
+
+    def sizeHint(self, option, index):
+        return QSize(200, self.ROW_HEIGHT)
+
+    def paint(self, painter, option, index):
+        rect = option.rect
+        online = index.data(FriendListModel.OnlineRole)
+
+        painter.save()
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+
+        # 背景
+        if option.state & QStyle.StateFlag.State_Selected:
+            painter.fillRect(rect, self.SELECTED_COLOR)
+        elif option.state & QStyle.StateFlag.State_MouseOver:
+            painter.fillRect(rect, self.HOVER_COLOR)
+        painter.setPen(QPen(self.BORDER_COLOR))
+        painter.drawLine(rect.bottomLeft(), rect.bottomRight())
+
+        # 在线状态指示器
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(self.ONLINE_COLOR if online else self.OFFLINE_COLOR)
+        dot_y = rect.top() + (rect.height() - self.DOT_SIZE) // 2
+        painter.drawEllipse(rect.left() + self.MARGIN, dot_y, self.DOT_SIZE, self.DOT_SIZE)
+
+        # 昵称
+        text_left = rect.left() + self.MARGIN + self.DOT_SIZE + 10
+        text_rect = QRect(text_left, rect.top(), rect.right() - text_left - self.MARGIN, rect.height())
+        painter.setFont(self.font)
+        painter.setPen(QColor(Qt.GlobalColor.black) if online else self.OFFLINE_COLOR)
+        name = painter.fontMetrics().elidedText(
+            index.data(Qt.ItemDataRole.DisplayRole) or "", Qt.TextElideMode.ElideRight, text_rect.width()
+        )
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, name)
+        painter.restore()
+
+
+class FriendListView(QListView):
+    """好友列表视图，所有行等高，只绘制可见行"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setStyleSheet("""
+            QListView {
+                border: none;
+                background: #f5f5f5;
+                font-family: Microsoft YaHei;
+            }
+        """)
+        self.setUniformItemSizes(True)
+        self.setMouseTracking(True)  # 悬停高亮
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setItemDelegate(FriendItemDelegate(self))
+
+
+if __name__ == "__main__":
+    import sys
+    from PyQt6.QtWidgets import QApplication
+
+    app = QApplication(sys.argv)
+
+    def friend(user_id, name):
+        return {"userid": user_id, "username": name, "nickname": "", "user_status": "offline",
+                "user_ipaddr": "", "user_port": ""}
+
+    model = FriendListModel()
+    a, b, c = friend(1, "a"), friend(2, "b"), friend(3, "c")
+    model.set_friends([a, b, c])
+    # 删除好友后行号索引中不能留下它，重复刷新同样的列表不能误删其他好友
+    model.set_friends([b, c])
+    assert model._rows == {2: 0, 3: 1}, model._rows
+    assert model.find(1) is None and model.find_by_username("a") is None
+    model.set_friends([b, c])
+    assert [f.username for f in model.friends()] == ["b", "c"]
+    model.apply_changes([a], [3])
+    assert [f.username for f in model.friends()] == ["b", "a"] and model._rows == {2: 0, 1: 1}, model._rows
+    print("✅ 好友列表增量更新测试通过！")
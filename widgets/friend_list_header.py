@@ -1,4 +1,4 @@
-from PyQt6.QtWidgets import (QWidget, QHBoxLayout, QPushButton, QSizePolicy, QSpacerItem)
+from PyQt6.QtWidgets import (QWidget, QHBoxLayout, QPushButton, QLineEdit)
 from PyQt6.QtCore import Qt, pyqtSignal, QSize
 from PyQt6.QtGui import QIcon
 from widgets.avatar_label import AvatarLabel
@@ -11,6 +11,7 @@ class FriendListHeader(QWidget):
     need_update_friends = pyqtSignal()  # 需要更新好友列表信号
     avatar_clicked = pyqtSignal(str)    # 头像点击信号
     add_button_clicked = pyqtSignal()   # 添加按钮点击信号
+    search_changed = pyqtSignal(str)    # 搜索框内容变化信号
     
     def __init__(self, username, parent=None):
         super().__init__(parent)
@@ -37,8 +38,21 @@ class FriendListHeader(QWidget):
         self.avatar.clicked.connect(self.handle_avatar_click)
         layout.addWidget(self.avatar)
         
-        # 添加水平弹簧
-        layout.addSpacerItem(QSpacerItem(0, 0, QSizePolicy.Policy.Expanding, QSizePolicy.Policy.Minimum))
+        # 搜索框：按用户名、昵称或拼音首字母过滤好友
+        self.search_box = QLineEdit()
+        self.search_box.setPlaceholderText("搜索")
+        self.search_box.setClearButtonEnabled(True)
+        self.search_box.setStyleSheet("""
+            QLineEdit {
+                border: none;
+                background: #e6e6e6;
+                border-radius: 15px;
+                padding: 5px 10px;
+                font-family: Microsoft YaHei;
+            }
+        """)
+        self.search_box.textChanged.connect(self.search_changed)
+        layout.addWidget(self.search_box)
         
         # 创建加号按钮
         self.add_button = QPushButton()
@@ -87,5 +101,8 @@ class FriendListHeader(QWidget):
         """处理好友删除事件，触发更新好友列表信号"""
         self.need_update_friends.emit()
 
+    def clear_search(self):
+        self.search_box.clear()
+
     def set_nickname(self, nickname):
         self.nickname_label.setText(nickname)
\ No newline at end of file
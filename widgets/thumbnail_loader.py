@@ -0,0 +1,79 @@
+from collections import OrderedDict
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QImage, QPixmap
+
+from panel.attachments import AttachmentStore
+
+
+class _ThumbnailSignals(QObject):
+    loaded = pyqtSignal(str, int, QImage)  # 摘要, 尺寸, 缩略图（失败时为空图）
+
+
+class _ThumbnailTask(QRunnable):
+    """在线程池中生成缩略图文件并读入 QImage（QPixmap 只能在 GUI 线程中创建）"""
+
+    def __init__(self, sha256, size, signals):
+        super().__init__()
+        self.sha256 = sha256
+        self.size = size
+        self.signals = signals
+
+    def run(self):
+        try:
+            image = QImage(AttachmentStore().thumbnail(self.sha256, self.size))
+        except Exception as e:
+            print(f"[Thumbnail] Failed to load {self.sha256[:12]}: {e}")
+            image = QImage()
+        self.signals.loaded.emit(self.sha256, self.size, image)
+
+
+class ThumbnailLoader(QObject):
+    """
+    附件图片缩略图的懒加载
+    get() 只返回已缓存的 QPixmap；没有时在后台线程生成，完成后发出 thumbnail_ready，
+    由视图重绘。委托只在绘制可见行时调用 get()，滚动经过的图片才会被加载
+    """
+    thumbnail_ready = pyqtSignal(str)  # 摘要
+    CACHE_SIZE = 200
+
+    def __init__(self, parent=None, max_threads=2):
+        super().__init__(parent)
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(max_threads)
+        self._signals = _ThumbnailSignals(self)
+        self._signals.loaded.connect(self._on_loaded)
+        self._cache = OrderedDict()  # (摘要, 尺寸) -> QPixmap
+        self._pending = set()
+        self._failed = set()
+
+    def get(self, sha256, size):
+        """
+        :param size: 缩略图最长边，物理像素
+        :return: QPixmap；尚未生成时返回 None 并开始后台加载
+        """
+        key = (sha256, size)
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self._cache.move_to_end(key)
+            return pixmap
+        if key not in self._pending and key not in self._failed:
+            self._pending.add(key)
+            self._pool.start(_ThumbnailTask(sha256, size, self._signals))
+        return None
+
+    def _on_loaded(self, sha256, size, image):
+        key = (sha256, size)
+        self._pending.discard(key)
+        if image.isNull():
+            self._failed.add(key)  # 文件不在本地或不是图片，不再重试
+            return
+        self._cache[key] = QPixmap.fromImage(image)
+        if len(self._cache) > self.CACHE_SIZE:
+            self._cache.popitem(last=False)
+        self.thumbnail_ready.emit(sha256)
+
+    def clear_pending(self):
+        """丢弃尚未开始的加载任务（例如切换会话后）"""
+        self._pool.clear()
+        self._pending.clear()